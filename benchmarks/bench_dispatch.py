@@ -0,0 +1,146 @@
+#!/bin/env/python3
+
+"""
+Per-update dispatch cost for each chat kind: routers guarded by chat
+filters vs the chat kind looked up once by `ChatKindMiddleware`.
+
+The routers mirror the bot's: the same number of message handlers, with
+the chain version guarded by the chat filters the routers used to have.
+
+    python benchmarks/bench_dispatch.py [updates]
+"""
+
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import logging
+
+from aiogram import F, Router
+from aiogram.enums import ChatType
+from aiogram.filters import BaseFilter
+from aiogram.types import Chat, Message
+
+from telegram_communa_bot.bot.routing import (
+    ADMIN,
+    GROUP,
+    LOBBY,
+    PRIVATE,
+    ChatKindFilter,
+    ChatKindMiddleware,
+    ChatKinds,
+)
+
+logging.disable(logging.CRITICAL)
+
+LOBBY_ID = -100
+ADMIN_ID = 1
+
+HANDLERS = {
+    "admin": ["/help", "/lobby", "/status", "/forget"],
+    "lobby": [
+        "/start",
+        "/whitelist",
+        "/blacklist",
+        "/waitlist",
+        "/allow",
+        "/block",
+        "/forget",
+        "/help",
+    ],
+    "private": ["/start", None],
+    "public": ["/start"],
+    "default": [None],
+}
+
+MESSAGES = {
+    "admin": (ADMIN_ID, ChatType.PRIVATE, "/status"),
+    "lobby": (LOBBY_ID, ChatType.SUPERGROUP, "/waitlist"),
+    "private": (5, ChatType.PRIVATE, "hello"),
+    "group": (-200, ChatType.GROUP, "/start"),
+}
+
+
+class IdFilter(BaseFilter):
+    def __init__(self, chat_id: int):
+        self.chat_id: int = chat_id
+
+    async def __call__(self, message: Message) -> bool:
+        return message.chat.id == self.chat_id
+
+
+def routers(filtered: bool) -> dict[str, Router]:
+    result: dict[str, Router] = {}
+    for name, commands in HANDLERS.items():
+        router = Router(name=name)
+        for command in commands:
+            flt = F.text == command if command else F.text
+
+            @router.message(flt)
+            async def handle(_: Message):
+                return True
+
+        result[name] = router
+
+    if filtered:
+        _ = result["admin"].message.filter(IdFilter(ADMIN_ID))
+        _ = result["lobby"].message.filter(IdFilter(LOBBY_ID))
+        _ = result["private"].message.filter(F.chat.type == ChatType.PRIVATE)
+        _ = result["public"].message.filter(
+            F.chat.type.in_({ChatType.GROUP, ChatType.SUPERGROUP})
+        )
+    return result
+
+
+def chain() -> Router:
+    root = Router(name="root")
+    _ = root.include_routers(*routers(filtered=True).values())
+    return root
+
+
+def table() -> Router:
+    r = routers(filtered=False)
+    _ = r["admin"].message.filter(ChatKindFilter(ADMIN))
+    _ = r["lobby"].message.filter(ChatKindFilter(LOBBY))
+    _ = r["private"].message.filter(ChatKindFilter(ADMIN, PRIVATE))
+    _ = r["public"].message.filter(ChatKindFilter(LOBBY, GROUP))
+    root = Router(name="root")
+    # on the update observer in the bot, where `event_chat` is known already
+    kinds = ChatKinds(lambda: LOBBY_ID, lambda: ADMIN_ID)
+    _ = root.message.outer_middleware(ChatKindMiddleware(kinds))
+    _ = root.include_routers(*r.values())
+    return root
+
+
+async def bench(root: Router, msg: Message, updates: int) -> float:
+    start = time.perf_counter()
+    for _ in range(updates):
+        _ = await root.propagate_event(update_type="message", event=msg, event_chat=msg.chat)
+    return (time.perf_counter() - start) / updates
+
+
+async def main():
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    old, new = chain(), table()
+
+    print(f"{'chat':<8} {'chain, us':>10} {'table, us':>10} {'speedup':>8}")
+    for kind, (chat_id, chat_type, text) in MESSAGES.items():
+        msg = Message(
+            message_id=1,
+            date=datetime.now(),
+            chat=Chat(id=chat_id, type=chat_type),
+            text=text,
+        )
+        before = await bench(old, msg, updates)
+        after = await bench(new, msg, updates)
+        print(
+            f"{kind:<8} {before * 1e6:>10.1f} {after * 1e6:>10.1f} {before / after:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+#!/bin/env/python3
+
+"""
+Flood control with many distinct senders: cost of one check and memory
+per tracked sender. Senders come round-robin, so every one of them is
+tracked at once; a simulated clock makes the first senders idle by the
+end of a second round, which then frees and reuses their slots.
+
+    python benchmarks/bench_flood.py [senders]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from telegram_communa_bot.bot.flood import FloodControl
+
+REPEAT = 3
+
+
+class Clock:
+    def __init__(self):
+        self.now: float = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def rounds(senders: int, trace: bool) -> tuple[float, float, int]:
+    """Seconds per check, bytes per tracked sender, senders tracked at the end"""
+    clock = Clock()
+    fc = FloodControl(rate=0.5, burst=20, mute=300, block_after=3, max_users=1 << 20, clock=clock)
+    # the whole round fits in the idle time, the second one comes after it
+    step = fc.idle / senders
+
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    for user_id in range(senders):
+        clock.now += step
+        _ = fc.check(user_id)
+    elapsed = time.perf_counter() - start
+    memory = 0
+    if trace:
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    for user_id in range(senders, 2 * senders):
+        clock.now += step
+        _ = fc.check(user_id)
+    return elapsed / senders, memory / senders, len(fc)
+
+
+def main():
+    senders = int(sys.argv[1]) if len(sys.argv) > 1 else 300_000
+    check = float("inf")
+    tracked = 0
+    for _ in range(REPEAT):
+        seconds, _, tracked = rounds(senders, trace=False)
+        check = min(check, seconds)
+    _, per_sender, _ = rounds(senders, trace=True)
+
+    print(f"{'senders':<28} {senders:>10}")
+    print(f"{'check, us':<28} {check * 1e6:>10.2f}")
+    print(f"{'bytes per tracked sender':<28} {per_sender:>10.0f}")
+    print(f"{'tracked after 2nd round':<28} {tracked:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/bin/env/python3
+
+"""
+Cost of one membership change: full JSON rewrite vs journal append.
+
+    python benchmarks/bench_journal.py [sizes...]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1234567890:bench")
+os.environ.setdefault("BOT_ADMIN", "1")
+os.environ["BOT_DATA_PATH"] = tempfile.mkdtemp(prefix="bench_journal_")
+# keep compaction out of the measurement
+os.environ["BOT_JOURNAL_COMPACT_SIZE"] = str(1 << 40)
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import logging
+
+from telegram_communa_bot.bot.app_data import UsersLists
+from telegram_communa_bot.settings import reset_settings
+
+logging.disable(logging.CRITICAL)
+
+REPEAT = 20
+
+
+def bench(storage: str, size: int) -> float:
+    os.environ["BOT_STORAGE"] = storage
+    # settings are parsed once
+    reset_settings()
+
+    ul = UsersLists(white_list=set(range(size)))
+    ul.save()
+
+    start = time.perf_counter()
+    for i in range(REPEAT):
+        ul.block(size + i)
+        ul.save()
+    return (time.perf_counter() - start) / REPEAT
+
+
+def main():
+    sizes = [int(x) for x in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+
+    print(f"{'ids':>10} {'json, ms':>12} {'journal, ms':>12} {'speedup':>8}")
+    for size in sizes:
+        full = bench("json", size)
+        journal = bench("journal", size)
+        print(
+            f"{size:>10} {full * 1000:>12.3f} {journal * 1000:>12.3f} {full / journal:>7.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/bin/env/python3
+
+"""
+Logging overhead per update as seen by the event loop.
+
+"before" is the old setup: every module at DEBUG, a synchronous stream
+handler and both router filters logging at INFO on each update. "after"
+is the queue-based setup at the default INFO level, with the filters
+logging through `RateLimitedLog`.
+
+    python benchmarks/bench_logging.py [updates]
+"""
+
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from telegram_communa_bot.logging_setup import RateLimitedLog
+
+FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+def sync_logger(stream) -> logging.Logger:
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(FORMAT))
+    logger = logging.getLogger("bench.before")
+    logger.handlers = [handler]
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    return logger
+
+
+def queued_logger(
+    stream, level: int
+) -> tuple[logging.Logger, logging.handlers.QueueListener]:
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(FORMAT))
+    q: queue.Queue[logging.LogRecord] = queue.Queue()
+    listener = logging.handlers.QueueListener(q, handler)
+    listener.start()
+
+    logger = logging.getLogger(f"bench.after.{level}")
+    logger.handlers = [logging.handlers.QueueHandler(q)]
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger, listener
+
+
+def before(logger: logging.Logger, updates: int) -> float:
+    start = time.perf_counter()
+    for i in range(updates):
+        logger.info("router_admin: message.chat.id=%s, app_data.admin_id=%s", i, 1)
+        logger.info("message.chat.id=%s, app_data.chat_id=%s", i, -100)
+    return (time.perf_counter() - start) / updates
+
+
+def after(logger: logging.Logger, updates: int) -> float:
+    admin = RateLimitedLog(logger)
+    lobby = RateLimitedLog(logger)
+    start = time.perf_counter()
+    for i in range(updates):
+        admin("router_admin: message.chat.id=%s, app_data.admin_id=%s", i, 1)
+        lobby("message.chat.id=%s, app_data.chat_id=%s", i, -100)
+    return (time.perf_counter() - start) / updates
+
+
+def main():
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    with tempfile.TemporaryFile("w") as stream:
+        results = [("before: sync, DEBUG", before(sync_logger(stream), updates))]
+
+        for name, level in (
+            ("after: queue, INFO", logging.INFO),
+            ("after: queue, DEBUG", logging.DEBUG),
+        ):
+            logger, listener = queued_logger(stream, level)
+            results.append((name, after(logger, updates)))
+            listener.stop()
+
+    base = results[0][1]
+    print(f"{'setup':<22} {'us/update':>10} {'speedup':>8}")
+    for name, seconds in results:
+        print(f"{name:<22} {seconds * 1e6:>10.2f} {base / seconds:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
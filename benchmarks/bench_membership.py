@@ -0,0 +1,95 @@
+#!/bin/env/python3
+
+"""
+White, black and wait lists as three sets vs one `Membership`: memory
+per id, `UsersLists` load time from an inline JSON snapshot and from the
+mapped binary one, and the cost of an `in` check. The int objects are
+shared with the input lists, so the sets column counts the sets only.
+
+    python benchmarks/bench_membership.py [ids]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1234567890:bench")
+os.environ.setdefault("BOT_ADMIN", "1")
+os.environ["BOT_DATA_PATH"] = tempfile.mkdtemp(prefix="bench_membership_")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import logging
+
+from telegram_communa_bot.bot.app_data import UsersLists
+from telegram_communa_bot.membership import Membership
+from telegram_communa_bot.storage import JsonStorage
+
+logging.disable(logging.CRITICAL)
+
+REPEAT = 3
+LOOKUPS = 200_000
+
+
+def lists(size: int) -> list[list[int]]:
+    """Telegram-like ids: 70% white, 20% wait, 10% black"""
+    ids = random.Random(22).sample(range(1 << 33), size)
+    white, wait = size * 7 // 10, size * 9 // 10
+    return [ids[:white], ids[wait:], ids[white:wait]]
+
+
+def memory(build) -> float:
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    data = build()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return after - before
+
+
+def load(binary: bool, ul: UsersLists) -> float:
+    backend = JsonStorage(journal=False, compact_size=1 << 40, binary_members=binary)
+    backend.write_job(ul, [], full=True)()
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        _ = backend.load(UsersLists)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def lookup(container, probes: list[int]) -> float:
+    start = time.perf_counter()
+    for x in probes:
+        _ = x in container
+    return (time.perf_counter() - start) / len(probes)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    white, black, wait = lists(size)
+
+    sets = memory(lambda: [set(white), set(black), set(wait)])
+    compact = memory(lambda: Membership.from_sets([white, black, wait]))
+
+    ul = UsersLists(white_list=set(white), black_list=set(black), wait_list=set(wait))
+    json_load = load(False, ul)
+    mapped_load = load(True, ul)
+
+    probes = random.Random(1).sample(white, min(LOOKUPS, len(white)))
+    set_lookup = lookup(set(white), probes)
+    view_lookup = lookup(ul.white_list, probes)
+
+    print(f"{'ids':<24} {size:>12}")
+    print(f"{'':<24} {'sets':>12} {'membership':>12}")
+    print(f"{'bytes per id':<24} {sets / size:>12.1f} {compact / size:>12.1f}")
+    print(f"{'load, ms':<24} {json_load * 1000:>12.1f} {mapped_load * 1000:>12.1f}")
+    print(f"{'in, us':<24} {set_lookup * 1e6:>12.3f} {view_lookup * 1e6:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
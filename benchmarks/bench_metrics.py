@@ -0,0 +1,122 @@
+#!/bin/env/python3
+
+"""
+Cost of metrics collection per update: the same dispatcher with and
+without the metrics middlewares, the metrics middlewares alone around a
+no-op handler, and the raw cost of one recording. Runs are interleaved
+and the best of `REPEAT` is reported, dispatch timings are noisy.
+
+    python benchmarks/bench_metrics.py [updates]
+"""
+
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import logging
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Chat, Message, Update
+
+from telegram_communa_bot.bot.instrumentation import (
+    HandlerMetricsMiddleware,
+    UpdateMetricsMiddleware,
+    instrument_dispatcher,
+)
+from telegram_communa_bot.metrics import Histogram, registry
+
+logging.disable(logging.CRITICAL)
+
+REPEAT = 5
+
+
+def dispatcher(instrumented: bool) -> Dispatcher:
+    router = Router(name="bench")
+
+    @router.message()
+    async def handle(_: Message):
+        return True
+
+    dp = Dispatcher()
+    if instrumented:
+        instrument_dispatcher(dp)
+    _ = dp.include_router(router)
+    return dp
+
+
+UPDATE = Update(
+    update_id=1,
+    message=Message(
+        message_id=1,
+        date=datetime.now(),
+        chat=Chat(id=5, type="private"),
+        text="hello",
+    ),
+)
+
+
+async def bench(dp: Dispatcher, bot: Bot, updates: int) -> float:
+    update = UPDATE
+    start = time.perf_counter()
+    for _ in range(updates):
+        _ = await dp.feed_update(bot, update)
+    return (time.perf_counter() - start) / updates
+
+
+async def bench_middlewares(updates: int) -> float:
+    outer, inner = UpdateMetricsMiddleware(), HandlerMetricsMiddleware()
+    router = Router(name="bench")
+
+    async def handler(_, __):
+        return True
+
+    async def handle_update(event, data):
+        data = {**data, "event_router": router, "handler": None}
+        return await inner(handler, event.message, data)
+
+    start = time.perf_counter()
+    for _ in range(updates):
+        _ = await outer(handle_update, UPDATE, {})
+    return (time.perf_counter() - start) / updates
+
+
+def bench_observe(count: int) -> float:
+    histogram = Histogram("bench_seconds", "bench", ("router", "handler"))
+    start = time.perf_counter()
+    for i in range(count):
+        histogram.observe(i * 1e-5, "lobby", "cmd_allow")
+    return (time.perf_counter() - start) / count
+
+
+async def main():
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    bot = Bot("42:bench")
+
+    plain_dp, instrumented_dp = dispatcher(False), dispatcher(True)
+
+    plain = instrumented = middlewares = observe = float("inf")
+    for _ in range(REPEAT):
+        plain = min(plain, await bench(plain_dp, bot, updates))
+        instrumented = min(instrumented, await bench(instrumented_dp, bot, updates))
+        middlewares = min(middlewares, await bench_middlewares(updates))
+        observe = min(observe, bench_observe(updates))
+    start = time.perf_counter()
+    _ = registry.render()
+    render = time.perf_counter() - start
+
+    print(f"{'':<24} {'us':>8}")
+    print(f"{'update, plain':<24} {plain * 1e6:>8.2f}")
+    print(f"{'update, instrumented':<24} {instrumented * 1e6:>8.2f}")
+    print(f"{'overhead per update':<24} {(instrumented - plain) * 1e6:>8.2f}")
+    print(f"{'metrics middlewares':<24} {middlewares * 1e6:>8.2f}")
+    print(f"{'histogram observe':<24} {observe * 1e6:>8.3f}")
+    print(f"{'/metrics render':<24} {render * 1e6:>8.0f}")
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
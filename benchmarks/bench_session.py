@@ -0,0 +1,78 @@
+#!/bin/env/python3
+
+"""
+Bot API calls through aiogram's default session and through
+`TunedSession`, against the fake Bot API in the same process: calls per
+second at a few concurrency levels and the connections each opened.
+
+    python benchmarks/bench_session.py [calls]
+"""
+
+import asyncio
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import logging
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.base import BaseSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+from fake_api import FakeBotAPI, Faults, Mix
+from telegram_communa_bot.bot.session import TunedSession
+from telegram_communa_bot.metrics import API_CONNECTIONS
+
+logging.disable(logging.CRITICAL)
+
+CONCURRENCY = (1, 10, 100)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def bench(session: BaseSession, calls: int, concurrency: int) -> float:
+    bot = Bot("42:bench", session=session)
+    _ = await bot.get_me()
+
+    async def client(count: int):
+        for _ in range(count):
+            _ = await bot.send_message(chat_id=1, text="hi")
+
+    start = time.perf_counter()
+    _ = await asyncio.gather(*(client(calls // concurrency) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    await bot.session.close()
+    return calls / elapsed
+
+
+async def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    api = FakeBotAPI(users=1, faults=Faults(), mix=Mix())
+    port = free_port()
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    server = TelegramAPIServer.from_base(f"http://127.0.0.1:{port}")
+
+    print(f"{'concurrency':<12} {'default/s':>10} {'tuned/s':>10} {'connections':>12}")
+    for concurrency in CONCURRENCY:
+        default = await bench(AiohttpSession(api=server), calls, concurrency)
+        created = API_CONNECTIONS.get("created")
+        tuned = await bench(TunedSession(api=server), calls, concurrency)
+        opened = API_CONNECTIONS.get("created") - created
+        print(f"{concurrency:<12} {default:>10.0f} {tuned:>10.0f} {opened:>12.0f}")
+
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
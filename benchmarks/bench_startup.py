@@ -0,0 +1,99 @@
+#!/bin/env/python3
+
+"""
+Cold start of the bot: import time of the package, and time from
+starting the process to the first update handled, against the fake Bot
+API. The bot is started twice on the same data: the first start
+resolves the `@admin` username with `getChat` before it polls, the
+second reuses the id saved by the first and checks it in the background.
+
+    python benchmarks/bench_startup.py
+"""
+
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from aiohttp import web
+
+from fake_api import FakeBotAPI, Faults, Mix
+from load_test import SRC, free_port, prepare_data
+
+REPEAT = 3
+IMPORT = (
+    "import time; start = time.perf_counter(); "
+    "import telegram_communa_bot.main; print(time.perf_counter() - start)"
+)
+
+
+def environment(data_path: Path, port: int) -> dict[str, str]:
+    return {
+        **os.environ,
+        "PYTHONPATH": str(SRC),
+        "TELEGRAM_BOT_TOKEN": "42:startup",
+        "BOT_ADMIN": "@admin",
+        "BOT_DATA_PATH": str(data_path),
+        "BOT_API_URL": f"http://127.0.0.1:{port}",
+        "BOT_LOG_LEVEL": "WARNING",
+        "BOT_LOG_AIOGRAM_LEVEL": "WARNING",
+    }
+
+
+def import_time(env: dict[str, str]) -> float:
+    best = float("inf")
+    for _ in range(REPEAT):
+        out = subprocess.run(
+            [sys.executable, "-c", IMPORT], env=env, capture_output=True, text=True
+        )
+        best = min(best, float(out.stdout))
+    return best
+
+
+async def first_update(data_path: Path) -> tuple[float, int]:
+    """Seconds from starting the bot to the first update handled, getChat calls"""
+    api = FakeBotAPI(users=1, faults=Faults(), mix=Mix(1, 0, 0, 0))
+    api.generate_one()
+    port = free_port()
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+
+    start = time.perf_counter()
+    bot = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-c",
+        "from telegram_communa_bot.main import main; main()",
+        env=environment(data_path, port),
+    )
+    try:
+        while not api.stats.completed:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+    finally:
+        bot.send_signal(signal.SIGTERM)
+        _ = await bot.wait()
+        await runner.cleanup()
+    return elapsed, api.stats.calls["getChat"]
+
+
+async def main():
+    data_path = Path(tempfile.mkdtemp(prefix="bench_startup_"))
+    prepare_data(data_path, [1000])
+
+    imported = import_time(environment(data_path, 0))
+    first, first_calls = await first_update(data_path)
+    cached, cached_calls = await first_update(data_path)
+
+    print(f"{'':<28} {'s':>8} {'getChat':>8}")
+    print(f"{'import telegram_communa_bot':<28} {imported:>8.2f}")
+    print(f"{'first update, first start':<28} {first:>8.2f} {first_calls:>8}")
+    print(f"{'first update, admin cached':<28} {cached:>8.2f} {cached_calls:>8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
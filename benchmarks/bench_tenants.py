@@ -0,0 +1,133 @@
+#!/bin/env/python3
+
+"""
+Many tenants in one process: memory of an idle tenant (known, nothing
+loaded) and of a loaded one, and the cost `TenantMiddleware` adds to an
+update, when the tenants fit in memory and when most updates load one.
+At most `BOT_TENANTS_LOADED` tenants are loaded at once, with
+`BOT_STORAGE=sqlite` each of them keeps its database open.
+
+    python benchmarks/bench_tenants.py [tenants]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from random import Random
+from types import SimpleNamespace
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1234567890:bench")
+os.environ.setdefault("BOT_ADMIN", "1")
+os.environ["BOT_DATA_PATH"] = tempfile.mkdtemp(prefix="bench_tenants_")
+os.environ["BOT_TENANTS"] = "1"
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import asyncio
+import logging
+from pathlib import Path
+
+from aiogram.types import Chat, Message, Update, User
+
+from telegram_communa_bot.bot import tenants as tenants_module
+from telegram_communa_bot.bot.app_data import app_data, users_lists
+from telegram_communa_bot.bot.tenants import TenantMiddleware, Tenants
+from telegram_communa_bot.persistent import using_tenant
+from telegram_communa_bot.settings import settings
+
+logging.disable(logging.CRITICAL)
+
+UPDATES = 10_000
+
+
+def setup(size: int) -> None:
+    """Lobbies with a few users each, written to disk"""
+    registry = Tenants(Path(os.environ["BOT_DATA_PATH"]), max_loaded=size)
+    for i in range(size):
+        chat_id = -1000 - i
+        tenant = registry.tenant(str(chat_id))
+        registry.add_lobby(chat_id, tenant)
+        with using_tenant(tenant):
+            app_data().set_field("chat_id", chat_id)
+            app_data().save()
+            for user_id in range(10):
+                users_lists().allow(user_id)
+            users_lists().save()
+        tenant.unload()
+
+
+def memory(size: int, max_loaded: int) -> tuple[float, float]:
+    """Bytes per idle and per loaded tenant"""
+    tracemalloc.start()
+    registry = Tenants(Path(os.environ["BOT_DATA_PATH"]), max_loaded=max_loaded)
+    tenants = [registry.resolve(0, Chat(id=-1000 - i, type="supergroup"), None) for i in range(size)]
+    idle, _ = tracemalloc.get_traced_memory()
+
+    for tenant in tenants[:max_loaded]:
+        assert tenant
+        with using_tenant(tenant):
+            _ = app_data(), users_lists()
+    loaded, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    for tenant in tenants[:max_loaded]:
+        assert tenant
+        tenant.unload()
+    return idle / size, (loaded - idle) / max_loaded
+
+
+async def route(size: int, max_loaded: int) -> float:
+    """Seconds per update added by the middleware"""
+    registry = Tenants(Path(os.environ["BOT_DATA_PATH"]), max_loaded=max_loaded)
+    tenants_module._tenants = registry
+    middleware = TenantMiddleware()
+    user = User(id=1, is_bot=False, first_name="u")
+
+    def event(i: int) -> tuple[Update, dict[str, object]]:
+        chat = Chat(id=-1000 - i, type="supergroup")
+        message = Message(message_id=1, date=datetime.now(), chat=chat, from_user=user, text="hi")
+        data = {"bot": SimpleNamespace(id=1), "event_chat": chat, "event_from_user": user}
+        return Update(update_id=1, message=message), data
+
+    rng = Random(23)
+    events = [event(rng.randrange(size)) for _ in range(UPDATES)]
+
+    async def handler(event, data):
+        return app_data().chat_id
+
+    start = time.perf_counter()
+    for update, data in events:
+        _ = await handler(update, data)
+    direct = time.perf_counter() - start
+
+    # loads everything once when it fits
+    for i in range(size):
+        _ = await middleware(handler, *event(i))
+    start = time.perf_counter()
+    for update, data in events:
+        _ = await middleware(handler, update, data)
+    routed = time.perf_counter() - start
+    return (routed - direct) / UPDATES
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    max_loaded = min(size, settings().tenants_loaded)
+    setup(size)
+    idle, loaded = memory(size, max_loaded)
+    # all the routed tenants fit
+    resident = asyncio.run(route(max_loaded, max_loaded))
+    churn = asyncio.run(route(size, max(1, min(max_loaded, size // 10))))
+
+    print(f"{'tenants':<32} {size:>10}")
+    print(f"{'loaded at most':<32} {max_loaded:>10}")
+    print(f"{'bytes per idle tenant':<32} {idle:>10.0f}")
+    print(f"{'bytes per loaded tenant':<32} {loaded:>10.0f}")
+    print(f"{'routing, all loaded, us':<32} {resident * 1e6:>10.2f}")
+    print(f"{'routing, <=10% loaded, us':<32} {churn * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+#!/bin/env/python3
+
+"""
+Throughput and latency of the worker pool: the load test with 1, 2 and
+4 worker processes at the same rate. Workers only help with more than
+one CPU, `nproc` is printed with the table.
+
+    python benchmarks/bench_workers.py [rate] [duration]
+"""
+
+import asyncio
+import os
+import sys
+
+from load_test import arguments, run
+
+WORKERS = (1, 2, 4)
+
+
+def main():
+    rate = sys.argv[1] if len(sys.argv) > 1 else "400"
+    duration = sys.argv[2] if len(sys.argv) > 2 else "10"
+
+    results = {}
+    for workers in WORKERS:
+        args = arguments().parse_args(
+            ["--rate", rate, "--duration", duration, "--workers", str(workers)]
+        )
+        results[workers] = asyncio.run(run(args))
+
+    print(f"rate {rate}/s for {duration}s, {os.cpu_count()} CPUs")
+    print(
+        f"{'workers':<8} {'updates/s':>10} {'p50 ms':>8} {'p99 ms':>8} "
+        f"{'lost':>6} {'RSS MB':>8}"
+    )
+    for workers, result in results.items():
+        print(
+            f"{workers:<8} {result['throughput']:>10.1f} {result['p50']:>8.1f} "
+            f"{result['p99']:>8.1f} {result['outstanding']:>6} {result['loaded_mb']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
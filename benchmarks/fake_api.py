@@ -0,0 +1,364 @@
+#!/bin/env/python3
+
+"""
+In-process fake of the Telegram Bot API for load tests.
+
+`getUpdates` is served from a synthetic traffic generator: private
+messages of whitelisted users, albums, replies in the lobby and list page
+clicks. The methods the bot calls are answered with configurable latency,
+and sends can fail with 429 or 5xx at a given rate.
+
+Every generated update knows the API call that completes it: a forward
+of the message to the lobby or back to the user, or the answer to the
+callback query. The time from handing the update out in `getUpdates` to
+that call is the update's end-to-end latency.
+"""
+
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Any
+
+from aiohttp import web
+
+BOT_ID = 42
+ADMIN_ID = 1
+LOBBY_ID = -1001000000001
+MEMBER_ID = 7
+FIRST_USER_ID = 1000
+# lobby messages get replies this long after the bot posted them, people
+# don't answer within milliseconds and the bot records senders after the call
+REPLY_DELAY = 5.0
+
+# methods that can be failed on purpose, like Telegram paces sends
+FAULTY_PREFIXES = ("send", "forward", "copy", "edit")
+
+Key = tuple[Any, ...]
+
+PHOTO = {"file_id": "f", "file_unique_id": "u", "width": 1, "height": 1}
+
+
+@dataclass
+class Faults:
+    latency: float = 0.0
+    jitter: float = 0.0
+    rate_429: float = 0.0
+    rate_5xx: float = 0.0
+    retry_after: int = 1
+
+
+@dataclass
+class Mix:
+    """Relative weights of generated update kinds"""
+
+    private: float = 0.6
+    album: float = 0.1
+    reply: float = 0.2
+    callback: float = 0.1
+
+
+@dataclass
+class Stats:
+    generated: int = 0
+    delivered: int = 0
+    completed: int = 0
+    injected_429: int = 0
+    injected_5xx: int = 0
+    calls: Counter[str] = field(default_factory=Counter)
+    latencies: list[float] = field(default_factory=list)
+    first_delivery: float = 0.0
+    last_completion: float = 0.0
+
+
+class FakeBotAPI:
+    def __init__(self, users: int, faults: Faults, mix: Mix, seed: int = 0):
+        self.users: list[int] = list(range(FIRST_USER_ID, FIRST_USER_ID + users))
+        self.faults: Faults = faults
+        self.mix: Mix = mix
+        self.stats: Stats = Stats()
+        self.polled: asyncio.Event = asyncio.Event()
+
+        self._random: random.Random = random.Random(seed)
+        self._update_ids: itertools.count[int] = itertools.count(1)
+        self._updates: deque[tuple[dict[str, Any], list[Key]]] = deque()
+        self._has_updates: asyncio.Event = asyncio.Event()
+        # completion key -> time the update was handed out, None until then
+        self._waiting: dict[Key, float | None] = {}
+        self._message_ids: dict[int, itertools.count[int]] = {}
+        self._lobby_messages: deque[int] = deque(maxlen=1000)
+        self._posted: deque[tuple[float, int]] = deque()
+        self._callback_ids: itertools.count[int] = itertools.count(1)
+
+    @property
+    def outstanding(self) -> int:
+        return len(self._waiting)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        _ = app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        return app
+
+    # Bot API
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params: dict[str, Any] = dict(await request.post()) or dict(request.query)
+        self.stats.calls[method] += 1
+
+        if method == "getUpdates":
+            return _ok(await self._get_updates(params))
+
+        if self.faults.latency or self.faults.jitter:
+            await asyncio.sleep(
+                self.faults.latency + self._random.uniform(0, self.faults.jitter)
+            )
+
+        if method.startswith(FAULTY_PREFIXES):
+            roll = self._random.random()
+            if roll < self.faults.rate_429:
+                self.stats.injected_429 += 1
+                return _error(
+                    429,
+                    f"Too Many Requests: retry after {self.faults.retry_after}",
+                    {"retry_after": self.faults.retry_after},
+                )
+            if roll < self.faults.rate_429 + self.faults.rate_5xx:
+                self.stats.injected_5xx += 1
+                return _error(500, "Internal Server Error")
+
+        return _ok(self._answer(method, params))
+
+    async def _get_updates(self, params: dict[str, Any]) -> list[dict[str, Any]]:
+        self.polled.set()
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+
+        while self._updates and self._updates[0][0]["update_id"] < offset:
+            _ = self._updates.popleft()
+
+        if not self._updates and timeout:
+            self._has_updates.clear()
+            try:
+                _ = await asyncio.wait_for(self._has_updates.wait(), timeout)
+            except TimeoutError:
+                return []
+
+        now = time.perf_counter()
+        batch: list[dict[str, Any]] = []
+        for update, keys in itertools.islice(self._updates, limit):
+            for key in keys:
+                if self._waiting.get(key, 0.0) is None:
+                    self._waiting[key] = now
+                    self.stats.delivered += 1
+            batch.append(update)
+
+        if batch and not self.stats.first_delivery:
+            self.stats.first_delivery = now
+        return batch
+
+    def _answer(self, method: str, params: dict[str, Any]) -> Any:
+        chat_id = _int(params.get("chat_id"))
+
+        match method:
+            case "getMe":
+                return {
+                    "id": BOT_ID,
+                    "is_bot": True,
+                    "first_name": "Lobby",
+                    "username": "lobby_bot",
+                }
+            case "getChat":
+                # usernames resolve to the admin, see BOT_ADMIN
+                if str(params.get("chat_id")).startswith("@"):
+                    chat_id = ADMIN_ID
+                return _chat_info(chat_id)
+            case "forwardMessage":
+                from_chat_id = _int(params["from_chat_id"])
+                self._complete(("fwd", from_chat_id, _int(params["message_id"])))
+                return self._message(chat_id, forwarded=True)
+            case "forwardMessages":
+                from_chat_id = _int(params["from_chat_id"])
+                result: list[dict[str, int]] = []
+                for message_id in json.loads(params["message_ids"]):
+                    self._complete(("fwd", from_chat_id, message_id))
+                    message = self._message(chat_id, forwarded=True)
+                    result.append({"message_id": message["message_id"]})
+                return result
+            case "answerCallbackQuery":
+                self._complete(("cb", params["callback_query_id"]))
+                return True
+            case "sendMessage" | "copyMessage" | "editMessageText" | "sendDocument":
+                return self._message(chat_id)
+            case _:
+                return True
+
+    def _complete(self, key: Key) -> None:
+        delivered = self._waiting.pop(key, None)
+        if delivered is None:
+            return
+        now = time.perf_counter()
+        self.stats.completed += 1
+        self.stats.latencies.append(now - delivered)
+        self.stats.last_completion = now
+
+    def _next_message_id(self, chat_id: int) -> int:
+        counter = self._message_ids.get(chat_id)
+        if not counter:
+            counter = self._message_ids[chat_id] = itertools.count(1)
+        return next(counter)
+
+    def _message(self, chat_id: int, forwarded: bool = False) -> dict[str, Any]:
+        message_id = self._next_message_id(chat_id)
+        if forwarded and chat_id == LOBBY_ID:
+            # only forwards can be replied to, the bot knows their senders
+            self._posted.append((time.perf_counter() + REPLY_DELAY, message_id))
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": _chat(chat_id),
+        }
+
+    # traffic
+
+    def _push(self, update: dict[str, Any], keys: list[Key]) -> None:
+        update["update_id"] = next(self._update_ids)
+        for key in keys:
+            self._waiting[key] = None
+        self._updates.append((update, keys))
+        self.stats.generated += len(keys)
+        self._has_updates.set()
+
+    def _user_message(self, user_id: int, **extra: Any) -> dict[str, Any]:
+        return {
+            "message_id": self._next_message_id(user_id),
+            "date": int(time.time()),
+            "chat": _chat(user_id),
+            "from": _user(user_id),
+            **extra,
+        }
+
+    def generate_one(self) -> None:
+        now = time.perf_counter()
+        while self._posted and self._posted[0][0] <= now:
+            self._lobby_messages.append(self._posted.popleft()[1])
+
+        mix = self.mix
+        kind = self._random.choices(
+            ("private", "album", "reply", "callback"),
+            (mix.private, mix.album, mix.reply, mix.callback),
+        )[0]
+        if kind in ("reply", "callback") and not self._lobby_messages:
+            kind = "private"
+
+        user_id = self._random.choice(self.users)
+        match kind:
+            case "private":
+                message = self._user_message(user_id, text="hello")
+                key = ("fwd", user_id, message["message_id"])
+                self._push({"message": message}, [key])
+            case "album":
+                group = f"album{self.stats.generated}"
+                for _ in range(3):
+                    message = self._user_message(
+                        user_id,
+                        media_group_id=group,
+                        photo=[PHOTO],
+                    )
+                    key = ("fwd", user_id, message["message_id"])
+                    self._push({"message": message}, [key])
+            case "reply":
+                replied = self._random.choice(self._lobby_messages)
+                message = {
+                    "message_id": self._next_message_id(LOBBY_ID),
+                    "date": int(time.time()),
+                    "chat": _chat(LOBBY_ID),
+                    "from": _user(MEMBER_ID),
+                    "text": "answer",
+                    "reply_to_message": {
+                        "message_id": replied,
+                        "date": int(time.time()),
+                        "chat": _chat(LOBBY_ID),
+                    },
+                }
+                key = ("fwd", LOBBY_ID, message["message_id"])
+                self._push({"message": message}, [key])
+            case _:
+                callback_id = str(next(self._callback_ids))
+                query = {
+                    "id": callback_id,
+                    "from": _user(MEMBER_ID),
+                    "chat_instance": "1",
+                    "data": f"list:white:{self._random.randrange(5)}",
+                    "message": {
+                        "message_id": self._random.choice(self._lobby_messages),
+                        "date": int(time.time()),
+                        "chat": _chat(LOBBY_ID),
+                        "text": "list",
+                    },
+                }
+                self._push({"callback_query": query}, [("cb", callback_id)])
+
+    async def generate(self, rate: float, duration: float) -> None:
+        """Generate updates at `rate` per second for `duration` seconds"""
+        start = time.perf_counter()
+        produced = 0
+        while (elapsed := time.perf_counter() - start) < duration:
+            due = int(elapsed * rate)
+            while produced < due:
+                self.generate_one()
+                produced += 1
+            await asyncio.sleep(0.005)
+
+
+def _ok(result: Any) -> web.Response:
+    return web.json_response({"ok": True, "result": result})
+
+
+def _error(
+    code: int, description: str, parameters: dict[str, Any] | None = None
+) -> web.Response:
+    body: dict[str, Any] = {
+        "ok": False,
+        "error_code": code,
+        "description": description,
+    }
+    if parameters:
+        body["parameters"] = parameters
+    return web.json_response(body, status=code)
+
+
+def _int(value: Any) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _chat(chat_id: int) -> dict[str, Any]:
+    if chat_id == LOBBY_ID:
+        return {"id": chat_id, "type": "supergroup", "title": "Lobby"}
+    return {"id": chat_id, "type": "private", "first_name": f"user{chat_id}"}
+
+
+def _user(user_id: int) -> dict[str, Any]:
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+
+def _chat_info(chat_id: int) -> dict[str, Any]:
+    return {
+        **_chat(chat_id),
+        "accent_color_id": 0,
+        "max_reaction_count": 0,
+        "accepted_gift_types": {
+            "unlimited_gifts": False,
+            "limited_gifts": False,
+            "unique_gifts": False,
+            "premium_subscription": False,
+            "gifts_from_channels": False,
+        },
+    }
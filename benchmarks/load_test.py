@@ -0,0 +1,218 @@
+#!/bin/env/python3
+
+"""
+End-to-end load test: the real bot against the fake Bot API.
+
+The bot runs in a child process with `BOT_API_URL` pointing at
+`fake_api.FakeBotAPI`, a prepared lobby and all generated users on the
+whitelist. Updates are generated at a fixed rate, and the report shows
+throughput, end-to-end latency and the bot's memory.
+
+    python benchmarks/load_test.py --users 1000 --rate 200 --duration 10
+    python benchmarks/load_test.py --latency 0.05 --p429 0.01 --p5xx 0.01
+    python benchmarks/load_test.py --workers 4
+
+Send budgets are lifted by default to measure the bot itself, pass
+`--global-rate 30 --group-rate 20` to see Telegram's limits in effect.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+from aiohttp import web
+
+from fake_api import ADMIN_ID, LOBBY_ID, FakeBotAPI, Faults, Mix
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def prepare_data(path: Path, users: list[int]) -> None:
+    _ = path.joinpath("persistent.json").write_text(
+        json.dumps({"chat_id": LOBBY_ID, "admin_id": ADMIN_ID, "new_chat_id": None})
+    )
+    _ = path.joinpath("users_lists.json").write_text(
+        json.dumps({"white_list": users, "black_list": [], "wait_list": []})
+    )
+
+
+def process_tree(pid: int) -> list[int]:
+    """A process and its descendants, the workers of `--workers`"""
+    result = [pid]
+    try:
+        for task in Path(f"/proc/{pid}/task").iterdir():
+            for child in task.joinpath("children").read_text().split():
+                result.extend(process_tree(int(child)))
+    except OSError:
+        pass
+    return result
+
+
+def memory_kb(pid: int) -> dict[str, int]:
+    """Current and peak RSS of a process and its children, summed"""
+    result: dict[str, int] = {"VmRSS": 0, "VmHWM": 0}
+    for process in process_tree(pid):
+        try:
+            for line in Path(f"/proc/{process}/status").read_text().splitlines():
+                key, _, value = line.partition(":")
+                if key in result:
+                    result[key] += int(value.split()[0])
+        except OSError:
+            pass
+    return result
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    api = FakeBotAPI(
+        users=args.users,
+        faults=Faults(args.latency, args.jitter, args.p429, args.p5xx),
+        mix=Mix(args.private, args.album, args.reply, args.callback),
+        seed=args.seed,
+    )
+
+    port = free_port()
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+
+    data_path = Path(tempfile.mkdtemp(prefix="load_test_"))
+    prepare_data(data_path, api.users)
+
+    env = {
+        **os.environ,
+        "PYTHONPATH": str(SRC),
+        "TELEGRAM_BOT_TOKEN": "42:load-test",
+        "BOT_ADMIN": str(ADMIN_ID),
+        "BOT_DATA_PATH": str(data_path),
+        "BOT_STORAGE": "json",
+        "BOT_API_URL": f"http://127.0.0.1:{port}",
+        "BOT_MODE": "polling",
+        "BOT_GLOBAL_RATE": str(args.global_rate),
+        "BOT_GROUP_RATE": str(args.group_rate),
+        "BOT_WORKERS": str(args.workers),
+        "BOT_FLOOD_RATE": str(args.flood_rate),
+        "BOT_LOG_LEVEL": args.log_level,
+        "BOT_LOG_AIOGRAM_LEVEL": "WARNING",
+    }
+    bot = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-c",
+        "from telegram_communa_bot.main import main; main()",
+        env=env,
+    )
+
+    try:
+        # worker processes start one import after another on a single CPU
+        _ = await asyncio.wait_for(api.polled.wait(), timeout=120)
+        idle = memory_kb(bot.pid)
+
+        await api.generate(args.rate, args.duration)
+
+        deadline = time.monotonic() + args.drain
+        while api.outstanding and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        loaded = memory_kb(bot.pid)
+    finally:
+        if bot.returncode is None:
+            bot.send_signal(signal.SIGTERM)
+            _ = await bot.wait()
+        await runner.cleanup()
+
+    return summary(api, idle, loaded)
+
+
+def summary(
+    api: FakeBotAPI, idle: dict[str, int], loaded: dict[str, int]
+) -> dict[str, Any]:
+    stats = api.stats
+    elapsed = max(1e-9, stats.last_completion - stats.first_delivery)
+    latencies = [x * 1000 for x in stats.latencies]
+    return {
+        "generated": stats.generated,
+        "completed": stats.completed,
+        "outstanding": api.outstanding,
+        "throughput": stats.completed / elapsed,
+        "p50": percentile(latencies, 0.5),
+        "p90": percentile(latencies, 0.9),
+        "p99": percentile(latencies, 0.99),
+        "max": max(latencies, default=float("nan")),
+        "idle_mb": idle.get("VmRSS", 0) / 1024,
+        "loaded_mb": loaded.get("VmRSS", 0) / 1024,
+        "peak_mb": loaded.get("VmHWM", 0) / 1024,
+        "injected_429": stats.injected_429,
+        "injected_5xx": stats.injected_5xx,
+        "calls": stats.calls.most_common(),
+    }
+
+
+def report(result: dict[str, Any], args: argparse.Namespace) -> None:
+    print(f"updates     {result['generated']} generated, {result['completed']} completed")
+    print(f"            {result['outstanding']} not completed in {args.drain}s")
+    print(f"throughput  {result['throughput']:.1f} updates/s")
+    print(
+        "latency ms  "
+        f"p50 {result['p50']:.1f}  "
+        f"p90 {result['p90']:.1f}  "
+        f"p99 {result['p99']:.1f}  "
+        f"max {result['max']:.1f}"
+    )
+    print(
+        f"memory MB   idle {result['idle_mb']:.1f}, "
+        f"loaded {result['loaded_mb']:.1f}, "
+        f"peak {result['peak_mb']:.1f}"
+    )
+    print(f"injected    {result['injected_429']} x 429, {result['injected_5xx']} x 5xx")
+    print("api calls   " + ", ".join(f"{k} {v}" for k, v in result["calls"]))
+
+
+def arguments() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    _ = parser.add_argument("--users", type=int, default=1000)
+    _ = parser.add_argument("--rate", type=float, default=200, help="updates per second")
+    _ = parser.add_argument("--duration", type=float, default=10, help="seconds")
+    _ = parser.add_argument("--drain", type=float, default=10, help="seconds to wait for the tail")
+    _ = parser.add_argument("--latency", type=float, default=0.0, help="API answer delay, s")
+    _ = parser.add_argument("--jitter", type=float, default=0.0, help="extra random delay, s")
+    _ = parser.add_argument("--p429", type=float, default=0.0, help="share of sends failed with 429")
+    _ = parser.add_argument("--p5xx", type=float, default=0.0, help="share of sends failed with 500")
+    _ = parser.add_argument("--private", type=float, default=0.6, help="weight of private messages")
+    _ = parser.add_argument("--album", type=float, default=0.1, help="weight of albums")
+    _ = parser.add_argument("--reply", type=float, default=0.2, help="weight of lobby replies")
+    _ = parser.add_argument("--callback", type=float, default=0.1, help="weight of list clicks")
+    _ = parser.add_argument("--global-rate", type=float, default=1e6)
+    _ = parser.add_argument("--group-rate", type=float, default=1e9, help="per minute")
+    _ = parser.add_argument("--log-level", default="WARNING")
+    _ = parser.add_argument("--seed", type=int, default=0)
+    _ = parser.add_argument("--workers", type=int, default=1, help="BOT_WORKERS")
+    _ = parser.add_argument("--flood-rate", type=float, default=0, help="BOT_FLOOD_RATE, 0 = off")
+    return parser
+
+
+def main():
+    args = arguments().parse_args()
+    report(asyncio.run(run(args)), args)
+
+
+if __name__ == "__main__":
+    main()
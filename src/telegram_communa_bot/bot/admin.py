@@ -3,31 +3,33 @@ from ..logging_setup import setup_logging
 
 logger = setup_logging(__file__)
 
-from typing import override
-from aiogram import Router
-from aiogram.filters import BaseFilter, Command
-from aiogram.types import Message
-
-from telegram_communa_bot.bot.app_data import AppData
-from telegram_communa_bot.bot.globals import GlobalData
-
-
-class _AdminFilter(BaseFilter):
-    @override
-    async def __call__(self, message: Message) -> bool:
-        ad: GlobalData = GlobalData.get()
-        logger.info(
-            "router_admin: message.chat.id=%s, app_data.admin_id=%s",
-            message.chat.id,
-            ad.admin_id,
-        )
-        return message.chat.id == ad.admin_id
-
+import asyncio
+from datetime import datetime
 
+from aiogram import Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import BufferedInputFile, Message
+
+from telegram_communa_bot.bot.app_data import app_data, users_lists
+
+from ..metrics import API_CONNECTIONS, API_FAILURES, API_REQUESTS, UPDATES
+from ..persistent import current_tenant, using_tenant, write_behind
+from ..profiling import MAX_SECONDS, profile, running
+from ..settings import settings
+from .common import md_escape
+from .flood import flood_control
+from .forwarding import forwarder
+from .globals import GlobalBot
+from .outbound import outbound
+from .routing import ADMIN, ChatKindFilter
+from .scheduling import scheduler
+from .tenants import tenants
+from .user_cache import user_cache
+
+
+# gets messages of the admin chat only, see `bot.routing`
 router_admin = Router(name="admin")
-
-
-_ = router_admin.message.filter(_AdminFilter())
+_ = router_admin.message.filter(ChatKindFilter(ADMIN))
 
 
 @router_admin.message(Command("help"))
@@ -35,6 +37,7 @@ async def cmd_help(msg: Message):
     return await msg.answer(
         """Команды админа
         - /status
+        - /profile <seconds> - profile the bot, the report comes as a document
         - /forget
         - /lobby <chat_id> - set lobby chat
         """
@@ -54,17 +57,118 @@ async def cmd_lobby(msg: Message):
             return await msg.answer("Использование: /lobby <chat_id>")
         return await msg.answer(f"Неверный chat_id: {chat_id}")
 
-    ad: AppData = AppData.get()
-    ad.chat_id = chat_id
+    if settings().tenants:
+        return await add_tenant_lobby(msg, chat_id)
+
+    ad = app_data()
+    ad.set_field("chat_id", chat_id)
     ad.save()
 
     _ = await msg.answer(f"Новый лобби чат: {chat_id}")
     _ = await lobby_send_message("Част устновлен в качестве lobby")
 
 
+async def add_tenant_lobby(msg: Message, chat_id: int):
+    """Lobby of the bot's own tenant, or of a new one for a shared bot"""
+    registry = tenants()
+    current = current_tenant()
+    tenant = current if current and current.bot else registry.tenant(str(chat_id))
+    registry.add_lobby(chat_id, tenant)
+
+    with tenant.hold(), using_tenant(tenant):
+        ad = app_data()
+        ad.set_field("chat_id", chat_id)
+        ad.save()
+
+        _ = await msg.answer(md_escape(f"Новый лобби чат: {chat_id}, тенант {tenant.name}"))
+        _ = await lobby_send_message("Част устновлен в качестве lobby")
+        if not tenant.bot:
+            me = await GlobalBot.get().me()
+            _ = await msg.answer(
+                md_escape(f"Ссылка для пользователей: https://t.me/{me.username}?start={tenant.name}")
+            )
+
+
+def status_text() -> str:
+    ad = app_data()
+    ul = users_lists()
+    out = outbound().stats
+    fw = forwarder().stats
+    fl = flood_control().stats
+
+    lines = [
+        f"Лобби: {ad.chat_id or 'не задано'}",
+        f"Пользователи: белый список {len(ul.white_list)}, "
+        f"ожидают {len(ul.wait_list)}, черный список {len(ul.black_list)}",
+        f"Обновления: {UPDATES.total():.0f}, "
+        f"не обработано {UPDATES.total(outcome='unhandled'):.0f}, "
+        f"ошибок {UPDATES.total(outcome='error'):.0f}",
+        f"Запросы к API: {API_REQUESTS.total():.0f}, "
+        f"ошибок {API_REQUESTS.total() - API_REQUESTS.total(code='ok'):.0f}",
+        f"Соединения с API: новых {API_CONNECTIONS.get('created'):.0f}, "
+        f"повторно {API_CONNECTIONS.get('reused'):.0f}, "
+        f"без ответа {API_FAILURES.total() - API_FAILURES.get('rejected'):.0f}, "
+        f"отклонено {API_FAILURES.get('rejected'):.0f}",
+        f"Отправка: {out.sent} отправлено, {out.retries} повторов, "
+        f"в очереди {outbound().depth}",
+        f"Обработка: выполняется {scheduler().running}, в очереди {scheduler().depth}",
+        f"Пересылка: {fw.messages} сообщений за {fw.calls} вызовов",
+        f"Флуд: отброшено {fl.dropped}, предупреждений {fl.warned}, "
+        f"мьютов {fl.muted}, заблокировано {fl.blocked}",
+        f"Кэш профилей: {len(user_cache())}",
+    ]
+
+    if settings().tenants:
+        registry = tenants()
+        lines.append(
+            f"Тенанты: загружено {registry.loaded} из {len(registry)}, "
+            f"выгружено {registry.stats.evictions}"
+        )
+
+    wb = write_behind()
+    if wb:
+        lines.append(
+            f"Сохранение: {wb.stats.flushes} сбросов, {wb.stats.errors} ошибок, "
+            f"последний {wb.stats.latency_last * 1000:.1f} мс"
+        )
+    return "\n".join(lines)
+
+
 @router_admin.message(Command("status"))
 async def cmd_status(msg: Message):
-    return await msg.answer("""TODO""")
+    return await msg.answer(md_escape(status_text()))
+
+
+# keeps the running `/profile` from being collected
+_profiling: asyncio.Task[None] | None = None
+
+
+@router_admin.message(Command("profile"))
+async def cmd_profile(msg: Message, command: CommandObject):
+    global _profiling
+    try:
+        seconds = float(command.args or 10)
+    except ValueError:
+        seconds = 0
+    if not 0 < seconds <= MAX_SECONDS:
+        return await msg.answer(md_escape(f"Использование: /profile <секунды до {MAX_SECONDS:g}>"))
+    if running() or (_profiling and not _profiling.done()):
+        return await msg.answer("Профилирование уже идет")
+
+    # in the background, the admin chat is handled one update at a time
+    _profiling = asyncio.create_task(send_profile(msg, seconds), name="profile")
+    return await msg.answer(md_escape(f"Профилирование {seconds:g} с, отчет придет документом"))
+
+
+async def send_profile(msg: Message, seconds: float):
+    try:
+        report = await profile(seconds)
+    except Exception as e:
+        logger.exception("Failed to profile")
+        _ = await msg.answer(md_escape(f"Профилирование не удалось: {e}"))
+        return
+    name = f"profile-{datetime.now():%Y%m%d-%H%M%S}.txt"
+    _ = await msg.answer_document(BufferedInputFile(report.encode(), filename=name))
 
 
 @router_admin.message(Command("forget"))
@@ -1,6 +1,12 @@
-from typing import override
+import asyncio
+import time
+from collections.abc import Iterable
+from typing import ClassVar, override
 
-from ..persistent import Persistent
+from pydantic import field_serializer
+
+from ..persistent import Persistent, current_tenant
+from ..storage import storage
 
 PERSISTENT_FILE_PATH = "persistent.json"
 USERS_LIST_FILE_PATH = "users_lists.json"
@@ -9,7 +15,15 @@ USERS_LIST_FILE_PATH = "users_lists.json"
 class AppData(Persistent):
     chat_id: int = 0
     admin_id: int = 0
+    # BOT_ADMIN username `admin_id` was resolved from
+    admin_username: str = ""
     new_chat_id: int | None = None
+    # polling position, see `lifecycle.UpdateTracker`
+    update_offset: int = 0
+    updates_done: list[int] = []
+    update_offset_time: float = 0.0
+    # lobby message with pending join requests, see `join_digest`
+    join_digest_id: int = 0
 
     @override
     @classmethod
@@ -21,6 +35,11 @@ __persistent: AppData | None = None
 
 
 def app_data() -> AppData:
+    """AppData of the current tenant, see `bot.tenants`"""
+    tenant = current_tenant()
+    if tenant:
+        return tenant.store(AppData)
+
     global __persistent
     if __persistent:
         return __persistent
@@ -28,22 +47,85 @@ def app_data() -> AppData:
     return __persistent
 
 
+WHITE_LIST = "white_list"
+BLACK_LIST = "black_list"
+WAIT_LIST = "wait_list"
+
+
 class UsersLists(Persistent):
+    membership_fields: ClassVar[tuple[str, ...]] = (WHITE_LIST, BLACK_LIST, WAIT_LIST)
+
     white_list: set[int] = set()
     black_list: set[int] = set()
     wait_list: set[int] = set()
+    # blocked the bot, skipped by `/broadcast` until they write again
+    unreachable: set[int] = set()
+    # when users entered the wait list, for `/allowall since <time>`
+    wait_since: dict[int, float] = {}
 
     @override
     @classmethod
     def _file_name(cls) -> str:
         return USERS_LIST_FILE_PATH
 
+    @field_serializer(WHITE_LIST, BLACK_LIST, WAIT_LIST)
+    def _dump_ids(self, ids: Iterable[int]) -> list[int]:
+        # views of `members`, already sorted
+        return list(ids)
+
+    def allow(self, user_id: int) -> None:
+        self._move(user_id, WHITE_LIST)
+
+    def block(self, user_id: int) -> None:
+        self._move(user_id, BLACK_LIST)
+
+    def wait(self, user_id: int) -> None:
+        self._move(user_id, WAIT_LIST)
+
+    def forget(self, user_id: int) -> None:
+        self._move(user_id, None)
+
+    def status(self, user_id: int) -> str | None:
+        """The list the user is in"""
+        status = self.members.get(user_id) if self.members else 0
+        return self.membership_fields[status - 1] if status else None
+
+    def _move(self, user_id: int, to: str | None) -> None:
+        """Put user into exactly one list (or none), recording only real changes"""
+        self._tracked = True
+        current = self.status(user_id)
+        if current != to:
+            if current:
+                self.discard_from(current, user_id)
+            if to:
+                self.add_to(to, user_id)
+
+        if to == WAIT_LIST and user_id not in self.wait_since:
+            self.put_in("wait_since", user_id, time.time())
+        elif to != WAIT_LIST and user_id in self.wait_since:
+            self.pop_from("wait_since", user_id)
+
 
 __user_lists: UsersLists | None = None
 
 
 def users_lists() -> UsersLists:
+    tenant = current_tenant()
+    if tenant:
+        return tenant.store(UsersLists)
+
     global __user_lists
     if not __user_lists:
         __user_lists = UsersLists.load()
     return __user_lists
+
+
+async def load_stores() -> None:
+    """Load all stores at once, each in a thread, before anything uses them"""
+    global __persistent, __user_lists
+    # the backend is created here, not raced for by the threads
+    _ = storage()
+    __persistent, __user_lists = await asyncio.gather(
+        asyncio.to_thread(AppData.load),
+        asyncio.to_thread(UsersLists.load),
+    )
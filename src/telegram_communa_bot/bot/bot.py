@@ -2,21 +2,40 @@ from ..logging_setup import setup_logging
 
 logger = setup_logging(__file__)
 
-from aiogram import Dispatcher, Router
+from aiogram import Bot, Dispatcher, Router
 from aiogram.types import Message
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 
 
-from ..settings import Settings
+from ..settings import Settings, settings
+from ..persistent import start_write_behind, stop_write_behind
+from ..storage import close_storages
 
-from .app_data import app_data
+from .app_data import app_data, load_stores
 from .globals import GlobalBot, GlobalData
 from .lobby_chat import router_lobby
 from .private import router_private
 from .public_chat import router_public_chat
 from .admin import router_admin
 from .common import item_str
+from .user_cache import UserCacheMiddleware
+from .outbound import OutboundLaneMiddleware, outbound
+from .scheduling import scheduler
+from .webhook import run_webhook
+from .lifecycle import run_polling
+from .forwarding import forwarder
+from .broadcast import start_broadcast
+from .reply_index import close_reply_index
+from .instrumentation import (
+    ApiMetricsMiddleware,
+    instrument_dispatcher,
+    register_gauges,
+    start_metrics_server,
+)
+from .session import create_session
+from .tenants import TenantMiddleware, tenants
+from .routing import ChatKindMiddleware, ChatKinds
 
 
 router = Router(name="default")
@@ -28,24 +47,79 @@ async def fallback(message: Message):
     return await message.answer("Unhandled message")
 
 
-async def run_bot(settings: Settings):
+def create_bot(settings: Settings) -> Bot:
     defaults = DefaultBotProperties(
         parse_mode=ParseMode.MARKDOWN_V2,
         # disable_web_page_preview=True,
         protect_content=False,
     )
 
-    bot = GlobalBot(settings.token, defaults=defaults).get()
+    session = create_session(settings)
+    bot = GlobalBot(settings.token, defaults=defaults, session=session).get()
+    _ = bot.session.middleware(outbound())
+    # inside the scheduler: times each attempt, not the wait for the budget
+    _ = bot.session.middleware(ApiMetricsMiddleware())
+
+    # bots of tenants share the session, and its middlewares
+    for name, token in settings.tenant_tokens:
+        _ = tenants().add_bot(name, Bot(token=token, session=session, defaults=defaults))
+    return bot
+
+
+def create_dispatcher() -> Dispatcher:
     dp = Dispatcher()
 
+    if settings().tenants:
+        # the others may use the stores already
+        _ = dp.update.outer_middleware(TenantMiddleware())
+    # after the tenant, the kinds and the lanes depend on its lobby
+    kinds = ChatKinds(
+        lobby_id=lambda: app_data().chat_id,
+        admin_id=lambda: GlobalData.get().admin_id,
+    )
+    _ = dp.update.outer_middleware(ChatKindMiddleware(kinds))
+    _ = dp.update.outer_middleware(scheduler())
+    _ = dp.update.outer_middleware(UserCacheMiddleware())
+    _ = dp.update.outer_middleware(OutboundLaneMiddleware())
+    instrument_dispatcher(dp)
+    register_gauges()
+
+    # messages go through the routers of their chat kind in this order
+    _ = dp.include_routers(
+        router_admin, router_lobby, router_private, router_public_chat, router
+    )
+    return dp
+
+
+async def run_bot(settings: Settings):
+    bot = create_bot(settings)
+    dp = create_dispatcher()
+
+    await load_stores()
     logger.info("AppData: %s", app_data())
 
     await GlobalData.init(settings)
 
-    _ = dp.include_router(router_admin)
-    _ = dp.include_router(router_lobby)
-    _ = dp.include_router(router_private)
-    _ = dp.include_router(router_public_chat)
-    _ = dp.include_router(router)
-
-    return await dp.start_polling(bot)
+    _ = start_write_behind(settings.save_interval, settings.save_max_pending)
+    # cut by the last stop
+    start_broadcast()
+    metrics_runner = None
+    try:
+        if settings.metrics_port:
+            metrics_runner = await start_metrics_server(
+                settings.metrics_host, settings.metrics_port
+            )
+
+        if settings.mode == "webhook":
+            return await run_webhook(dp, bot, settings)
+
+        return await run_polling(dp, bot, settings, tenants().bots() if settings.tenants else ())
+    finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await forwarder().close()
+        if settings.tenants:
+            await tenants().close()
+        close_reply_index()
+        await stop_write_behind()
+        close_storages()
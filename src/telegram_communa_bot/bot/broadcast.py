@@ -0,0 +1,343 @@
+"""
+`/broadcast`: copy a lobby message to every whitelisted user.
+
+Sends go through the outbound scheduler in the `BULK` lane, so the
+broadcast uses the global budget left over by lobby and private chats.
+`BOT_BROADCAST_CONCURRENCY` sends are in flight at a time. Users who
+blocked the bot are flagged in `UsersLists.unreachable` and skipped by
+later broadcasts until they write to the bot again.
+
+Progress is kept in `BroadcastState`: recipients before `position` are
+done, and so are the ids in `done_above`, as sends finish out of order.
+It is saved as sends finish, through the write-behind engine, so a flush
+writes the progress of all sends since the last one. With
+`BOT_STORAGE=journal` that is a few ops; the `json` and `sqlite`
+backends write the whole state, the recipients too, on every flush (on
+every send with `BOT_SAVE_INTERVAL=0`). A
+broadcast cut by a restart continues where it stopped, for a tenant
+(see `bot.tenants`) once it is loaded again. One lobby message is edited
+with the progress.
+"""
+
+from ..logging_setup import setup_logging
+
+logger = setup_logging(__file__)
+
+import asyncio
+import time
+from contextlib import suppress
+from typing import override
+
+from aiogram import Router
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError
+from aiogram.filters import Command
+from aiogram.types import Message
+
+from ..logging_setup import RateLimitedLog
+from ..persistent import Persistent, Tenant, current_tenant
+from ..settings import settings
+from .app_data import users_lists
+from .common import md_escape
+from .globals import GlobalBot
+from .outbound import BULK, lane
+
+BROADCAST_FILE_PATH = "broadcast.json"
+PROGRESS_INTERVAL = 5.0
+
+_failure_log = RateLimitedLog(logger, rate=1)
+
+
+class BroadcastState(Persistent):
+    from_chat_id: int = 0
+    # 0 when no broadcast is running
+    message_id: int = 0
+    status_message_id: int = 0
+    recipients: list[int] = []
+    position: int = 0
+    done_above: list[int] = []
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+    elapsed: float = 0.0
+
+    @override
+    @classmethod
+    def _file_name(cls) -> str:
+        return BROADCAST_FILE_PATH
+
+    @property
+    def running(self) -> bool:
+        return bool(self.message_id)
+
+    def begin(
+        self, from_chat_id: int, message_id: int, status_message_id: int, recipients: list[int]
+    ) -> None:
+        self.set_field("from_chat_id", from_chat_id)
+        self.set_field("message_id", message_id)
+        self.set_field("status_message_id", status_message_id)
+        self.set_field("recipients", recipients)
+        for field in ("position", "sent", "failed", "blocked"):
+            self.set_field(field, 0)
+        self.set_field("done_above", [])
+        self.set_field("elapsed", 0.0)
+        self.save()
+
+    def clear(self) -> None:
+        self.set_field("message_id", 0)
+        self.set_field("recipients", [])
+        self.set_field("done_above", [])
+        self.save()
+
+
+__broadcast_state: BroadcastState | None = None
+
+
+def broadcast_state() -> BroadcastState:
+    tenant = current_tenant()
+    if tenant:
+        return tenant.store(BroadcastState)
+
+    global __broadcast_state
+    if not __broadcast_state:
+        __broadcast_state = BroadcastState.load()
+    return __broadcast_state
+
+
+class Broadcast:
+    """
+    Sends of a saved broadcast. The progress lives here and is copied to
+    the state on checkpoints: in a worker pool the state is a replica the
+    receiver may update with older values.
+    """
+
+    def __init__(self, state: BroadcastState, concurrency: int):
+        self.state: BroadcastState = state
+        self.concurrency: int = max(1, concurrency)
+
+        self.position: int = state.position
+        self.sent: int = state.sent
+        self.failed: int = state.failed
+        self.blocked: int = state.blocked
+        self._next: int = state.position
+        self._done: set[int] = set(state.done_above)
+        self._started: float = time.monotonic()
+        self._elapsed_before: float = state.elapsed
+
+    @property
+    def elapsed(self) -> float:
+        return self._elapsed_before + time.monotonic() - self._started
+
+    @property
+    def total(self) -> int:
+        return len(self.state.recipients)
+
+    @property
+    def done(self) -> int:
+        return self.position + len(self._done)
+
+    async def run(self) -> None:
+        """Send to the remaining recipients, progress stays saved when cancelled"""
+        progress = asyncio.create_task(self._report_progress())
+        try:
+            _ = await asyncio.gather(*(self._worker() for _ in range(self.concurrency)))
+        finally:
+            _ = progress.cancel()
+            with suppress(asyncio.CancelledError):
+                await progress
+            self._checkpoint()
+
+        logger.info(
+            "Broadcast done in %.1fs: %d sent, %d failed, %d blocked the bot",
+            self.elapsed,
+            self.sent,
+            self.failed,
+            self.blocked,
+        )
+        await self._edit(self.final_text())
+        self.state.clear()
+
+    async def _worker(self) -> None:
+        recipients = self.state.recipients
+        while self._next < len(recipients):
+            index = self._next
+            self._next += 1
+            # done before a restart, `_finish` may have moved past it already
+            if index < self.position or index in self._done:
+                continue
+            await self._send(recipients[index])
+            self._finish(index)
+
+    async def _send(self, user_id: int) -> None:
+        state = self.state
+        try:
+            with lane(BULK):
+                _ = await GlobalBot.get().copy_message(
+                    chat_id=user_id,
+                    from_chat_id=state.from_chat_id,
+                    message_id=state.message_id,
+                )
+        except TelegramForbiddenError:
+            self.blocked += 1
+            ul = users_lists()
+            ul.add_to("unreachable", user_id)
+            ul.save()
+        except TelegramAPIError as e:
+            self.failed += 1
+            _failure_log("Broadcast to %s failed: %s", user_id, e)
+        else:
+            self.sent += 1
+
+    def _finish(self, index: int) -> None:
+        if index < self.position:
+            return
+        if index != self.position:
+            self._done.add(index)
+            return
+
+        position = index + 1
+        while position in self._done:
+            self._done.remove(position)
+            position += 1
+        self.position = position
+        self._checkpoint()
+
+    def _checkpoint(self) -> None:
+        """Save the progress, written with the rest of the state on the next flush"""
+        state = self.state
+        state.set_field("position", self.position)
+        state.set_field("done_above", sorted(self._done))
+        state.set_field("sent", self.sent)
+        state.set_field("failed", self.failed)
+        state.set_field("blocked", self.blocked)
+        state.set_field("elapsed", self.elapsed)
+        state.save()
+
+    async def _report_progress(self) -> None:
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            await self._edit(self.progress_text())
+
+    async def _edit(self, text: str) -> None:
+        state = self.state
+        if not state.status_message_id:
+            return
+        try:
+            _ = await GlobalBot.get().edit_message_text(
+                text=md_escape(text),
+                chat_id=state.from_chat_id,
+                message_id=state.status_message_id,
+            )
+        except TelegramAPIError as e:
+            # "message is not modified" too
+            logger.debug("Can't update broadcast status: %s", e)
+
+    def _rate(self) -> float:
+        return self.done / max(self.elapsed, 1e-9)
+
+    def progress_text(self) -> str:
+        return (
+            f"Рассылка: {self.done} из {self.total}, "
+            f"ошибок {self.failed}, заблокировали бота {self.blocked}, "
+            f"{self._rate():.1f} в секунду"
+        )
+
+    def final_text(self) -> str:
+        return (
+            f"Рассылка завершена за {self.elapsed:.0f} с: "
+            f"доставлено {self.sent} из {self.total}, "
+            f"ошибок {self.failed}, заблокировали бота {self.blocked}, "
+            f"{self._rate():.1f} в секунду"
+        )
+
+
+_running: asyncio.Task[None] | None = None
+# key of the task of a tenant in `Tenant.resources`
+BROADCAST = "broadcast"
+
+
+def _running_task() -> asyncio.Task[None] | None:
+    tenant = current_tenant()
+    return tenant.resources.get(BROADCAST) if tenant else _running
+
+
+def start_broadcast() -> None:
+    """Run the saved broadcast of the current tenant in the background"""
+    global _running
+    state = broadcast_state()
+    running = _running_task()
+    if not state.running or (running and not running.done()):
+        return
+
+    broadcast = Broadcast(state, settings().broadcast_concurrency)
+    tenant = current_tenant()
+    if tenant:
+        task = asyncio.create_task(_hold(tenant, broadcast), name=f"broadcast-{tenant.name}")
+        tenant.resources[BROADCAST] = task
+    else:
+        task = _running = asyncio.create_task(broadcast.run(), name="broadcast")
+    task.add_done_callback(_log_failure)
+
+
+async def _hold(tenant: Tenant, broadcast: Broadcast) -> None:
+    # the state stays loaded until the end
+    with tenant.hold():
+        await broadcast.run()
+
+
+def _log_failure(task: asyncio.Task[None]) -> None:
+    if not task.cancelled() and task.exception():
+        logger.error("Broadcast failed", exc_info=task.exception())
+
+
+async def stop_broadcast() -> None:
+    """Stop sending, the saved progress is resumed by `start_broadcast()`"""
+    running = _running_task()
+    if running and not running.done():
+        _ = running.cancel()
+        with suppress(asyncio.CancelledError):
+            await running
+
+
+router_broadcast = Router(name="broadcast")
+
+
+@router_broadcast.message(Command("broadcast"))
+async def cmd_broadcast(message: Message):
+    state = broadcast_state()
+    if state.running:
+        return await message.answer(
+            md_escape("Рассылка уже идет, /broadcast_stop остановит ее")
+        )
+
+    source = message.reply_to_message
+    if not source:
+        return await message.answer(
+            md_escape("Ответьте командой /broadcast на сообщение для рассылки")
+        )
+
+    ul = users_lists()
+    recipients = sorted(ul.white_list - ul.unreachable)
+    if not recipients:
+        return await message.answer("Некому отправлять")
+
+    status = await message.answer(md_escape(f"Рассылка: 0 из {len(recipients)}"))
+    state.begin(message.chat.id, source.message_id, status.message_id, recipients)
+    logger.info("Broadcast message %s to %d users", source.message_id, len(recipients))
+    start_broadcast()
+
+
+@router_broadcast.message(Command("broadcast_stop"))
+async def cmd_broadcast_stop(message: Message):
+    state = broadcast_state()
+    if not state.running:
+        return await message.answer("Рассылка не идет")
+
+    await stop_broadcast()
+    done, total = state.position + len(state.done_above), len(state.recipients)
+    state.clear()
+    return await message.answer(md_escape(f"Рассылка остановлена, отправлено {done} из {total}"))
+
+
+@router_broadcast.shutdown()
+async def on_shutdown():
+    await stop_broadcast()
@@ -2,10 +2,22 @@ from ..logging_setup import setup_logging
 
 logger = setup_logging(__file__)
 
+import re
+
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
 from aiogram.types import ReplyMarkupUnion, User, Chat, Message
 
 from .globals import GlobalBot
-from .app_data import AppData
+from .app_data import app_data
+from .user_cache import user_cache
+
+
+MD_SPECIAL = re.compile(r"([_*\[\]()~`>#+\-=|{}.!\\])")
+
+
+def md_escape(text: str) -> str:
+    """Escape text for ParseMode.MARKDOWN_V2"""
+    return MD_SPECIAL.sub(r"\\\1", text)
 
 
 def item_str(item: User | Chat | Message | None):
@@ -22,6 +34,16 @@ def item_str(item: User | Chat | Message | None):
 
 
 async def user_from_id(id: int) -> User | None:
+    try:
+        return await user_cache().get(id, _fetch_user)
+    except TelegramAPIError as e:
+        # not cached, asked again next time
+        logger.warning("Can't get user %s: %s", id, e)
+        return None
+
+
+async def _fetch_user(id: int) -> User | None:
+    """None for a user Telegram doesn't know, other errors are raised"""
     try:
         chat = await GlobalBot.get().get_chat(id)
         return User(
@@ -32,12 +54,18 @@ async def user_from_id(id: int) -> User | None:
             full_name=chat.full_name,
             username=chat.username,
         )
-    except ValueError:
+    except TelegramBadRequest as e:
+        if "chat not found" not in e.message.lower():
+            raise
+        logger.warning("Can't get user %s: %s", id, e)
+        return None
+    except ValueError as e:
+        logger.warning("Can't get user %s: %s", id, e)
         return None
 
 
 async def lobby_send_message(text: str, reply_markup: ReplyMarkupUnion | None = None):
-    chat_id = AppData.get().chat_id
+    chat_id = app_data().chat_id
     if not chat_id:
         logger.error("Lobby chat_id is not set")
         return None
@@ -0,0 +1,189 @@
+"""
+Flood control of private messages before they are forwarded.
+
+Every sender has a token bucket of `BOT_FLOOD_BURST` messages refilled at
+`BOT_FLOOD_RATE` per second. Messages over it are dropped, and the
+responses escalate: a warning on the first one, a mute for
+`BOT_FLOOD_MUTE` seconds when the sender keeps going for another burst,
+and the black list after `BOT_FLOOD_BLOCK_AFTER` mutes.
+
+Every sender is tracked from their first message, until they are idle
+long enough for the bucket to be full again and any mute to be over.
+Their state is kept in flat arrays indexed by a slot, the dict from user
+id to slot is in last-seen order, and idle slots are freed from its head
+as new messages come in, a few per check, so some idle senders stay
+tracked a little longer. Each check is O(1) and memory is
+bounded by the senders of the last few minutes, capped by
+`BOT_FLOOD_MAX_USERS`.
+"""
+
+import time
+from array import array
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from ..metrics import FLOOD
+from ..settings import settings
+
+PASS = "pass"
+DROP = "drop"
+WARN = "warn"
+MUTE = "mute"
+BLOCK = "block"
+
+# tracked senders freed per check, more than one keeps up with any inflow
+EXPIRE_BATCH = 2
+
+
+@dataclass
+class FloodStats:
+    passed: int = 0
+    dropped: int = 0
+    warned: int = 0
+    muted: int = 0
+    blocked: int = 0
+    evictions: int = 0
+
+
+class FloodControl:
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        mute: float,
+        block_after: int,
+        max_users: int,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate: float = rate
+        self.burst: float = float(max(1, burst))
+        self.mute: float = mute
+        self.block_after: int = block_after
+        self.max_users: int = max(1, max_users)
+        self.clock: Callable[[], float] = clock
+        self.stats: FloodStats = FloodStats()
+        # an idle bucket is full again and any mute is over by then
+        self.idle: float = self.burst / rate + mute if rate > 0 else 0.0
+
+        # user id -> slot, least recently seen first
+        self._slots: OrderedDict[int, int] = OrderedDict()
+        self._free: list[int] = []
+        self._tokens: array[float] = array("d")
+        self._seen: array[float] = array("d")
+        self._muted_until: array[float] = array("d")
+        # messages dropped in a row, mutes so far
+        self._strikes: array[int] = array("l")
+        self._mutes: array[int] = array("l")
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def check(self, user_id: int) -> str:
+        """Verdict for a message of `user_id`"""
+        if not self.enabled:
+            return PASS
+
+        now = self.clock()
+        self._expire(now)
+        slot = self._slots.get(user_id)
+        if slot is None:
+            slot = self._track(user_id, now)
+        else:
+            self._slots.move_to_end(user_id)
+
+        if self._muted_until[slot] > now:
+            return self._verdict(DROP)
+
+        tokens = min(self.burst, self._tokens[slot] + (now - self._seen[slot]) * self.rate)
+        self._seen[slot] = now
+        if tokens >= 1:
+            self._tokens[slot] = tokens - 1
+            self._strikes[slot] = 0
+            return self._verdict(PASS)
+
+        self._tokens[slot] = tokens
+        strikes = self._strikes[slot] = self._strikes[slot] + 1
+        if strikes == 1:
+            return self._verdict(WARN)
+        if strikes < self.burst:
+            return self._verdict(DROP)
+
+        self._strikes[slot] = 0
+        mutes = self._mutes[slot] = self._mutes[slot] + 1
+        if self.block_after and mutes >= self.block_after:
+            self._release(user_id)
+            return self._verdict(BLOCK)
+        self._muted_until[slot] = now + self.mute
+        return self._verdict(MUTE)
+
+    def _verdict(self, verdict: str) -> str:
+        FLOOD.inc(verdict)
+        if verdict == PASS:
+            self.stats.passed += 1
+            return verdict
+
+        self.stats.dropped += 1
+        if verdict == WARN:
+            self.stats.warned += 1
+        elif verdict == MUTE:
+            self.stats.muted += 1
+        elif verdict == BLOCK:
+            self.stats.blocked += 1
+        return verdict
+
+    def _track(self, user_id: int, now: float) -> int:
+        if len(self._slots) >= self.max_users:
+            oldest, _ = next(iter(self._slots.items()))
+            self._release(oldest)
+            self.stats.evictions += 1
+
+        if self._free:
+            slot = self._free.pop()
+            self._tokens[slot] = self.burst
+            self._seen[slot] = now
+            self._muted_until[slot] = 0.0
+            self._strikes[slot] = 0
+            self._mutes[slot] = 0
+        else:
+            slot = len(self._tokens)
+            self._tokens.append(self.burst)
+            self._seen.append(now)
+            self._muted_until.append(0.0)
+            self._strikes.append(0)
+            self._mutes.append(0)
+        self._slots[user_id] = slot
+        return slot
+
+    def _release(self, user_id: int) -> None:
+        self._free.append(self._slots.pop(user_id))
+
+    def _expire(self, now: float) -> None:
+        for _ in range(EXPIRE_BATCH):
+            if not self._slots:
+                return
+            user_id, slot = next(iter(self._slots.items()))
+            if now - self._seen[slot] < self.idle:
+                return
+            self._release(user_id)
+
+
+_flood_control: FloodControl | None = None
+
+
+def flood_control() -> FloodControl:
+    global _flood_control
+    if not _flood_control:
+        cfg = settings()
+        _flood_control = FloodControl(
+            cfg.flood_rate,
+            cfg.flood_burst,
+            cfg.flood_mute,
+            cfg.flood_block_after,
+            cfg.flood_max_users,
+        )
+    return _flood_control
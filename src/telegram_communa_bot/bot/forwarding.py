@@ -0,0 +1,168 @@
+"""
+Coalescing of private messages forwarded to the lobby.
+
+Parts of an album (same `media_group_id`) and, optionally, bursts of
+messages from one user are collected for a short window and delivered
+with one `forward_messages` call instead of one call per message. A
+batch is bound to the lobby and bot of the tenant its first message came
+through, it may be delivered from another context.
+"""
+
+from ..logging_setup import setup_logging
+
+logger = setup_logging(__file__)
+
+import asyncio
+from collections.abc import Coroutine
+from dataclasses import dataclass, field
+from typing import Any
+
+from aiogram import Bot
+from aiogram.types import Message
+
+from ..settings import settings
+from .app_data import app_data
+from .globals import GlobalBot
+from .reply_index import reply_index
+
+# Bot API limit for forwardMessages
+MAX_BATCH = 100
+
+# lobby, private chat, album
+BatchKey = tuple[int, int, str | None]
+
+
+@dataclass
+class ForwardStats:
+    messages: int = 0
+    calls: int = 0
+    errors: int = 0
+
+    @property
+    def saved(self) -> int:
+        return self.messages - self.calls
+
+
+@dataclass
+class _Batch:
+    lobby_id: int
+    bot: Bot
+    chat_id: int
+    message_ids: list[int] = field(default_factory=list)
+    timer: asyncio.Task[None] | None = None
+
+
+class Forwarder:
+    def __init__(self, album_window: float, burst_window: float, max_batch: int):
+        self.album_window: float = album_window
+        self.burst_window: float = burst_window
+        self.max_batch: int = min(max(1, max_batch), MAX_BATCH)
+        self.stats: ForwardStats = ForwardStats()
+
+        self._batches: dict[BatchKey, _Batch] = {}
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    async def add(self, message: Message) -> None:
+        chat_id = message.chat.id
+        lobby_id = app_data().chat_id
+
+        if self.burst_window > 0:
+            # albums are just a kind of burst here
+            key: BatchKey = (lobby_id, chat_id, None)
+            window = max(self.burst_window, self.album_window)
+        elif message.media_group_id:
+            key = (lobby_id, chat_id, message.media_group_id)
+            window = self.album_window
+        else:
+            # keep order with an album of this user still being collected
+            await self.flush_chat(chat_id)
+            await self._deliver(_Batch(lobby_id, GlobalBot.get(), chat_id, [message.message_id]))
+            return
+
+        batch = self._batches.get(key)
+        if not batch:
+            batch = self._batches[key] = _Batch(lobby_id, GlobalBot.get(), chat_id)
+            batch.timer = self._spawn(self._flush_later(key, window))
+
+        batch.message_ids.append(message.message_id)
+        if len(batch.message_ids) >= self.max_batch:
+            await self._flush(key)
+
+    def _spawn(self, coro: Coroutine[Any, Any, None]) -> asyncio.Task[None]:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _flush_later(self, key: BatchKey, window: float) -> None:
+        await asyncio.sleep(window)
+        await self._flush(key, from_timer=True)
+
+    async def _flush(self, key: BatchKey, from_timer: bool = False) -> None:
+        batch = self._batches.pop(key, None)
+        if not batch:
+            return
+        if batch.timer and not from_timer:
+            _ = batch.timer.cancel()
+        await self._deliver(batch)
+
+    async def flush_chat(self, chat_id: int) -> None:
+        for key in [k for k in self._batches if k[1] == chat_id]:
+            await self._flush(key)
+
+    async def _deliver(self, batch: _Batch) -> None:
+        chat_id, bot = batch.lobby_id, batch.bot
+        from_chat_id, message_ids = batch.chat_id, batch.message_ids
+
+        self.stats.messages += len(message_ids)
+        self.stats.calls += 1
+        message_ids = sorted(message_ids)
+        try:
+            if len(message_ids) == 1:
+                sent = await bot.forward_message(chat_id, from_chat_id, message_ids[0])
+                lobby_ids = [sent.message_id]
+            else:
+                result = await bot.forward_messages(chat_id, from_chat_id, message_ids)
+                lobby_ids = [x.message_id for x in result]
+        except Exception:
+            self.stats.errors += 1
+            logger.exception("Can't forward %s from %s", message_ids, from_chat_id)
+            return
+
+        # messages that can't be forwarded are skipped, then the pairs are unknown
+        if len(lobby_ids) != len(message_ids):
+            message_ids = [0] * len(lobby_ids)
+        index = reply_index()
+        for lobby_id, message_id in zip(lobby_ids, message_ids):
+            # a private chat id is the id of the user
+            index.record(chat_id, lobby_id, from_chat_id, message_id)
+
+        if len(message_ids) > 1:
+            logger.debug(
+                "Forwarded %d messages from %s in one call, %d calls saved so far",
+                len(message_ids),
+                from_chat_id,
+                self.stats.saved,
+            )
+
+    async def drain(self) -> None:
+        """Deliver everything collected so far"""
+        for key in list(self._batches):
+            await self._flush(key)
+        if self._tasks:
+            _ = await asyncio.wait(self._tasks)
+
+    async def close(self) -> None:
+        await self.drain()
+        logger.info("Forwarding stats: %s, %d calls saved", self.stats, self.stats.saved)
+
+
+_forwarder: Forwarder | None = None
+
+
+def forwarder() -> Forwarder:
+    global _forwarder
+    if not _forwarder:
+        cfg = settings()
+        _forwarder = Forwarder(cfg.album_window, cfg.burst_window, cfg.forward_batch)
+    return _forwarder
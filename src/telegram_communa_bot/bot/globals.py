@@ -2,23 +2,40 @@ from ..logging_setup import setup_logging
 
 logger = setup_logging(__file__)
 
+import asyncio
 from dataclasses import dataclass
 
 from aiogram import Bot
-from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+)
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.base import BaseSession
 
+from ..persistent import current_tenant
 from ..settings import Settings
+from .app_data import app_data
 
 
 class GlobalBot:
-    def __init__(self, token: str, defaults: DefaultBotProperties):
-        self._bot: Bot = Bot(token=token, defaults=defaults)
+    def __init__(
+        self,
+        token: str,
+        defaults: DefaultBotProperties,
+        session: BaseSession | None = None,
+    ):
+        self._bot: Bot = Bot(token=token, session=session, defaults=defaults)
         global _global_bot
         _global_bot = self
 
     @staticmethod
     def get() -> Bot:
+        """Bot of the current tenant when it has one, see `bot.tenants`"""
+        tenant = current_tenant()
+        if tenant and tenant.bot:
+            return tenant.bot
         if not _global_bot:
             raise SystemExit(1)
 
@@ -38,18 +55,59 @@ class GlobalData:
 
     @staticmethod
     async def init(settings: Settings):
+        global _global_data, _revalidation
         try:
             admin_id = int(settings.admin)
         except ValueError:
-            admin_id = await username_to_id(settings.admin) or 0
-            if not admin_id:
-                logger.error(f"Incorrect admin: {settings.admin}")
+            admin_id = cached_admin_id(settings.admin)
+            if admin_id:
+                # resolved on an earlier start, check it without delaying this one
+                _revalidation = asyncio.create_task(revalidate_admin(settings.admin))
+            else:
+                admin_id = await resolve_admin(settings.admin)
 
-        global _global_data
         _global_data = GlobalData(admin_id=admin_id)
 
 
 _global_data: GlobalData
+_revalidation: asyncio.Task[None] | None = None
+
+
+def _username(name: str) -> str:
+    return name if name.startswith("@") else "@" + name
+
+
+def cached_admin_id(username: str) -> int:
+    ad = app_data()
+    return ad.admin_id if ad.admin_username == _username(username) else 0
+
+
+async def resolve_admin(username: str) -> int:
+    """Resolve the admin username and remember the id for the next start"""
+    admin_id = await username_to_id(username) or 0
+    if not admin_id:
+        logger.error(f"Incorrect admin: {username}")
+        return 0
+
+    ad = app_data()
+    if (ad.admin_id, ad.admin_username) != (admin_id, _username(username)):
+        ad.set_field("admin_id", admin_id)
+        ad.set_field("admin_username", _username(username))
+        ad.save()
+    return admin_id
+
+
+async def revalidate_admin(username: str) -> None:
+    global _global_data
+    try:
+        admin_id = await resolve_admin(username)
+    except TelegramNetworkError as e:
+        logger.warning("Can't check admin %s: %s", username, e)
+        return
+
+    if admin_id and admin_id != _global_data.admin_id:
+        logger.warning("Admin %s is now %s", username, admin_id)
+        _global_data = GlobalData(admin_id=admin_id)
 
 
 async def username_to_id(username: str) -> int | None:
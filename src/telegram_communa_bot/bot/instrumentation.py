@@ -0,0 +1,218 @@
+"""
+Metrics collection for the bot and the `/metrics` endpoint.
+
+- `UpdateMetricsMiddleware` counts updates by type, router and outcome and
+  records how late they are processed
+- `HandlerMetricsMiddleware` times the handler that took an update
+- `ApiMetricsMiddleware` times Bot API requests and counts their results
+"""
+
+from ..logging_setup import setup_logging
+
+logger = setup_logging(__file__)
+
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, override
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramBadRequest,
+    TelegramConflictError,
+    TelegramEntityTooLarge,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+    TelegramServerError,
+    TelegramUnauthorizedError,
+)
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject, Update
+from aiohttp import web
+
+from ..metrics import (
+    API_REQUESTS,
+    API_SECONDS,
+    HANDLER_SECONDS,
+    UPDATE_LAG,
+    UPDATES,
+    registry,
+)
+from .globals import GlobalBot
+from .outbound import outbound
+from .scheduling import scheduler
+from .session import TunedSession
+from .user_cache import user_cache
+
+if TYPE_CHECKING:
+    from aiogram import Bot
+
+ROUTE_KEY = "metrics_route"
+
+_ERROR_CODES: tuple[tuple[type[Exception], str], ...] = (
+    (TelegramRetryAfter, "429"),
+    (TelegramBadRequest, "400"),
+    (TelegramUnauthorizedError, "401"),
+    (TelegramForbiddenError, "403"),
+    (TelegramNotFound, "404"),
+    (TelegramConflictError, "409"),
+    (TelegramEntityTooLarge, "413"),
+    (TelegramServerError, "5xx"),
+    (TelegramNetworkError, "network"),
+)
+
+
+def error_code(error: Exception) -> str:
+    for cls, code in _ERROR_CODES:
+        if isinstance(error, cls):
+            return code
+    return "api_error" if isinstance(error, TelegramAPIError) else "error"
+
+
+@dataclass
+class _Route:
+    """Filled in by the handler middleware, read by the update middleware"""
+
+    router: str = "none"
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    @override
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+
+        update_type = event.event_type
+        date = getattr(event.event, "date", None)
+        if date:
+            UPDATE_LAG.observe(max(0.0, time.time() - date.timestamp()))
+
+        route = data[ROUTE_KEY] = _Route()
+        try:
+            result = await handler(event, data)
+        except Exception:
+            UPDATES.inc(update_type, route.router, "error")
+            raise
+
+        outcome = "unhandled" if result is UNHANDLED else "handled"
+        UPDATES.inc(update_type, route.router, outcome)
+        return result
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    @override
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        router = data["event_router"].name
+        handler_object: HandlerObject | None = data.get("handler")
+        name = getattr(handler_object.callback, "__name__", "?") if handler_object else "?"
+
+        route: _Route | None = data.get(ROUTE_KEY)
+        if route:
+            route.router = router
+
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, router, name)
+
+
+def instrument_dispatcher(dp: Dispatcher) -> None:
+    _ = dp.update.outer_middleware(UpdateMetricsMiddleware())
+
+    handler_metrics = HandlerMetricsMiddleware()
+    for name, observer in dp.observers.items():
+        if name not in ("update", "error"):
+            _ = observer.middleware(handler_metrics)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    @override
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: "Bot",
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = method.__api_method__
+        code = "ok"
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            code = error_code(e)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - start, name)
+            API_REQUESTS.inc(name, code)
+
+
+def _circuit_open() -> float:
+    session = GlobalBot.get().session
+    return float(isinstance(session, TunedSession) and session.breaker.is_open)
+
+
+def register_gauges() -> None:
+    _ = registry.gauge(
+        "bot_outbound_queue_depth",
+        "Sends waiting for the global budget",
+        lambda: outbound().depth,
+    )
+    _ = registry.gauge(
+        "bot_handler_queue_depth",
+        "Updates waiting for earlier updates of their chat or a handler slot",
+        lambda: scheduler().depth,
+    )
+    _ = registry.gauge(
+        "bot_handlers_running",
+        "Handlers running at once",
+        lambda: scheduler().running,
+    )
+    _ = registry.gauge(
+        "bot_user_cache_size",
+        "Cached user profiles",
+        lambda: len(user_cache()),
+    )
+    _ = registry.gauge(
+        "bot_api_circuit_open",
+        "1 while Bot API requests fail fast after repeated failures",
+        _circuit_open,
+    )
+
+
+async def metrics(_: web.Request) -> web.Response:
+    return web.Response(
+        text=registry.render(), content_type="text/plain", charset="utf-8"
+    )
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    _ = app.router.add_get("/metrics", metrics)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info("Serve metrics on %s:%s/metrics", host, port)
+    return runner
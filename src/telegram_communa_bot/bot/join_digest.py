@@ -0,0 +1,214 @@
+"""
+Join requests collected into one lobby message.
+
+Instead of a message per `/start` of an unknown user, the wait list is
+shown in one digest message, edited at most once per
+`BOT_JOIN_DIGEST_WINDOW` seconds however many users join. Its buttons use
+the `ASK_ALLOW` callbacks of `lobby_chat.handle_answer`: one pair per
+user, and one pair for the page. The ids of a page are kept here under a
+short key, for the last `_PAGES_SIZE` rendered pages, and the buttons
+carry the key: a user who joins later is not on the page answered. When
+the wait list is empty the digest is closed, the next request opens a new one
+at the bottom of the chat.
+"""
+
+from ..logging_setup import setup_logging
+
+logger = setup_logging(__file__)
+
+import asyncio
+import itertools
+from collections import OrderedDict
+from collections.abc import Iterator
+from dataclasses import dataclass
+
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
+
+from ..persistent import current_tenant
+from ..settings import settings
+from .app_data import app_data, users_lists
+from .common import md_escape, user_from_id
+from .globals import GlobalBot
+from .list_view import Page, page_keyboard, user_line
+
+ASK_ALLOW = "allow_user"
+DIGEST = "digest"
+# marks a key of page ids in `ASK_ALLOW` callbacks
+PAGE_KEY = "p"
+# a keyboard row per user
+PAGE_SIZE = 10
+_PAGES_SIZE = 32
+
+
+@dataclass
+class DigestStats:
+    joins: int = 0
+    edits: int = 0
+    sends: int = 0
+    errors: int = 0
+
+
+def digest_keyboard(ids: list[int], key: str, page: int, pages: int) -> InlineKeyboardMarkup:
+    rows = [
+        [
+            InlineKeyboardButton(text=f"✅ {x}", callback_data=f"{ASK_ALLOW}:{x}:yes"),
+            InlineKeyboardButton(text=f"⛔ {x}", callback_data=f"{ASK_ALLOW}:{x}:no"),
+        ]
+        for x in ids
+    ]
+    span = f"{PAGE_KEY}{key}"
+    rows.append(
+        [
+            InlineKeyboardButton(
+                text="✅ Всех на странице", callback_data=f"{ASK_ALLOW}:{span}:yes"
+            ),
+            InlineKeyboardButton(
+                text="⛔ Всех на странице", callback_data=f"{ASK_ALLOW}:{span}:no"
+            ),
+        ]
+    )
+
+    nav = page_keyboard(DIGEST, page, pages)
+    if nav:
+        rows.extend(nav.inline_keyboard)
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+class JoinDigest:
+    def __init__(self, window: float):
+        self.window: float = window
+        self.stats: DigestStats = DigestStats()
+        # page shown in the digest message
+        self.page: int = 0
+
+        self._timer: asyncio.Task[None] | None = None
+        # one message is opened at a time
+        self._lock: asyncio.Lock = asyncio.Lock()
+        self._closed: bool = False
+        # key -> ids of a rendered page
+        self._pages: OrderedDict[str, list[int]] = OrderedDict()
+        self._page_keys: Iterator[int] = itertools.count(1)
+
+    def add(self, user_id: int) -> None:
+        logger.debug("Join request of %s goes to the digest", user_id)
+        self.stats.joins += 1
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Update the digest at the end of the window"""
+        if not self._timer and not self._closed:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def update_now(self) -> None:
+        """Update the digest after a moderator's answer"""
+        if self._timer:
+            _ = self._timer.cancel()
+            self._timer = None
+        await self.flush()
+
+    def page_ids(self, key: str) -> list[int] | None:
+        """Ids of a rendered page, None when the key is gone"""
+        return self._pages.get(key)
+
+    def owns(self, message: Message) -> bool:
+        return bool(message.message_id) and message.message_id == app_data().join_digest_id
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.window)
+        self._timer = None
+        await self.flush()
+
+    async def render(self, page: int) -> Page:
+        """Page of the wait list, profiles resolved for this page only"""
+        ids = sorted(users_lists().wait_list)
+        if not ids:
+            return md_escape("Все заявки рассмотрены"), None
+
+        pages = -(-len(ids) // PAGE_SIZE)
+        page = min(max(page, 0), pages - 1)
+        self.page = page
+
+        page_ids = ids[page * PAGE_SIZE : (page + 1) * PAGE_SIZE]
+        users = await asyncio.gather(*(user_from_id(x) for x in page_ids))
+        lines = [md_escape(f"Заявки на доступ ({len(ids)}), стр. {page + 1}/{pages}:")]
+        lines.extend(user_line(x, u) for x, u in zip(page_ids, users))
+
+        key = str(next(self._page_keys))
+        self._pages[key] = page_ids
+        while len(self._pages) > _PAGES_SIZE:
+            _ = self._pages.popitem(last=False)
+        return "\n".join(lines), digest_keyboard(page_ids, key, page, pages)
+
+    async def flush(self) -> None:
+        async with self._lock:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        chat_id = app_data().chat_id
+        if not chat_id:
+            logger.error("Lobby chat_id is not set")
+            return
+
+        text, kb = await self.render(self.page)
+        message_id = app_data().join_digest_id
+        bot = GlobalBot.get()
+        try:
+            if message_id:
+                self.stats.edits += 1
+                _ = await bot.edit_message_text(
+                    text=text, chat_id=chat_id, message_id=message_id, reply_markup=kb
+                )
+            elif kb:
+                self.stats.sends += 1
+                sent = await bot.send_message(chat_id, text, reply_markup=kb)
+                message_id = sent.message_id
+        except TelegramBadRequest as e:
+            if "not modified" in str(e):
+                return
+            # deleted or can't be edited anymore, open a new one next time
+            logger.warning("Can't update the join digest: %s", e)
+            self.stats.errors += 1
+            message_id = 0
+            if users_lists().wait_list:
+                self.refresh()
+        except TelegramAPIError as e:
+            self.stats.errors += 1
+            logger.error("Can't send the join digest: %s", e)
+            return
+
+        if not kb:
+            # everybody is handled, close this digest
+            message_id = 0
+            self.page = 0
+        ad = app_data()
+        if ad.join_digest_id != message_id:
+            ad.set_field("join_digest_id", message_id)
+            ad.save()
+
+    async def close(self) -> None:
+        """Show what is collected so far"""
+        self._closed = True
+        if self._timer:
+            await self.update_now()
+        logger.info("Join digest stats: %s", self.stats)
+
+
+_join_digest: JoinDigest | None = None
+# key of the digest of a tenant in `Tenant.resources`
+JOIN_DIGEST = "join_digest"
+
+
+def join_digest() -> JoinDigest:
+    """Digest of the current tenant, see `bot.tenants`"""
+    tenant = current_tenant()
+    if tenant:
+        digest = tenant.resources.get(JOIN_DIGEST)
+        if not digest:
+            digest = tenant.resources[JOIN_DIGEST] = JoinDigest(settings().join_digest_window)
+        return digest
+
+    global _join_digest
+    if not _join_digest:
+        _join_digest = JoinDigest(settings().join_digest_window)
+    return _join_digest
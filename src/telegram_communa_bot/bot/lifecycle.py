@@ -0,0 +1,301 @@
+"""
+Polling with a known update offset and a graceful stop.
+
+Updates are handled in tasks and finish out of order. `UpdateTracker`
+keeps the offset below which every update is processed, and the ids
+above it that are processed too; both are saved in `AppData`. The next
+start asks Telegram for updates from that offset and skips the ones
+already processed, so nothing is lost or handled twice across restarts.
+Fetching waits while the handlers are behind, see `bot.scheduling`.
+
+`getUpdates` is asked from the same offset while polling: Telegram
+forgets the updates below the offset it is given, so an update is
+confirmed only once it and every update before it are processed. The
+ones still in flight come again and are skipped; when a batch has
+nothing new, the next fetch waits for one of them to finish.
+
+A batch holds at most 100 updates, so a slow update keeps the ones after
+it from being fetched once 100 more are in flight or done behind it, and
+each fetch meanwhile brings nothing new. An update stops holding the
+offset after `OFFSET_HOLD` seconds: it is confirmed while it still runs,
+and if it is cancelled at shutdown Telegram doesn't deliver it again.
+
+On SIGTERM fetching stops at once, in-flight updates get
+`BOT_DRAIN_TIMEOUT` seconds to finish, collected forwards are sent and
+the offset is saved. Updates cancelled at the deadline stay above the
+offset and are fetched again on the next start.
+
+Tenants with a bot of their own (see `bot.tenants`) get a poller each,
+with the offset in their `AppData`; a signal stops all of them.
+"""
+
+from ..logging_setup import setup_logging
+
+logger = setup_logging(__file__)
+
+import asyncio
+import signal
+import time
+from collections.abc import Iterable, Sequence
+from contextlib import suppress
+from dataclasses import dataclass
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import GetUpdates, TelegramMethod
+from aiogram.types import Update
+from aiogram.utils.backoff import Backoff, BackoffConfig
+
+from ..persistent import Tenant, using_tenant
+from ..settings import Settings
+from .app_data import AppData, app_data
+from .forwarding import forwarder
+from .scheduling import scheduler
+
+POLL_TIMEOUT = 30
+# longest wait for an update in flight before fetching again
+REFETCH_DELAY = 0.5
+# longest an update in flight keeps the ones after it unconfirmed
+OFFSET_HOLD = 5.0
+BACKOFF = BackoffConfig(min_delay=1.0, max_delay=5.0, factor=1.3, jitter=0.1)
+# Telegram keeps updates for a day, an older offset may be from another id sequence
+OFFSET_MAX_AGE = 24 * 3600.0
+
+
+class UpdateTracker:
+    def __init__(self, offset: int = 0, done: Iterable[int] = ()):
+        # id after the highest one fetched
+        self._next: int = offset
+        # update id -> when it was taken
+        self._pending: dict[int, float] = {}
+        self._done: set[int] = {x for x in done if x >= offset}
+
+    @property
+    def offset(self) -> int:
+        """Every update below it is processed"""
+        return min(self._pending) if self._pending else self._next
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def fetch_offset(self, hold: float) -> int:
+        """Offset to fetch from, updates taken over `hold` seconds ago don't hold it"""
+        since = time.monotonic() - hold
+        held = [x for x, start in self._pending.items() if start > since]
+        return min(held) if held else self._next
+
+    def fetched(self, update_id: int) -> bool:
+        """Taken already by this run, or below the offset it started at"""
+        return update_id < self._next
+
+    def start(self, update_id: int) -> bool:
+        """Take a fetched update, False if it was processed already"""
+        self._next = max(self._next, update_id + 1)
+        if update_id in self._done:
+            return False
+        self._pending[update_id] = time.monotonic()
+        return True
+
+    def finish(self, update_id: int) -> None:
+        _ = self._pending.pop(update_id, None)
+        self._done.add(update_id)
+
+    def checkpoint(self) -> tuple[int, list[int]]:
+        """Offset and processed ids above it, forgets the ids below"""
+        offset = self.offset
+        self._done = {x for x in self._done if x >= offset}
+        return offset, sorted(self._done)
+
+    @classmethod
+    def restore(cls, ad: AppData) -> "UpdateTracker":
+        if not ad.update_offset or time.time() - ad.update_offset_time > OFFSET_MAX_AGE:
+            return cls()
+        return cls(ad.update_offset, ad.updates_done)
+
+
+def save_checkpoint(tracker: UpdateTracker, ad: AppData) -> None:
+    offset, done = tracker.checkpoint()
+    if (offset, done) == (ad.update_offset, ad.updates_done):
+        return
+    ad.set_field("update_offset", offset)
+    ad.set_field("updates_done", done)
+    ad.set_field("update_offset_time", time.time())
+    ad.save()
+
+
+@dataclass
+class LifecycleStats:
+    processed: int = 0
+    # fetched again after a restart, processed before it
+    skipped: int = 0
+    drained: int = 0
+    # cancelled at the drain deadline, fetched again on the next start
+    cancelled: int = 0
+    drain_seconds: float = 0.0
+
+
+class Poller:
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        settings: Settings,
+        stop: asyncio.Event | None = None,
+        close_session: bool = True,
+    ):
+        self.dp: Dispatcher = dp
+        self.bot: Bot = bot
+        self.drain_timeout: float = settings.drain_timeout
+        self.checkpoint_interval: float = max(1.0, settings.save_interval)
+        self.tracker: UpdateTracker = UpdateTracker.restore(app_data())
+        self.stats: LifecycleStats = LifecycleStats()
+        # the session may be shared with other pollers
+        self.close_session: bool = close_session
+
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._checkpoint_at: float = 0.0
+        self._stop: asyncio.Event = stop or asyncio.Event()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    async def run(self) -> None:
+        """Poll until SIGTERM/SIGINT or `stop()`, then drain"""
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            with suppress(NotImplementedError):
+                loop.add_signal_handler(sig, self.stop)
+
+        # polling doesn't work while a webhook is set
+        _ = await self.bot.delete_webhook()
+        await self.dp.emit_startup(bot=self.bot, dispatcher=self.dp)
+        logger.info("Poll updates from offset %s", self.tracker.offset or "of Telegram")
+
+        fetching = asyncio.create_task(self._fetch())
+        stopping = asyncio.create_task(self._stop.wait())
+        try:
+            done, _ = await asyncio.wait(
+                (fetching, stopping), return_when=asyncio.FIRST_COMPLETED
+            )
+            if fetching in done:
+                fetching.result()
+        finally:
+            for task in (fetching, stopping):
+                _ = task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                with suppress(NotImplementedError):
+                    _ = loop.remove_signal_handler(sig)
+            await self.drain()
+            await self.dp.emit_shutdown(bot=self.bot, dispatcher=self.dp)
+            if self.close_session:
+                await self.bot.session.close()
+
+    async def _fetch(self) -> None:
+        backoff = Backoff(BACKOFF)
+        allowed_updates = self.dp.resolve_used_update_types()
+        while True:
+            # backpressure: handlers are behind, leave updates with Telegram
+            await scheduler().room()
+            # updates in flight stay unconfirmed, for a while
+            offset = self.tracker.fetch_offset(OFFSET_HOLD) or None
+            try:
+                updates = await self.bot(
+                    GetUpdates(
+                        offset=offset, timeout=POLL_TIMEOUT, allowed_updates=allowed_updates
+                    )
+                )
+            except Exception as e:
+                logger.error("Failed to fetch updates: %s, retry in %.1fs", e, backoff.next_delay)
+                await backoff.asleep()
+                continue
+            backoff.reset()
+
+            fresh = 0
+            for update in updates:
+                if self.tracker.fetched(update.update_id):
+                    continue
+                fresh += 1
+                if not self.tracker.start(update.update_id):
+                    self.stats.skipped += 1
+                    continue
+                task = asyncio.create_task(self._process(update))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+            if updates and not fresh and self._tasks:
+                # only updates in flight, don't ask again until one is done
+                _ = await asyncio.wait(
+                    set(self._tasks), timeout=REFETCH_DELAY, return_when=asyncio.FIRST_COMPLETED
+                )
+
+            if time.monotonic() - self._checkpoint_at >= self.checkpoint_interval:
+                self._checkpoint_at = time.monotonic()
+                save_checkpoint(self.tracker, app_data())
+
+    async def _process(self, update: Update) -> None:
+        try:
+            result = await self.dp.feed_update(
+                self.bot, update, dispatcher=self.dp, bots=[self.bot]
+            )
+            if isinstance(result, TelegramMethod):
+                await self.dp.silent_call_request(self.bot, result)
+        except asyncio.CancelledError:
+            # left pending, the saved offset stays below it
+            raise
+        except Exception:
+            logger.exception("Failed to process update %s", update.update_id)
+        self.tracker.finish(update.update_id)
+        self.stats.processed += 1
+
+    async def drain(self) -> None:
+        start = time.monotonic()
+        inflight = set(self._tasks)
+        if inflight:
+            logger.info("Drain %d updates", len(inflight))
+            _, pending = await asyncio.wait(inflight, timeout=self.drain_timeout)
+            for task in pending:
+                _ = task.cancel()
+            _ = await asyncio.gather(*pending, return_exceptions=True)
+            self.stats.drained = len(inflight) - len(pending)
+            self.stats.cancelled = len(pending)
+
+        # collected forwards belong to updates counted as processed
+        await forwarder().drain()
+        save_checkpoint(self.tracker, app_data())
+        self.stats.drain_seconds = time.monotonic() - start
+        logger.info(
+            "Stopped in %.2fs at offset %d: %d updates processed, %d drained, "
+            "%d cancelled to be fetched again, %d skipped as processed before",
+            self.stats.drain_seconds,
+            self.tracker.offset,
+            self.stats.processed,
+            self.stats.drained,
+            self.stats.cancelled,
+            self.stats.skipped,
+        )
+
+
+async def run_polling(
+    dp: Dispatcher, bot: Bot, settings: Settings, tenants: Sequence[Tenant] = ()
+) -> None:
+    if not tenants:
+        return await Poller(dp, bot, settings).run()
+
+    stop = asyncio.Event()
+
+    async def poll(tenant: Tenant | None, bot: Bot) -> None:
+        # the poller and its updates see the stores of the tenant
+        with using_tenant(tenant):
+            poller = Poller(dp, bot, settings, stop=stop, close_session=False)
+            try:
+                await poller.run()
+            finally:
+                stop.set()
+
+    try:
+        _ = await asyncio.gather(poll(None, bot), *(poll(x, x.bot) for x in tenants))
+    finally:
+        # the bots share it
+        await bot.session.close()
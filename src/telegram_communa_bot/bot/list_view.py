@@ -0,0 +1,149 @@
+"""
+Paginated rendering of the users lists for lobby commands.
+
+Only the visible page is resolved to user profiles. Rendered pages are
+memoized by `UsersLists.version`, so browsing an unchanged list costs
+nothing. Results of bulk commands are paged the same way, their ids are
+kept for the last `_RESULTS_SIZE` results.
+"""
+
+import asyncio
+import itertools
+from collections import OrderedDict
+from collections.abc import Sequence
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, User
+
+from .app_data import BLACK_LIST, WAIT_LIST, WHITE_LIST, users_lists
+from .common import md_escape, user_from_id
+
+LIST_PAGE = "list"
+
+# Telegram limit for a message text
+MESSAGE_LIMIT = 4096
+# raw name parts are cut to this, escaping at most doubles them
+NAME_LIMIT = 64
+# bullet, id, @username, name and escapes
+LINE_LIMIT = 32 + 4 * NAME_LIMIT
+HEADER_LIMIT = 256
+PAGE_SIZE = min(20, (MESSAGE_LIMIT - HEADER_LIMIT) // LINE_LIMIT)
+
+LISTS = {
+    "white": (WHITE_LIST, "Пользователи в белом списке"),
+    "wait": (WAIT_LIST, "Пользователи в листе ожидания"),
+    "black": (BLACK_LIST, "Пользователи в черном списке"),
+}
+
+Page = tuple[str, InlineKeyboardMarkup | None]
+
+_MEMO_SIZE = 64
+# keyed by list kind, page, store identity and version
+_pages: OrderedDict[tuple[str, int, int, int], Page] = OrderedDict()
+_sorted: dict[str, tuple[tuple[int, int], list[int]]] = {}
+
+_RESULTS_SIZE = 32
+# keyed by a kind of their own: title, note and ids
+_results: OrderedDict[str, tuple[str, str, list[int]]] = OrderedDict()
+_result_ids = itertools.count(1)
+
+
+def user_line(user_id: int, user: User | None) -> str:
+    if not user:
+        return f"• `{user_id}`"
+
+    line = f"• `{user_id}`"
+    if user.username:
+        line += " @" + md_escape(user.username[:NAME_LIMIT])
+    return line + " " + md_escape(user.full_name[:NAME_LIMIT])
+
+
+def page_keyboard(kind: str, page: int, pages: int) -> InlineKeyboardMarkup | None:
+    buttons: list[InlineKeyboardButton] = []
+    if page > 0:
+        buttons.append(
+            InlineKeyboardButton(text="«", callback_data=f"{LIST_PAGE}:{kind}:{page - 1}")
+        )
+    if page + 1 < pages:
+        buttons.append(
+            InlineKeyboardButton(text="»", callback_data=f"{LIST_PAGE}:{kind}:{page + 1}")
+        )
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+
+async def render_ids(
+    title: str, ids: Sequence[int], kind: str, page: int, note: str = ""
+) -> Page:
+    """Render one page of `ids`, resolving profiles for this page only"""
+    pages = max(1, -(-len(ids) // PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+
+    page_ids = ids[page * PAGE_SIZE : (page + 1) * PAGE_SIZE]
+    users = await asyncio.gather(*(user_from_id(x) for x in page_ids))
+
+    header = md_escape(f"{title} ({len(ids)}), стр. {page + 1}/{pages}:")
+    lines = [header]
+    if note:
+        lines.append(md_escape(note))
+    lines.extend(user_line(x, u) for x, u in zip(page_ids, users))
+    text = "\n".join(lines)
+
+    # safety net, PAGE_SIZE is chosen so this never triggers
+    while len(text) > MESSAGE_LIMIT and len(lines) > 1:
+        _ = lines.pop()
+        text = "\n".join(lines)
+
+    return text, page_keyboard(kind, page, pages)
+
+
+def _sorted_ids(kind: str, field: str) -> list[int]:
+    ul = users_lists()
+    stamp = (id(ul), ul.version)
+    cached = _sorted.get(kind)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    ids = sorted(getattr(ul, field))
+    _sorted[kind] = (stamp, ids)
+    return ids
+
+
+async def render_list(kind: str, page: int = 0) -> Page:
+    field, title = LISTS[kind]
+    ul = users_lists()
+    version = ul.version
+
+    key = (kind, page, id(ul), version)
+    cached = _pages.get(key)
+    if cached:
+        _pages.move_to_end(key)
+        return cached
+
+    result = await render_ids(title, _sorted_ids(kind, field), kind, page)
+
+    # the list could change while profiles were resolving
+    if ul.version == version:
+        _pages[key] = result
+        while len(_pages) > _MEMO_SIZE:
+            _ = _pages.popitem(last=False)
+    return result
+
+
+async def render_result(title: str, ids: list[int], note: str = "") -> Page:
+    """First page of a bulk command result, kept for paging"""
+    kind = f"r{next(_result_ids)}"
+    _results[kind] = (title, note, ids)
+    while len(_results) > _RESULTS_SIZE:
+        _ = _results.popitem(last=False)
+    return await render_ids(title, ids, kind, 0, note)
+
+
+async def render_page(kind: str, page: int) -> Page | None:
+    """Page of a users list or of a kept result, None when it is gone"""
+    if kind in LISTS:
+        return await render_list(kind, page)
+
+    result = _results.get(kind)
+    if not result:
+        return None
+    title, note, ids = result
+    return await render_ids(title, ids, kind, page, note)
@@ -4,8 +4,7 @@ logger = setup_logging(__file__)
 
 import asyncio
 import re
-from typing import override
-from collections.abc import Iterable  # , Awaitable, Callable
+from typing import Any, override
 
 from aiogram import Router, F
 from aiogram.filters import BaseFilter
@@ -18,63 +17,67 @@ from aiogram.types import (
     InlineKeyboardButton,
     CallbackQuery,
 )
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 
+from ..settings import settings
 from .globals import GlobalBot
 
 from .common import (
     item_str,
-    user_from_id,
+    md_escape,
     lobby_send_message,
 )
 
 from .app_data import app_data, users_lists
+from .broadcast import router_broadcast
+from .join_digest import ASK_ALLOW, DIGEST, PAGE_KEY, join_digest
+from .list_view import LIST_PAGE, render_list, render_page, render_result
+from .moderation import apply, parse_targets, select, undated
+from .outbound import BULK, lane
+from .reply_index import reply_index
+from .routing import LOBBY, ChatKindFilter
 
 
 PREFIX_PATTERN = re.compile(r"^\[(\d+)\s@")
 
 
-class LobbyFilter(BaseFilter):
-    @override
-    async def __call__(self, message: Message) -> bool:
-        ad = app_data()
-        logger.info(
-            "message.chat.id=%s, app_data.chat_id=%s",
-            message.chat.id,
-            ad.chat_id,
-        )
-        return message.chat.id == ad.chat_id
-
-
+# gets messages of the lobby chat only, see `bot.routing`
 router_lobby = Router(name="lobby")
-
-_lobby_filter = LobbyFilter()
-_ = router_lobby.message.filter(_lobby_filter)
+_ = router_lobby.message.filter(ChatKindFilter(LOBBY))
 
 router_questsions = Router(name="questons")
 _ = router_lobby.include_router(router_questsions)
+_ = router_lobby.include_router(router_broadcast)
 
 
-@router_lobby.message(F.reply_to_message, F.reply_to_message.forward_from)
-async def reply(message: Message):
-    """Handle replies in the group and forward back to original user."""
-    assert message.reply_to_message
-    assert message.reply_to_message.forward_from
+class ReplyRouteFilter(BaseFilter):
+    """Find the original sender of a forwarded message being replied to"""
 
-    user_id = message.reply_to_message.forward_from.id
+    @override
+    async def __call__(self, message: Message) -> bool | dict[str, Any]:
+        replied = message.reply_to_message
+        if not replied:
+            return False
+
+        route = reply_index().lookup(message.chat.id, replied.message_id)
+        if route:
+            return {"user_id": route[0]}
+
+        # forwarded before the index existed, works unless the sender hides it
+        if replied.forward_from:
+            return {"user_id": replied.forward_from.id}
+        return False
 
+
+@router_lobby.message(ReplyRouteFilter())
+async def reply(message: Message, user_id: int):
+    """Handle replies in the group and forward back to original user."""
     if not user_id:
         return await message.answer("Невозможно ответить отправителю")
 
     return await message.forward(user_id)
 
 
-def dot_list(lst: Iterable[User]) -> str:
-    out_lst = [" "]
-    out_lst.extend(item_str(i) for i in lst)
-    return "\n - ".join(out_lst).strip()
-
-
 @router_lobby.message(Command("start"))
 async def lobby_start(message: Message):
     logger.info("Start command in lobby, %s", item_str(message.chat))
@@ -89,96 +92,102 @@ async def lobby_start(message: Message):
 
 @router_lobby.message(Command("whitelist"))
 async def cmd_whitelist(message: Message):
-    lst = await asyncio.gather(*(user_from_id(x) for x in users_lists().white_list))
-    users = filter(None, lst)
-    return await message.answer("Пользователи в белом спске:\n" + dot_list(users))
+    text, kb = await render_list("white")
+    return await message.answer(text, reply_markup=kb)
 
 
 @router_lobby.message(Command("blacklist"))
 async def cmd_blacklist(message: Message):
-    lst = await asyncio.gather(*(user_from_id(x) for x in users_lists().black_list))
-    users = filter(None, lst)
-    return await message.answer("Пользователи в черном спске:\n" + dot_list(users))
+    text, kb = await render_list("black")
+    return await message.answer(text, reply_markup=kb)
 
 
 @router_lobby.message(Command("waitlist"))
 async def cmd_waitlist(message: Message):
-    lst = await asyncio.gather(*(user_from_id(x) for x in users_lists().wait_list))
-    users = filter(None, lst)
-    return await message.answer("Пользователи в листе ожидания:\n" + dot_list(users))
+    text, kb = await render_list("wait")
+    return await message.answer(text, reply_markup=kb)
+
 
+@router_lobby.callback_query(F.data.startswith(f"{LIST_PAGE}:"))
+async def handle_list_page(query: CallbackQuery):
+    _ = await query.answer()
 
-async def user_from_message_1(message: Message) -> User | None:
-    if not message.text:
-        _ = await message.answer("Укажите идентификатор пользователя")
+    assert query.data
+    if not isinstance(query.message, Message):
+        return None
+    if query.message.chat.id != app_data().chat_id:
         return None
 
     try:
-        user_id = int(message.text.split(" ")[1].strip())
-    except IndexError:
-        _ = await message.answer("Укажите идентификатор пользователя")
+        _, kind, page_text = query.data.split(":", 2)
+        page = int(page_text)
     except ValueError:
-        _ = await message.answer(f"Неправильный идентификатор пользователя")
-    else:
-        return await user_from_id(user_id)
-
-
-@router_lobby.message(Command("allow"))
-async def cmd_allow(message: Message):
-    user = await user_from_message_1(message)
-    if not user:
+        logger.warning("Bad list page callback: %s", query.data)
         return None
 
-    ul = users_lists()
+    if kind == DIGEST:
+        result = await join_digest().render(page)
+    else:
+        result = await render_page(kind, page)
+    if not result:
+        return None
 
-    if user.id in ul.white_list:
-        return await message.answer(
-            f"Пользователь {item_str(user)} уже был одобрен ранее"
-        )
+    text, kb = result
+    return await query.message.edit_text(text, reply_markup=kb)
 
-    ul.white_list.add(user.id)
-    if user.id in ul.wait_list:
-        ul.wait_list.remove(user.id)
-        ul.save()
-        return await message.answer(f"Пользователь {item_str(user)} одобрен")
-    if user.id in ul.black_list:
-        ul.black_list.remove(user.id)
-        ul.save()
-        return await message.answer(f"Пользователь {item_str(user)} одобрен")
 
-    return await message.answer(f"Неизвестный пользователь {item_str(user)}")
+USAGE = "Использование: /{} <user_id> ... [100-200] [since 2h]"
+TITLES = {
+    "allow": "Одобрены",
+    "block": "Заблокированы",
+    "forget": "Удалены из списков",
+}
 
 
-@router_lobby.message(Command("block"))
-async def cmd_block(message: Message):
-    user = await user_from_message_1(message)
-    if not user:
-        return None
+async def moderate(message: Message, command: CommandObject, waitlist: bool = False):
+    """Apply `command` to all its targets, or to the wait list"""
+    action = command.command.removesuffix("all")
+    try:
+        targets = parse_targets(command.args or "")
+    except ValueError as e:
+        return await message.answer(md_escape(f"Не понял: {e}"))
 
     ul = users_lists()
-    ul.white_list.discard(user.id)
-    ul.wait_list.discard(user.id)
-    ul.black_list.add(user.id)
-    ul.save()
-
-    return await message.answer(
-        f"Пользователь {item_str(user)} заблокирован. Теперь он не может писать сообщения"
+    if waitlist:
+        ids = (select(targets, ul) if targets else set(ul.wait_list)) & ul.wait_list
+    elif targets:
+        ids = select(targets, ul)
+    else:
+        return await message.answer(md_escape(USAGE.format(action)))
+
+    # waitlisted before times were recorded, `since` misses them
+    skipped = undated(targets, ul)
+    skipped_note = f"без времени ожидания, не выбраны: {skipped}" if skipped else ""
+    if not ids:
+        text = ", ".join(filter(None, ("Никто не выбран", skipped_note)))
+        return await message.answer(md_escape(text))
+
+    outcome = apply(ul, action, ids)
+    logger.info(
+        "%s: %d changed, %d unchanged, %d unknown",
+        action,
+        len(outcome.changed),
+        outcome.unchanged,
+        outcome.unknown,
     )
+    note = ", ".join(filter(None, (outcome.note(), skipped_note)))
+    text, kb = await render_result(TITLES[action], outcome.changed, note)
+    return await message.answer(text, reply_markup=kb)
 
 
-@router_lobby.message(Command("forget"))
-async def cmd_forget(message: Message):
-    user = await user_from_message_1(message)
-    if not user:
-        return None
+@router_lobby.message(Command("allow", "block", "forget"))
+async def cmd_moderate(message: Message, command: CommandObject):
+    return await moderate(message, command)
 
-    ul = users_lists()
-    ul.wait_list.discard(user.id)
-    ul.white_list.discard(user.id)
-    ul.black_list.discard(user.id)
-    ul.save()
 
-    return await message.answer("Пользователь удален из всех списков")
+@router_lobby.message(Command("allowall", "blockall"))
+async def cmd_moderate_waitlist(message: Message, command: CommandObject):
+    return await moderate(message, command, waitlist=True)
 
 
 @router_lobby.message(Command("help"))
@@ -198,6 +207,14 @@ async def cmd_help(message: Message):
 
       - /allow <user_id> - разрешить полльзвателю послылать сообщения
       - /block <user_id> - заблокировать пользователя
+      - /forget <user_id> - удалить пользователя из всех списков
+      - /allowall, /blockall - то же для всего листа ожидания
+
+      Командам можно передать несколько `user_id`, диапазон `100-200`
+      и `since 2h` - всех, кто в листе ожидания последние 2 часа
+
+      - /broadcast - ответом на сообщение: разослать его всем из белого списка
+      - /broadcast_stop - остановить рассылку
 
       `user_id` - это первая цифра в списках пользователей
     """
@@ -248,10 +265,10 @@ async def cmd_help(message: Message):
 #     return await lobby_send_message(question, reply_markup=kb)
 
 
-ASK_ALLOW = "allow_user"
-
-
 async def ask_allow_user(user: User):
+    if settings().join_digest_window > 0:
+        return join_digest().add(user.id)
+
     kb = InlineKeyboardMarkup(
         inline_keyboard=[
             [
@@ -278,20 +295,42 @@ async def handle_answer(query: CallbackQuery):
     assert query.message
     assert isinstance(query.message, Message)
 
-    _, user_id, choice = query.data.split(":", 2)
-    user_id = int(user_id)
-
+    # a user id, or the key of a page of the join digest
+    _, target, choice = query.data.split(":", 2)
     ul = users_lists()
+    digest = join_digest()
+    if target.startswith(PAGE_KEY):
+        page_ids = digest.page_ids(target.removeprefix(PAGE_KEY))
+        if page_ids is None:
+            # an old page, show the current one
+            logger.info("Page %s of the join digest is gone", target)
+            if digest.owns(query.message):
+                return await digest.update_now()
+            return None
+        ids = set(page_ids) & ul.wait_list
+    else:
+        try:
+            ids = parse_targets(target).ids
+        except ValueError:
+            logger.warning("Bad answer callback: %s", query.data)
+            return None
+    outcome = apply(ul, "allow" if choice == "yes" else "block", ids)
+
+    text = "Доступ разрешен" if choice == "yes" else "Доступ запрещен"
     bot = GlobalBot.get()
+    with lane(BULK):
+        results = await asyncio.gather(
+            *(bot.send_message(x, text) for x in outcome.changed), return_exceptions=True
+        )
+    for user_id, result in zip(outcome.changed, results):
+        if isinstance(result, Exception):
+            logger.warning("Can't notify %s: %s", user_id, result)
 
-    if choice == "yes":
-        ul.white_list.add(user_id)
-        _ = await bot.send_message(user_id, "Доступ разрешен")
-    else:
-        ul.black_list.add(user_id)
-        _ = await bot.send_message(user_id, "Доступ запрещен")
+    if digest.owns(query.message):
+        return await digest.update_now()
+    _ = await query.message.edit_reply_markup(reply_markup=None)
 
-    ul.wait_list.discard(user_id)
-    ul.save()
 
-    _ = await query.message.edit_reply_markup(reply_markup=None)
+@router_lobby.shutdown()
+async def on_shutdown():
+    await join_digest().close()
@@ -0,0 +1,123 @@
+"""
+Bulk changes of the users lists for `/allow`, `/block` and `/forget`.
+
+Targets are ids, ranges `100-200` of known ids and `since <time>` for
+users waitlisted since then, where time is `30m`, `2h`, `1d` ago or an
+ISO date. Users waitlisted before the time was recorded have none and
+are never matched by `since`, the reply counts them. All of them are
+applied in memory and saved once; profiles are resolved only for the
+page of the result that is shown.
+"""
+
+import re
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from .app_data import BLACK_LIST, WHITE_LIST, UsersLists
+
+SINCE = "since"
+RANGE = re.compile(r"^(\d+)-(\d+)$")
+DURATION = re.compile(r"^(\d+)([smhd])$")
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# action: list the users go to, only users in some list are moved
+ACTIONS: dict[str, tuple[str | None, bool]] = {
+    "allow": (WHITE_LIST, True),
+    "block": (BLACK_LIST, False),
+    "forget": (None, False),
+}
+
+
+@dataclass
+class Targets:
+    ids: set[int] = field(default_factory=set)
+    ranges: list[tuple[int, int]] = field(default_factory=list)
+    since: float | None = None
+
+    def __bool__(self) -> bool:
+        return bool(self.ids or self.ranges or self.since is not None)
+
+
+def parse_since(text: str, now: float) -> float:
+    match = DURATION.match(text)
+    if match:
+        return now - int(match[1]) * UNITS[match[2]]
+    return datetime.fromisoformat(text).timestamp()
+
+
+def parse_targets(args: str, now: float | None = None) -> Targets:
+    """Parse command arguments, ValueError names the first bad one"""
+    now = time.time() if now is None else now
+    targets = Targets()
+    tokens = iter(args.replace(",", " ").split())
+    for token in tokens:
+        if token == SINCE:
+            value = next(tokens, "")
+            try:
+                targets.since = parse_since(value, now)
+            except ValueError:
+                raise ValueError(f"since {value}") from None
+        elif match := RANGE.match(token):
+            low, high = int(match[1]), int(match[2])
+            targets.ranges.append((min(low, high), max(low, high)))
+        elif token.isdigit():
+            targets.ids.add(int(token))
+        else:
+            raise ValueError(token)
+    return targets
+
+
+def select(targets: Targets, ul: UsersLists) -> set[int]:
+    """Named ids, known ids in the ranges and users waitlisted since"""
+    ids = set(targets.ids)
+    if targets.ranges:
+        known: Iterable[int] = ul.white_list | ul.black_list | ul.wait_list
+        ids.update(x for x in known if any(lo <= x <= hi for lo, hi in targets.ranges))
+    if targets.since is not None:
+        since = targets.since
+        ids.update(x for x, at in ul.wait_since.items() if at >= since and x in ul.wait_list)
+    return ids
+
+
+def undated(targets: Targets, ul: UsersLists) -> int:
+    """Waitlisted users `since` can't match, they have no time recorded"""
+    if targets.since is None:
+        return 0
+    return sum(1 for x in ul.wait_list if x not in ul.wait_since)
+
+
+@dataclass
+class Outcome:
+    changed: list[int] = field(default_factory=list)
+    unchanged: int = 0
+    unknown: int = 0
+
+    def note(self) -> str:
+        parts: list[str] = []
+        if self.unchanged:
+            parts.append(f"без изменений: {self.unchanged}")
+        if self.unknown:
+            parts.append(f"неизвестны: {self.unknown}")
+        return ", ".join(parts)
+
+
+def apply(ul: UsersLists, action: str, ids: Iterable[int]) -> Outcome:
+    """Move the users as one change, saved once"""
+    to, known_only = ACTIONS[action]
+    move = getattr(ul, action)
+    outcome = Outcome()
+    for user_id in sorted(ids):
+        status = ul.status(user_id)
+        if status == to:
+            outcome.unchanged += 1
+        elif known_only and status is None:
+            outcome.unknown += 1
+        else:
+            move(user_id)
+            outcome.changed.append(user_id)
+
+    if outcome.changed:
+        ul.save()
+    return outcome
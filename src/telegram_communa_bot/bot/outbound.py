@@ -0,0 +1,280 @@
+"""
+Outbound scheduler for Bot API calls.
+
+Installed as a session request middleware, so every send made through
+`GlobalBot` passes through it. Sends are paced by token buckets: one
+global and one per group chat. `TelegramRetryAfter` parks only the
+affected chat, transient network and server errors are retried with
+jittered exponential backoff.
+
+Sends waiting for the global budget, or for the budget of a group, are
+served by lane: lobby and admin traffic (`HIGH`) goes ahead of private
+chats (`NORMAL`) and bulk jobs (`BULK`).
+"""
+
+from ..logging_setup import setup_logging
+
+logger = setup_logging(__file__)
+
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from collections.abc import Awaitable, Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, override
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.exceptions import (
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import Chat, TelegramObject
+
+from ..settings import settings
+from .app_data import app_data
+from .globals import GlobalData
+
+if TYPE_CHECKING:
+    from aiogram import Bot
+
+HIGH, NORMAL, BULK = 0, 1, 2
+LANES = {HIGH: "high", NORMAL: "normal", BULK: "bulk"}
+
+# Bot API methods counted against the send budgets
+PACED_PREFIXES = ("send", "forward", "copy", "edit")
+
+_lane: ContextVar[int] = ContextVar("outbound_lane", default=NORMAL)
+
+
+@contextmanager
+def lane(value: int) -> Iterator[None]:
+    """Run sends made inside the block in the given lane"""
+    token = _lane.set(value)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate: float = rate
+        self.burst: float = burst
+        self.tokens: float = burst
+        self.updated: float = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class LaneQueue:
+    """Token bucket whose waiters are served by lane, then in arrival order"""
+
+    def __init__(self, bucket: TokenBucket, name: str):
+        self.bucket: TokenBucket = bucket
+        self.name: str = name
+        self._queue: list[tuple[int, int, asyncio.Future[None]]] = []
+        self._seq: Iterator[int] = itertools.count()
+        self._pump: asyncio.Task[None] | None = None
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    async def take(self, lane: int) -> None:
+        if not self._queue and self.bucket.try_take():
+            return
+
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (lane, next(self._seq), future))
+        if not self._pump or self._pump.done():
+            self._pump = asyncio.create_task(self._run_pump(), name=self.name)
+        await future
+
+    async def _run_pump(self) -> None:
+        """Hand out tokens to waiting sends, highest lane first"""
+        while self._queue:
+            delay = self.bucket.wait_time()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+
+            _, _, future = heapq.heappop(self._queue)
+            if future.done():
+                # the waiting send was cancelled
+                continue
+            _ = self.bucket.try_take()
+            future.set_result(None)
+
+
+@dataclass
+class OutboundStats:
+    sent: int = 0
+    retries: int = 0
+    retry_after: int = 0
+    network_errors: int = 0
+    waits: int = 0
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+    queued: dict[str, int] = field(default_factory=lambda: dict.fromkeys(LANES.values(), 0))
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    def __init__(
+        self,
+        global_rate: float,
+        group_rate: float,
+        retries: int,
+        backoff: float = 0.5,
+    ):
+        self.group_rate: float = group_rate
+        self.retries: int = retries
+        self.backoff: float = backoff
+        self.stats: OutboundStats = OutboundStats()
+
+        self._global: LaneQueue = LaneQueue(
+            TokenBucket(global_rate, global_rate), "outbound-pump"
+        )
+        self._groups: dict[int | str, LaneQueue] = {}
+        self._parked: dict[int | str, float] = {}
+
+    @property
+    def depth(self) -> int:
+        return len(self._global)
+
+    @override
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: "Bot",
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if not method.__api_method__.startswith(PACED_PREFIXES):
+            return await make_request(bot, method)
+
+        chat_id: int | str | None = getattr(method, "chat_id", None)
+        attempt = 0
+        while True:
+            await self._acquire(chat_id, _lane.get())
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.stats.retry_after += 1
+                logger.warning("Chat %s is flooded, park for %ss", chat_id, e.retry_after)
+                if chat_id is not None:
+                    self._parked[chat_id] = time.monotonic() + e.retry_after
+                if attempt >= self.retries:
+                    raise
+            except (TelegramNetworkError, TelegramServerError) as e:
+                self.stats.network_errors += 1
+                if attempt >= self.retries:
+                    raise
+                delay = self.backoff * 2**attempt * random.uniform(0.5, 1.5)
+                logger.warning("%s failed: %s, retry in %.2fs", method.__api_method__, e, delay)
+                await asyncio.sleep(delay)
+            else:
+                self.stats.sent += 1
+                return response
+
+            attempt += 1
+            self.stats.retries += 1
+
+    async def _acquire(self, chat_id: int | str | None, lane: int) -> None:
+        start = time.monotonic()
+
+        parked_until = self._parked.get(chat_id) if chat_id is not None else None
+        if parked_until:
+            if parked_until > start:
+                await asyncio.sleep(parked_until - start)
+            _ = self._parked.pop(chat_id, None)
+
+        if _is_group(chat_id):
+            assert chat_id is not None
+            group = self._groups.get(chat_id)
+            # not `if not`, it has a length
+            if group is None:
+                # a few messages in a row are fine, the minute average is what counts
+                burst = max(1.0, self.group_rate * 15)
+                bucket = TokenBucket(self.group_rate, burst)
+                group = self._groups[chat_id] = LaneQueue(bucket, f"outbound-pump-{chat_id}")
+            # by lane too: a lobby reply goes ahead of forwards booked before it
+            await group.take(lane)
+
+        self.stats.queued[LANES[lane]] += 1
+        try:
+            await self._global.take(lane)
+        finally:
+            self.stats.queued[LANES[lane]] -= 1
+
+        waited = time.monotonic() - start
+        if waited > 0.001:
+            self.stats.waits += 1
+            self.stats.wait_total += waited
+            self.stats.wait_max = max(self.stats.wait_max, waited)
+
+
+def _is_group(chat_id: int | str | None) -> bool:
+    # groups and channels have negative ids, public ones can be addressed by @username
+    return isinstance(chat_id, str) or (chat_id is not None and chat_id < 0)
+
+
+_scheduler: OutboundScheduler | None = None
+
+
+def outbound() -> OutboundScheduler:
+    global _scheduler
+    if not _scheduler:
+        cfg = settings()
+        _scheduler = OutboundScheduler(
+            global_rate=cfg.global_rate,
+            group_rate=cfg.group_rate / 60,
+            retries=cfg.send_retries,
+        )
+    return _scheduler
+
+
+def chat_lane(chat: Chat | None) -> int:
+    """HIGH for the lobby and the admin chat"""
+    if chat and chat.id in (app_data().chat_id, GlobalData.get().admin_id):
+        return HIGH
+    return NORMAL
+
+
+class OutboundLaneMiddleware(BaseMiddleware):
+    """Put sends made while handling lobby and admin updates into the HIGH lane"""
+
+    @override
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        if chat_lane(data.get("event_chat")) == HIGH:
+            with lane(HIGH):
+                return await handler(event, data)
+        return await handler(event, data)
@@ -1,18 +1,29 @@
-from aiogram import Router, F
-from aiogram.enums import ChatType
-from aiogram.types import Message
+from aiogram import Router
+from aiogram.types import Message, User
 from aiogram.filters import Command
 
 from ..logging_setup import setup_logging
-from .app_data import app_data, users_lists
-from .common import item_str
+from .app_data import users_lists
+from .common import item_str, lobby_send_message, md_escape
+from .flood import BLOCK, MUTE, PASS, WARN, flood_control
+from .forwarding import forwarder
 from .lobby_chat import ask_allow_user
+from .routing import ADMIN, PRIVATE, ChatKindFilter
 
 logger = setup_logging(__file__)
 
 
+# gets messages of private chats only, see `bot.routing`
 router_private = Router(name="provate")
-router_private.message.filter(F.chat.type == ChatType.PRIVATE)
+_ = router_private.message.filter(ChatKindFilter(ADMIN, PRIVATE))
+
+
+def reachable(user_id: int) -> None:
+    """The user writes to the bot, so they unblocked it"""
+    ul = users_lists()
+    if user_id in ul.unreachable:
+        ul.discard_from("unreachable", user_id)
+        ul.save()
 
 
 @router_private.message(Command("start"))
@@ -26,13 +37,14 @@ async def cmd_start(message: Message):
         return None
 
     user = message.from_user
+    reachable(user.id)
     if user.id in ul.white_list:
         return await message.answer("Отправь сообщение и я перешлю его в лобби чат")
 
     if user.id in ul.black_list:
         return await message.answer("Бот не будет передавать твои сообщения")
 
-    ul.wait_list.add(user.id)
+    ul.wait(user.id)
     ul.save()
 
     _ = await ask_allow_user(user)
@@ -46,5 +58,30 @@ async def handle_message(message: Message):
     if not message.from_user or message.from_user.id not in white_list:
         return await message.answer("Тебя нет в списке допущенных пользователей")
 
-    ad = app_data()
-    return await message.forward(ad.chat_id)
+    reachable(message.from_user.id)
+    verdict = flood_control().check(message.from_user.id)
+    if verdict != PASS:
+        return await on_flood(message, message.from_user, verdict)
+
+    await forwarder().add(message)
+
+
+async def on_flood(message: Message, user: User, verdict: str):
+    """Escalate on a dropped message, plain drops get no answer"""
+    if verdict == WARN:
+        return await message.answer("Слишком много сообщений, лишние не будут переданы")
+    if verdict == MUTE:
+        mute = flood_control().mute
+        return await message.answer(
+            md_escape(f"Слишком много сообщений, {mute:.0f} с сообщения не будут переданы")
+        )
+    if verdict == BLOCK:
+        logger.warning("Block %s for flooding", item_str(user))
+        ul = users_lists()
+        ul.block(user.id)
+        ul.save()
+        _ = await lobby_send_message(
+            md_escape(f"Пользователь {user.id} {user.full_name} заблокирован за флуд")
+        )
+        return await message.answer("Бот не будет передавать твои сообщения")
+    return None
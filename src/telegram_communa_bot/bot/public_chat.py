@@ -7,24 +7,23 @@ from ..logging_setup import setup_logging
 
 logger = setup_logging(__file__)
 
-from aiogram import F, Router
-from aiogram.enums import ChatType
+from aiogram import Router
 from aiogram.types import Message
 from aiogram.filters import Command
 
 
-from .app_data import AppData
+from .app_data import app_data
+from .routing import GROUP, LOBBY, ChatKindFilter
 
 
+# gets messages of groups only, see `bot.routing`
 router_public_chat = Router(name="public_chat")
-router_public_chat.message.filter(
-    F.chat.type.in_({ChatType.GROUP, ChatType.SUPERGROUP})
-)
+_ = router_public_chat.message.filter(ChatKindFilter(LOBBY, GROUP))
 
 
 @router_public_chat.message(Command("start"))
 async def cmd_start(message: Message):
-    data = AppData.get()
+    data = app_data()
     data.new_chat_id = message.chat.id
 
     _ = await message.answer(
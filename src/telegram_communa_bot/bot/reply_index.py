@@ -0,0 +1,117 @@
+"""
+Reply routing index: lobby message id -> original sender.
+
+A memory-mapped file of fixed-width records, addressed directly by the
+lobby message id shifted by the lobby chat id, modulo `capacity`. Message
+ids in a chat only grow, so a new record simply overwrites the oldest one
+in its slot: lookups and inserts are O(1) and the file never grows past
+`capacity` records.
+
+Each record keeps its lobby chat id and a lookup compares it: with
+`BOT_TENANTS` the lobbies of all tenants share the file and its capacity,
+and records of a lobby that was moved are just never matched again. The
+map is shared by worker processes too, nothing is kept in the object.
+"""
+
+from ..logging_setup import setup_logging
+
+logger = setup_logging(__file__)
+
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+
+from ..settings import settings
+
+INDEX_FILE_NAME = "reply_index.bin"
+
+MAGIC = b"RIDX"
+VERSION = 2
+# magic, version, capacity
+HEADER = struct.Struct("<4sIq")
+# lobby chat id, lobby message id, user id, original message id, unix time
+RECORD = struct.Struct("<qqqqq")
+# spreads the message ids of lobbies over the slots
+CHAT_STRIDE = 0x9E3779B1
+
+
+class ReplyIndex:
+    def __init__(self, path: Path, capacity: int, max_age: float):
+        self.path: Path = path
+        self.capacity: int = max(1, capacity)
+        self.max_age: float = max_age
+
+        size = HEADER.size + self.capacity * RECORD.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fresh = os.fstat(fd).st_size != size
+            if fresh:
+                # sparse, reads as zeroes
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+            self._mm: mmap.mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        magic, version, capacity = HEADER.unpack_from(self._mm, 0)
+        if fresh or magic != MAGIC or version != VERSION or capacity != self.capacity:
+            if not fresh:
+                logger.warning("Reply index %s has other format, start a new one", path)
+                self._mm[:] = bytes(size)
+            HEADER.pack_into(self._mm, 0, MAGIC, VERSION, self.capacity)
+
+    def _offset(self, chat_id: int, message_id: int) -> int:
+        slot = (message_id + chat_id * CHAT_STRIDE) % self.capacity
+        return HEADER.size + slot * RECORD.size
+
+    def record(
+        self, lobby_chat_id: int, lobby_message_id: int, user_id: int, message_id: int
+    ) -> None:
+        RECORD.pack_into(
+            self._mm,
+            self._offset(lobby_chat_id, lobby_message_id),
+            lobby_chat_id,
+            lobby_message_id,
+            user_id,
+            message_id,
+            int(time.time()),
+        )
+
+    def lookup(self, lobby_chat_id: int, lobby_message_id: int) -> tuple[int, int] | None:
+        """Return `(user_id, original message id)` for a lobby message"""
+        chat_id, stored_id, user_id, message_id, stamp = RECORD.unpack_from(
+            self._mm, self._offset(lobby_chat_id, lobby_message_id)
+        )
+        if chat_id != lobby_chat_id or stored_id != lobby_message_id or not user_id:
+            return None
+        if self.max_age and time.time() - stamp > self.max_age:
+            return None
+        return user_id, message_id
+
+    def close(self) -> None:
+        self._mm.flush()
+        self._mm.close()
+
+
+_reply_index: ReplyIndex | None = None
+
+
+def reply_index() -> ReplyIndex:
+    global _reply_index
+    if not _reply_index:
+        cfg = settings()
+        _reply_index = ReplyIndex(
+            cfg.data_path.joinpath(INDEX_FILE_NAME),
+            cfg.reply_index_size,
+            cfg.reply_index_max_age,
+        )
+    return _reply_index
+
+
+def close_reply_index() -> None:
+    global _reply_index
+    if _reply_index:
+        _reply_index.close()
+        _reply_index = None
@@ -0,0 +1,93 @@
+"""
+Pre-dispatch of messages by chat.
+
+`ChatKindMiddleware` classifies the chat of an update once, by a dict
+lookup of `chat.id` (admin and lobby chats) or `chat.type`, and puts the
+kind in the handler data as `chat_kind`. Each router takes the kinds it
+serves with `ChatKindFilter` as a filter of its message observer: a set
+lookup, and the routers of other kinds skip their handlers entirely. The
+id table is rebuilt only when the lobby or admin id changes. Other update
+types go through all routers as usual.
+
+Routers are included in the order messages of a kind go through them:
+admin, lobby, private, public chats, default; the admin chat falls
+through to the private routers, the lobby to the public ones.
+"""
+
+from ..logging_setup import RateLimitedLog, setup_logging
+
+logger = setup_logging(__file__)
+_trace = RateLimitedLog(logger)
+
+from collections.abc import Awaitable, Callable
+from typing import Any, override
+
+from aiogram import BaseMiddleware
+from aiogram.enums import ChatType
+from aiogram.filters import BaseFilter
+from aiogram.types import Chat, Message, TelegramObject
+
+ADMIN = "admin"
+LOBBY = "lobby"
+PRIVATE = "private"
+GROUP = "group"
+OTHER = "other"
+
+# key of the kind in the handler data
+CHAT_KIND = "chat_kind"
+
+_BY_TYPE = {
+    ChatType.PRIVATE: PRIVATE,
+    ChatType.GROUP: GROUP,
+    ChatType.SUPERGROUP: GROUP,
+}
+
+
+class ChatKinds:
+    def __init__(self, lobby_id: Callable[[], int], admin_id: Callable[[], int]):
+        self.lobby_id: Callable[[], int] = lobby_id
+        self.admin_id: Callable[[], int] = admin_id
+
+        self._by_id: dict[int, str] = {}
+        self._stamp: tuple[int, int] | None = None
+
+    def classify(self, chat: Chat) -> str:
+        stamp = (self.lobby_id(), self.admin_id())
+        if stamp != self._stamp:
+            lobby_id, admin_id = stamp
+            self._by_id = {x: k for x, k in ((lobby_id, LOBBY), (admin_id, ADMIN)) if x}
+            self._stamp = stamp
+            logger.debug("Dispatch table: %s", self._by_id)
+
+        return self._by_id.get(chat.id) or _BY_TYPE.get(chat.type, OTHER)
+
+
+class ChatKindMiddleware(BaseMiddleware):
+    """Outer update middleware, after the tenant: the lobby id is its own"""
+
+    def __init__(self, kinds: ChatKinds):
+        self.kinds: ChatKinds = kinds
+
+    @override
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        chat: Chat | None = data.get("event_chat")
+        if chat:
+            kind = data[CHAT_KIND] = self.kinds.classify(chat)
+            _trace("Update in chat %s dispatched as %s", chat.id, kind)
+        return await handler(event, data)
+
+
+class ChatKindFilter(BaseFilter):
+    """Messages of chats of `kinds`, for `router.message.filter()`"""
+
+    def __init__(self, *kinds: str):
+        self.kinds: frozenset[str] = frozenset(kinds)
+
+    @override
+    async def __call__(self, message: Message, chat_kind: str | None = None) -> bool:
+        return chat_kind in self.kinds
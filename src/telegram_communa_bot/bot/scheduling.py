@@ -0,0 +1,187 @@
+"""
+Ordered handling of updates with bounded concurrency.
+
+`UpdateScheduler` is an outer update middleware. Updates of one chat are
+handled one at a time, in the order they arrived: two quick messages of a
+user reach the lobby in order, and the handlers of a lobby don't
+interleave their changes of `UsersLists` around `await`. Updates without
+a chat are ordered by their sender, ones without either are not ordered.
+
+At most `BOT_HANDLER_CONCURRENCY` handlers run at once. Updates waiting
+for a slot are served by lane, lobby and admin updates (`HIGH`) ahead of
+private chats (`NORMAL`), so a flood of private messages doesn't hold up
+moderation.
+
+Once `BOT_HANDLER_QUEUE` updates are in the scheduler, waiting or
+running, receivers stop taking new ones until there is `room()`: the
+poller doesn't fetch, the webhook answers 429.
+"""
+
+from ..logging_setup import setup_logging
+
+logger = setup_logging(__file__)
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable, Iterator
+from dataclasses import dataclass
+from typing import Any, override
+
+from aiogram import BaseMiddleware
+from aiogram.types import Chat, TelegramObject, User
+
+from ..metrics import HANDLER_WAIT
+from ..settings import settings
+from .outbound import LANES, chat_lane
+
+
+@dataclass
+class SchedulerStats:
+    handled: int = 0
+    # waited for an earlier update of their chat
+    ordered: int = 0
+    # waited for a free slot
+    queued: int = 0
+    # times a receiver waited for room
+    paused: int = 0
+
+
+class UpdateScheduler(BaseMiddleware):
+    def __init__(self, concurrency: int, max_pending: int):
+        self.concurrency: int = max(1, concurrency)
+        self.max_pending: int = max(self.concurrency, max_pending)
+        self.stats: SchedulerStats = SchedulerStats()
+        self.running: int = 0
+
+        # chat -> turns of its waiting updates, one more is being handled
+        self._chats: dict[int, deque[asyncio.Future[None]]] = {}
+        # updates waiting for a slot: (lane, seq, future)
+        self._slots: list[tuple[int, int, asyncio.Future[None]]] = []
+        self._seq: Iterator[int] = itertools.count()
+        self._pending: int = 0
+        self._room: asyncio.Event = asyncio.Event()
+        self._room.set()
+
+    @property
+    def pending(self) -> int:
+        """Updates in the scheduler, waiting or running"""
+        return self._pending
+
+    @property
+    def depth(self) -> int:
+        """Updates waiting for their chat or for a slot"""
+        return self._pending - self.running
+
+    @property
+    def saturated(self) -> bool:
+        return self._pending >= self.max_pending
+
+    async def room(self) -> None:
+        """Wait until the scheduler takes more updates"""
+        # updates just handed over reach the scheduler first
+        await asyncio.sleep(0)
+        if not self.saturated:
+            return
+        self.stats.paused += 1
+        while self.saturated:
+            self._room.clear()
+            _ = await self._room.wait()
+
+    @override
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        chat: Chat | None = data.get("event_chat")
+        user: User | None = data.get("event_from_user")
+        key = chat.id if chat else user.id if user else None
+        lane = chat_lane(chat)
+
+        start = time.monotonic()
+        self._pending += 1
+        try:
+            if key is not None:
+                await self._take_turn(key)
+            try:
+                await self._take_slot(lane)
+                try:
+                    HANDLER_WAIT.observe(time.monotonic() - start, LANES[lane])
+                    self.stats.handled += 1
+                    return await handler(event, data)
+                finally:
+                    self._release_slot()
+            finally:
+                if key is not None:
+                    self._pass_turn(key)
+        finally:
+            self._pending -= 1
+            if not self.saturated:
+                self._room.set()
+
+    async def _take_turn(self, key: int) -> None:
+        turns = self._chats.get(key)
+        if turns is None:
+            self._chats[key] = deque()
+            return
+
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        turns.append(future)
+        self.stats.ordered += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the turn was handed over already
+                self._pass_turn(key)
+            raise
+
+    def _pass_turn(self, key: int) -> None:
+        turns = self._chats[key]
+        while turns:
+            future = turns.popleft()
+            # skip cancelled updates
+            if not future.done():
+                future.set_result(None)
+                return
+        del self._chats[key]
+
+    async def _take_slot(self, lane: int) -> None:
+        # while some wait, every slot is taken
+        if not self._slots and self.running < self.concurrency:
+            self.running += 1
+            return
+
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._slots, (lane, next(self._seq), future))
+        self.stats.queued += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release_slot()
+            raise
+
+    def _release_slot(self) -> None:
+        """Hand the slot to the next waiting update, highest lane first"""
+        while self._slots:
+            _, _, future = heapq.heappop(self._slots)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.running -= 1
+
+
+_scheduler: UpdateScheduler | None = None
+
+
+def scheduler() -> UpdateScheduler:
+    global _scheduler
+    if not _scheduler:
+        cfg = settings()
+        _scheduler = UpdateScheduler(cfg.handler_concurrency, cfg.handler_queue)
+    return _scheduler
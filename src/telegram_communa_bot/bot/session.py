@@ -0,0 +1,232 @@
+"""
+HTTP session of the bot: aiogram's aiohttp session with a sized
+connection pool, keep-alive and DNS cache, per-call timeouts and a
+circuit breaker.
+
+Regular calls get `BOT_API_TIMEOUT`, `getUpdates` gets its long-poll
+wait on top of it, so a slow `getChat` can't hang a handler for the
+minute aiogram allows by default. After `BOT_API_BREAKER_THRESHOLD`
+failures in a row (network errors, timeouts, 5xx) requests fail at once
+for `BOT_API_BREAKER_RESET` seconds, then single requests probe the API
+until one gets an answer.
+"""
+
+from ..logging_setup import setup_logging
+
+logger = setup_logging(__file__)
+
+import time
+from collections.abc import Callable
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Any, cast, override
+
+from aiogram import __version__ as aiogram_version
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from aiogram.exceptions import TelegramNetworkError
+from aiogram.methods import GetUpdates, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiohttp import (
+    ClientError,
+    ClientSession,
+    ClientTimeout,
+    TraceConfig,
+    TraceConnectionCreateEndParams,
+    TraceConnectionReuseconnParams,
+    TraceDnsCacheHitParams,
+    TraceDnsCacheMissParams,
+)
+from aiohttp.hdrs import USER_AGENT
+from aiohttp.http import SERVER_SOFTWARE
+
+from ..metrics import API_CONNECTIONS, API_FAILURES
+from ..settings import Settings
+
+if TYPE_CHECKING:
+    from aiogram import Bot
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        threshold: int,
+        reset_after: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        # 0 never opens the circuit
+        self.threshold: int = threshold
+        self.reset_after: float = reset_after
+        self.failures: int = 0
+        self.opened_at: float | None = None
+
+        self._clock: Callable[[], float] = clock
+        self._probing: bool = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self._probing or self._clock() - self.opened_at < self.reset_after:
+            return False
+        self._probing = True
+        return True
+
+    def success(self) -> None:
+        if self.opened_at is not None:
+            logger.info("Bot API answers again, close the circuit")
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if not self.threshold or self.failures < self.threshold:
+            return
+        if self.opened_at is None:
+            logger.warning(
+                "%d Bot API failures in a row, fail requests for %.0fs",
+                self.failures,
+                self.reset_after,
+            )
+        self.opened_at = self._clock()
+
+    def release(self) -> None:
+        """The request was cancelled, let another one probe"""
+        self._probing = False
+
+
+async def _on_connection_created(
+    _: ClientSession, __: SimpleNamespace, ___: TraceConnectionCreateEndParams
+) -> None:
+    API_CONNECTIONS.inc("created")
+
+
+async def _on_connection_reused(
+    _: ClientSession, __: SimpleNamespace, ___: TraceConnectionReuseconnParams
+) -> None:
+    API_CONNECTIONS.inc("reused")
+
+
+async def _on_dns_hit(
+    _: ClientSession, __: SimpleNamespace, ___: TraceDnsCacheHitParams
+) -> None:
+    API_CONNECTIONS.inc("dns_cache_hit")
+
+
+async def _on_dns_miss(
+    _: ClientSession, __: SimpleNamespace, ___: TraceDnsCacheMissParams
+) -> None:
+    API_CONNECTIONS.inc("dns_cache_miss")
+
+
+def trace_config() -> TraceConfig:
+    trace = TraceConfig()
+    trace.on_connection_create_end.append(_on_connection_created)
+    trace.on_connection_reuseconn.append(_on_connection_reused)
+    trace.on_dns_cache_hit.append(_on_dns_hit)
+    trace.on_dns_cache_miss.append(_on_dns_miss)
+    return trace
+
+
+class TunedSession(AiohttpSession):
+    def __init__(
+        self,
+        api: TelegramAPIServer = PRODUCTION,
+        pool_size: int = 100,
+        keepalive: float = 30.0,
+        dns_ttl: int = 300,
+        timeout: float = 10.0,
+        connect_timeout: float = 5.0,
+        breaker: CircuitBreaker | None = None,
+    ):
+        super().__init__(api=api, limit=pool_size, timeout=timeout)
+        self.connect_timeout: float = connect_timeout
+        self.breaker: CircuitBreaker = breaker or CircuitBreaker(0, 0.0)
+        self._connector_init.update(
+            limit_per_host=pool_size,
+            keepalive_timeout=keepalive,
+            ttl_dns_cache=dns_ttl,
+        )
+
+    @override
+    async def create_session(self) -> ClientSession:
+        if self._should_reset_connector:
+            await self.close()
+
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(
+                connector=self._connector_type(**self._connector_init),
+                headers={USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{aiogram_version}"},
+                trace_configs=[trace_config()],
+            )
+            self._should_reset_connector = False
+
+        return self._session
+
+    def timeout_for(self, method: TelegramMethod[Any], timeout: int | None) -> float:
+        if isinstance(method, GetUpdates):
+            # the long-poll wait is not a slow answer
+            return (method.timeout or 0) + self.timeout
+        return self.timeout if timeout is None else timeout
+
+    @override
+    async def make_request(
+        self,
+        bot: "Bot",
+        method: TelegramMethod[TelegramType],
+        timeout: int | None = None,
+    ) -> TelegramType:
+        if not self.breaker.allow():
+            API_FAILURES.inc("rejected")
+            raise TelegramNetworkError(method=method, message="Bot API is failing, not sent")
+
+        try:
+            session = await self.create_session()
+            url = self.api.api_url(token=bot.token, method=method.__api_method__)
+            form = self.build_form_data(bot=bot, method=method)
+            budget = ClientTimeout(
+                total=self.timeout_for(method, timeout), sock_connect=self.connect_timeout
+            )
+            async with session.post(url, data=form, timeout=budget) as resp:
+                raw_result = await resp.text()
+        except TimeoutError as e:
+            API_FAILURES.inc("timeout")
+            self.breaker.failure()
+            raise TelegramNetworkError(method=method, message="Request timeout error") from e
+        except ClientError as e:
+            API_FAILURES.inc("network")
+            self.breaker.failure()
+            raise TelegramNetworkError(
+                method=method, message=f"{type(e).__name__}: {e}"
+            ) from e
+        except BaseException:
+            # cancelled, or failed here: reading a file to upload and such
+            self.breaker.release()
+            raise
+
+        if resp.status >= 500:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+
+        response = self.check_response(
+            bot=bot, method=method, status_code=resp.status, content=raw_result
+        )
+        return cast(TelegramType, response.result)
+
+
+def create_session(settings: Settings) -> TunedSession:
+    api = TelegramAPIServer.from_base(settings.api_url) if settings.api_url else PRODUCTION
+    return TunedSession(
+        api=api,
+        pool_size=settings.api_pool_size,
+        keepalive=settings.api_keepalive,
+        dns_ttl=settings.api_dns_ttl,
+        timeout=settings.api_timeout,
+        connect_timeout=settings.api_connect_timeout,
+        breaker=CircuitBreaker(settings.api_breaker_threshold, settings.api_breaker_reset),
+    )
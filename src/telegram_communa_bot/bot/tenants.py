@@ -0,0 +1,229 @@
+"""
+Many lobbies in one process.
+
+With `BOT_TENANTS` every lobby is a tenant with its own `AppData`,
+`UsersLists` and the rest of the stores in `<BOT_DATA_PATH>/tenants/<name>`.
+`TenantMiddleware` resolves the tenant of an update and makes it current
+for the handlers, so `app_data()` and friends return its stores:
+
+- by the bot that received it, for tenants with a bot of their own
+  (`BOT_TENANT_TOKENS`);
+- by the lobby chat, see `/lobby` of the admin;
+- in a private chat, by the lobby the user joined with `/start <lobby>`,
+  the deep link `t.me/<bot>?start=<lobby>`.
+
+Updates of no tenant use the stores in `BOT_DATA_PATH` as before.
+
+Stores are loaded on first use. At most `BOT_TENANTS_LOADED` tenants stay
+in memory: idle ones are flushed and unloaded, least recently used first;
+an idle tenant costs its entries in the index only.
+"""
+
+from ..logging_setup import setup_logging
+
+logger = setup_logging(__file__)
+
+import asyncio
+import inspect
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, override
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.enums import ChatType
+from aiogram.types import Chat, TelegramObject, Update, User
+
+from ..persistent import Persistent, Tenant, using_tenant, write_behind
+from ..settings import settings
+from .broadcast import start_broadcast
+
+TENANTS_DIR = "tenants"
+TENANTS_FILE_PATH = "tenants.json"
+START = "/start "
+
+
+class TenantIndex(Persistent):
+    # lobby chat id -> tenant
+    lobbies: dict[int, str] = {}
+    # user -> tenant of the lobby they joined with `/start <lobby>`
+    users: dict[int, str] = {}
+
+    @override
+    @classmethod
+    def _file_name(cls) -> str:
+        return TENANTS_FILE_PATH
+
+
+@dataclass
+class TenantStats:
+    routed: int = 0
+    loads: int = 0
+    evictions: int = 0
+    # evictions put off, the tenant got busy or its flush failed
+    kept: int = 0
+
+
+class Tenants:
+    def __init__(self, root: Path, max_loaded: int):
+        self.root: Path = root.joinpath(TENANTS_DIR)
+        self.max_loaded: int = max(1, max_loaded)
+        self.stats: TenantStats = TenantStats()
+
+        with using_tenant(None):
+            self.index: TenantIndex = TenantIndex.load()
+        self._tenants: dict[str, Tenant] = {}
+        self._by_bot: dict[int, Tenant] = {}
+        # loaded tenants, least recently used first
+        self._loaded: OrderedDict[str, Tenant] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len({*self.index.lobbies.values(), *(x.name for x in self._by_bot.values())})
+
+    @property
+    def loaded(self) -> int:
+        return len(self._loaded)
+
+    def tenant(self, name: str) -> Tenant:
+        tenant = self._tenants.get(name)
+        if not tenant:
+            tenant = self._tenants[name] = Tenant(name, self.root.joinpath(name), self._on_load)
+        return tenant
+
+    def bots(self) -> list[Tenant]:
+        return list(self._by_bot.values())
+
+    def add_bot(self, name: str, bot: Bot) -> Tenant:
+        tenant = self.tenant(name)
+        tenant.bot = bot
+        self._by_bot[bot.id] = tenant
+        return tenant
+
+    def add_lobby(self, chat_id: int, tenant: Tenant) -> None:
+        """Route `chat_id` and the users who join it to `tenant`"""
+        index = self.index
+        for old in [x for x, name in index.lobbies.items() if name == tenant.name]:
+            index.pop_from("lobbies", old)
+        index.put_in("lobbies", chat_id, tenant.name)
+        index.save()
+
+    def join(self, user_id: int, name: str) -> Tenant | None:
+        """`/start <name>` in a private chat, None for an unknown lobby"""
+        if name not in self.index.lobbies.values():
+            return None
+        if self.index.users.get(user_id) != name:
+            self.index.put_in("users", user_id, name)
+            self.index.save()
+        return self.tenant(name)
+
+    def resolve(self, bot_id: int, chat: Chat | None, user: User | None) -> Tenant | None:
+        self.stats.routed += 1
+        tenant = self._by_bot.get(bot_id)
+        if tenant or not chat:
+            return tenant
+
+        name = self.index.lobbies.get(chat.id)
+        if name is None and chat.type == ChatType.PRIVATE and user:
+            name = self.index.users.get(user.id)
+        return self.tenant(name) if name is not None else None
+
+    def touch(self, tenant: Tenant) -> None:
+        if tenant.name in self._loaded:
+            self._loaded.move_to_end(tenant.name)
+
+    def _on_load(self, tenant: Tenant) -> None:
+        logger.debug("Load tenant %s", tenant.name)
+        self._loaded[tenant.name] = tenant
+        self.stats.loads += 1
+
+    async def evict(self) -> None:
+        """Unload idle tenants over `max_loaded`, least recently used first"""
+        excess = len(self._loaded) - self.max_loaded
+        if excess <= 0:
+            return
+        victims = [x for x in self._loaded.values() if not x.active][:excess]
+        if not victims:
+            return
+
+        for tenant in victims:
+            await _close_resources(tenant)
+        engine = write_behind()
+        if engine:
+            await engine.flush()
+
+        for tenant in victims:
+            # busy again, or the changes are still to be written
+            if tenant.active or (engine and any(engine.is_dirty(x) for x in tenant.stores())):
+                self.stats.kept += 1
+                continue
+            if self._loaded.pop(tenant.name, None):
+                tenant.unload()
+                self.stats.evictions += 1
+                logger.debug("Unload tenant %s", tenant.name)
+
+    async def close(self) -> None:
+        """Stop what the loaded tenants run, their stores are flushed with the rest"""
+        for tenant in list(self._loaded.values()):
+            await _close_resources(tenant)
+        logger.info("Tenant stats: %s, %d loaded of %d", self.stats, self.loaded, len(self))
+
+
+async def _close_resources(tenant: Tenant) -> None:
+    with using_tenant(tenant):
+        for name, resource in list(tenant.resources.items()):
+            if isinstance(resource, asyncio.Task):
+                _ = resource.cancel()
+                _ = await asyncio.gather(resource, return_exceptions=True)
+            elif hasattr(resource, "close"):
+                result = resource.close()
+                if inspect.isawaitable(result):
+                    await result
+            if tenant.resources.get(name) is resource:
+                del tenant.resources[name]
+
+
+_tenants: Tenants | None = None
+
+
+def tenants() -> Tenants:
+    global _tenants
+    # not `if not`, it has a length
+    if _tenants is None:
+        cfg = settings()
+        _tenants = Tenants(cfg.data_path, cfg.tenants_loaded)
+    return _tenants
+
+
+class TenantMiddleware(BaseMiddleware):
+    """Make the tenant of an update current while it is handled"""
+
+    @override
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        registry = tenants()
+        bot: Bot = data["bot"]
+        chat: Chat | None = data.get("event_chat")
+        user: User | None = data.get("event_from_user")
+
+        message = event.message if isinstance(event, Update) else None
+        if message and message.text and message.text.startswith(START) and user:
+            if message.chat.type == ChatType.PRIVATE:
+                _ = registry.join(user.id, message.text[len(START) :].strip())
+
+        tenant = registry.resolve(bot.id, chat, user)
+        if not tenant:
+            return await handler(event, data)
+
+        registry.touch(tenant)
+        with tenant.hold(), using_tenant(tenant):
+            if not tenant.loaded:
+                # a broadcast cut by a restart or an eviction goes on
+                start_broadcast()
+            result = await handler(event, data)
+        await registry.evict()
+        return result
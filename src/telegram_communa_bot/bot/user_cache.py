@@ -0,0 +1,132 @@
+"""
+User profile cache in front of `get_chat` lookups.
+
+Entries expire after a TTL and the least recently used ones are evicted
+once the cache is full. Users Telegram doesn't know (`fetch` returns
+None) are cached for a shorter time; errors such as network failures or
+flood waits are raised to every waiting caller and not cached.
+Concurrent lookups of one id share one request and cold fetches are
+capped by a semaphore.
+"""
+
+from ..logging_setup import setup_logging
+
+logger = setup_logging(__file__)
+
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Any, override
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+from ..settings import settings
+
+Fetch = Callable[[int], Awaitable[User | None]]
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    negative_hits: int = 0
+    # lookups served by a request already in flight
+    coalesced: int = 0
+    fetches: int = 0
+    evictions: int = 0
+
+
+class UserCache:
+    def __init__(self, ttl: float, negative_ttl: float, max_size: int, concurrency: int):
+        self.ttl: float = ttl
+        self.negative_ttl: float = negative_ttl
+        self.max_size: int = max(1, max_size)
+        self.stats: CacheStats = CacheStats()
+
+        # user_id -> (expires_at, user or None for failed lookups)
+        self._entries: OrderedDict[int, tuple[float, User | None]] = OrderedDict()
+        self._inflight: dict[int, asyncio.Task[User | None]] = {}
+        self._semaphore: asyncio.Semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def put(self, user: User) -> None:
+        self._store(user.id, user, self.ttl)
+
+    def _store(self, user_id: int, user: User | None, ttl: float) -> None:
+        self._entries[user_id] = (time.monotonic() + ttl, user)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            _ = self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    async def get(self, user_id: int, fetch: Fetch) -> User | None:
+        entry = self._entries.get(user_id)
+        if entry:
+            expires_at, user = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(user_id)
+                if user:
+                    self.stats.hits += 1
+                else:
+                    self.stats.negative_hits += 1
+                return user
+            del self._entries[user_id]
+
+        task = self._inflight.get(user_id)
+        if task:
+            self.stats.coalesced += 1
+        else:
+            self.stats.misses += 1
+            task = asyncio.create_task(self._fetch(user_id, fetch))
+            self._inflight[user_id] = task
+
+        # one cancelled caller must not cancel the request for the others
+        return await asyncio.shield(task)
+
+    async def _fetch(self, user_id: int, fetch: Fetch) -> User | None:
+        try:
+            async with self._semaphore:
+                self.stats.fetches += 1
+                user = await fetch(user_id)
+        finally:
+            del self._inflight[user_id]
+
+        self._store(user_id, user, self.ttl if user else self.negative_ttl)
+        return user
+
+
+_user_cache: UserCache | None = None
+
+
+def user_cache() -> UserCache:
+    global _user_cache
+    if not _user_cache:
+        cfg = settings()
+        _user_cache = UserCache(
+            ttl=cfg.user_cache_ttl,
+            negative_ttl=cfg.user_cache_negative_ttl,
+            max_size=cfg.user_cache_size,
+            concurrency=cfg.user_fetch_concurrency,
+        )
+    return _user_cache
+
+
+class UserCacheMiddleware(BaseMiddleware):
+    """Feed the cache with the sender of every incoming update"""
+
+    @override
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        user: User | None = data.get("event_from_user")
+        if user and not user.is_bot:
+            user_cache().put(user)
+        return await handler(event, data)
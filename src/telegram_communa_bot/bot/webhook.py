@@ -0,0 +1,162 @@
+"""
+Webhook delivery mode.
+
+Updates are accepted by an aiohttp app, answered with 200 right away and
+processed in background tasks. When too many updates are in flight, or
+the handlers are behind (see `bot.scheduling`), the server answers 429,
+and Telegram delivers the update again later.
+"""
+
+from ..logging_setup import setup_logging
+
+logger = setup_logging(__file__)
+
+import asyncio
+import hmac
+import signal
+import time
+from collections.abc import Awaitable, Callable
+from contextlib import suppress
+from functools import partial
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+from ..settings import Settings
+from .scheduling import scheduler
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+Feed = Callable[[dict[str, Any]], Awaitable[Any]]
+
+
+class WebhookServer:
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        secret: str | None,
+        max_inflight: int,
+        feed: Feed | None = None,
+    ):
+        self.dp: Dispatcher = dp
+        self.bot: Bot = bot
+        # where raw updates go, the dispatcher by default
+        self.feed: Feed = feed or partial(dp.feed_raw_update, bot)
+        self.secret: str | None = secret
+        self.max_inflight: int = max(1, max_inflight)
+        self.ready: bool = False
+        self.rejected: int = 0
+
+        self._inflight: set[asyncio.Task[None]] = set()
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    def app(self, path: str) -> web.Application:
+        app = web.Application()
+        _ = app.router.add_post(path, self.handle_update)
+        _ = app.router.add_get("/healthz", self.liveness)
+        _ = app.router.add_get("/readyz", self.readiness)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), self.secret
+        ):
+            return web.Response(status=401)
+
+        if len(self._inflight) >= self.max_inflight or scheduler().saturated:
+            self.rejected += 1
+            return web.Response(status=429, headers={"Retry-After": "1"})
+
+        try:
+            update: dict[str, Any] = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        task = asyncio.create_task(self._process(update))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+        return web.Response()
+
+    async def _process(self, update: dict[str, Any]) -> None:
+        try:
+            _ = await self.feed(update)
+        except Exception:
+            logger.exception("Failed to process update %s", update.get("update_id"))
+
+    async def liveness(self, _: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def readiness(self, _: web.Request) -> web.Response:
+        if not self.ready:
+            return web.Response(status=503, text="not ready")
+        return web.Response(text="ok")
+
+    async def drain(self, timeout: float) -> None:
+        """Wait for in-flight updates, cancel the ones left at the deadline"""
+        start = time.monotonic()
+        inflight = set(self._inflight)
+        if not inflight:
+            return
+
+        _, pending = await asyncio.wait(inflight, timeout=timeout)
+        for task in pending:
+            _ = task.cancel()
+        _ = await asyncio.gather(*pending, return_exceptions=True)
+        # Telegram got 200 for them, they are not delivered again
+        logger.info(
+            "Drained %d updates in %.2fs, %d dropped",
+            len(inflight) - len(pending),
+            time.monotonic() - start,
+            len(pending),
+        )
+
+
+async def run_webhook(
+    dp: Dispatcher, bot: Bot, settings: Settings, feed: Feed | None = None
+) -> None:
+    """Serve updates until SIGTERM/SIGINT"""
+    server = WebhookServer(
+        dp, bot, settings.webhook_secret, settings.webhook_max_inflight, feed
+    )
+    runner = web.AppRunner(server.app(settings.webhook_path))
+    await runner.setup()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        site = web.TCPSite(runner, settings.webhook_host, settings.webhook_port)
+        await site.start()
+        logger.info(
+            "Serve webhook on %s:%s%s",
+            settings.webhook_host,
+            settings.webhook_port,
+            settings.webhook_path,
+        )
+
+        if settings.webhook_url:
+            _ = await bot.set_webhook(
+                url=settings.webhook_url.rstrip("/") + settings.webhook_path,
+                secret_token=settings.webhook_secret,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=min(100, settings.webhook_max_inflight),
+            )
+
+        server.ready = True
+        _ = await stop.wait()
+    finally:
+        server.ready = False
+        await runner.cleanup()
+        await server.drain(settings.drain_timeout)
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
@@ -0,0 +1,499 @@
+"""
+Scale-out mode: one receiver process and `BOT_WORKERS` worker processes.
+
+The receiver takes updates as raw JSON, by polling or webhook, and hands
+each one to the worker picked by its chat id, so the updates of a chat
+always reach the same worker in order. Workers parse the updates and run
+the usual dispatcher and routers.
+
+The receiver owns `AppData` and `UsersLists`. Workers keep replicas
+(`IpcStorage`) and send their changes, as journal ops, to the receiver.
+It applies and saves them, then sends the resulting state of everything
+the ops touched to every worker, so the replicas converge in the order
+the receiver applied the changes.
+
+Dead workers are started again. Updates for a worker that is down, and
+the ones it had not finished when it died, wait in the receiver and are
+handed to the new process before anything else, so an update may be
+handled twice but is not lost. In polling mode the offset confirmed to
+Telegram stays below the oldest waiting update.
+"""
+
+from ..logging_setup import setup_logging
+
+logger = setup_logging(__file__)
+
+import asyncio
+import json
+import multiprocessing
+import os
+import pickle
+import signal
+import socket
+from collections import deque
+from collections.abc import Awaitable, Callable
+from contextlib import suppress
+from dataclasses import dataclass, field
+from multiprocessing.process import BaseProcess
+from typing import Any, cast
+
+import aiohttp
+from aiogram import Bot, Dispatcher
+
+from ..journal import Op
+from ..persistent import Persistent, start_write_behind, stop_write_behind
+from ..settings import Settings, reset_settings, settings
+from ..storage import IpcStorage, close_storages, storage
+from .app_data import app_data, load_stores, users_lists
+from .bot import create_bot, create_dispatcher
+from .broadcast import broadcast_state, start_broadcast
+from .forwarding import forwarder
+from .globals import GlobalData
+from .instrumentation import start_metrics_server
+from .reply_index import close_reply_index
+from .webhook import run_webhook
+
+STORES: dict[str, Callable[[], Persistent]] = {
+    "AppData": app_data,
+    "UsersLists": users_lists,
+    "BroadcastState": broadcast_state,
+}
+
+Frame = tuple[Any, ...]
+Feed = Callable[[dict[str, Any]], Awaitable[None]]
+
+POLL_TIMEOUT = 30
+RESTART_DELAY = 1.0
+STOP_TIMEOUT = 10.0
+# updates kept for a worker that is down, later ones are dropped
+MAX_UNDELIVERED = 10_000
+
+
+def write_frame(writer: asyncio.StreamWriter, frame: Frame) -> None:
+    data = pickle.dumps(frame, protocol=pickle.HIGHEST_PROTOCOL)
+    writer.write(len(data).to_bytes(4, "big") + data)
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Frame:
+    size = int.from_bytes(await reader.readexactly(4), "big")
+    return pickle.loads(await reader.readexactly(size))
+
+
+def shard_key(update: dict[str, Any]) -> int:
+    """Chat id of an update, or user id for updates without a chat"""
+    for event in update.values():
+        if not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"]
+    return 0
+
+
+def apply_changes(obj: Persistent, ops: list[Op]) -> None:
+    for op, field, value in ops:
+        match op:
+            case "add":
+                obj.add_to(field, value)
+            case "discard":
+                obj.discard_from(field, value)
+            case "put":
+                obj.put_in(field, *value)
+            case "pop":
+                obj.pop_from(field, value)
+            case "set":
+                obj.set_field(field, value)
+            case _:
+                logger.error("Unknown op %s from a worker", op)
+    obj.save()
+
+
+def settle(obj: Persistent, ops: list[Op]) -> list[Op]:
+    """Current state of everything `ops` touched, as ops any replica can apply"""
+    result: dict[tuple[Any, ...], Op] = {}
+    for op, field, value in ops:
+        if op == "set":
+            result[(field,)] = ("set", field, getattr(obj, field))
+            continue
+        if op in ("put", "pop"):
+            key = value[0] if op == "put" else value
+            items = getattr(obj, field)
+            result[(field, key)] = (
+                ("put", field, [key, items[key]]) if key in items else ("pop", field, key)
+            )
+            continue
+
+        fields = obj.membership_fields if field in obj.membership_fields else (field,)
+        for name in fields:
+            present = value in getattr(obj, name)
+            result[(name, value)] = ("add" if present else "discard", name, value)
+    return list(result.values())
+
+
+def worker_env(settings: Settings) -> dict[str, str]:
+    count = settings.workers
+    return {
+        "BOT_WORKERS": "1",
+        "BOT_STORAGE": "ipc",
+        "BOT_SAVE_INTERVAL": "0",
+        "BOT_METRICS_PORT": "0",
+        # the send budgets are per bot, not per process
+        "BOT_GLOBAL_RATE": str(settings.global_rate / count),
+        "BOT_GROUP_RATE": str(settings.group_rate / count),
+        "BOT_USER_FETCH_CONCURRENCY": str(
+            max(1, settings.user_fetch_concurrency // count)
+        ),
+    }
+
+
+@dataclass
+class PoolStats:
+    dispatched: int = 0
+    # handed again to a restarted worker
+    redelivered: int = 0
+    dropped: int = 0
+    changes: int = 0
+    restarts: int = 0
+
+
+@dataclass
+class _Worker:
+    index: int
+    process: BaseProcess
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+    serving: asyncio.Task[None] | None = None
+    # update id -> update handed over and not finished yet
+    inflight: dict[int, dict[str, Any]] = field(default_factory=dict)
+
+    @property
+    def alive(self) -> bool:
+        return not self.writer.is_closing()
+
+
+class WorkerPool:
+    def __init__(self, count: int, env: dict[str, str]):
+        self.count: int = count
+        self.env: dict[str, str] = env
+        self.stats: PoolStats = PoolStats()
+
+        self._workers: list[_Worker | None] = [None] * count
+        # updates of each worker waiting for it to start again, oldest first
+        self._undelivered: list[deque[dict[str, Any]]] = [deque() for _ in range(count)]
+        self._closing: bool = False
+        self._context = multiprocessing.get_context("spawn")
+
+    async def start(self) -> None:
+        self._workers = list(
+            await asyncio.gather(*(self._spawn(index) for index in range(self.count)))
+        )
+        logger.info("Started %d workers", self.count)
+
+    async def _spawn(self, index: int) -> _Worker:
+        ours, theirs = socket.socketpair()
+        process = self._context.Process(
+            target=worker_main,
+            args=(index, theirs, self.env),
+            name=f"bot-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        theirs.close()
+
+        reader, writer = await asyncio.open_connection(sock=ours)
+        worker = _Worker(index, process, reader, writer)
+        snapshots = {name: get().model_dump(mode="json") for name, get in STORES.items()}
+        # a cut broadcast is resumed where lobby commands go
+        lobby = index == app_data().chat_id % self.count
+        write_frame(writer, ("snapshots", snapshots, lobby))
+        # updates wait in the receiver until the worker can take them
+        frame = await read_frame(reader)
+        if frame != ("ready",):
+            raise RuntimeError(f"Worker {index} failed to start: {frame[:1]}")
+        worker.serving = asyncio.create_task(self._serve(worker), name=f"worker-{index}")
+        # no await up to the caller taking the worker: these go ahead of new updates
+        self._redeliver(worker)
+        return worker
+
+    def unconfirmed(self) -> int | None:
+        """Oldest update id not handed to a live worker yet"""
+        ids = [x[0]["update_id"] for x in self._undelivered if x]
+        return min(ids) if ids else None
+
+    async def dispatch(self, update: dict[str, Any]) -> None:
+        index = shard_key(update) % self.count
+        worker = self._workers[index]
+        if not worker or not worker.alive:
+            self._keep(index, update)
+            return
+
+        self._send(worker, update)
+        self.stats.dispatched += 1
+        with suppress(ConnectionError):
+            await worker.writer.drain()
+
+    def _send(self, worker: _Worker, update: dict[str, Any]) -> None:
+        worker.inflight[update["update_id"]] = update
+        write_frame(worker.writer, ("update", update))
+
+    def _keep(self, index: int, update: dict[str, Any]) -> None:
+        undelivered = self._undelivered[index]
+        if len(undelivered) >= MAX_UNDELIVERED:
+            self.stats.dropped += 1
+            logger.warning("Worker %d is down, drop update %s", index, update["update_id"])
+            return
+        undelivered.append(update)
+
+    def _lost(self, worker: _Worker) -> None:
+        """Keep what a dead worker had not finished, ahead of what came since"""
+        self._undelivered[worker.index].extendleft(reversed(worker.inflight.values()))
+        worker.inflight = {}
+
+    def _redeliver(self, worker: _Worker) -> None:
+        undelivered = self._undelivered[worker.index]
+        if undelivered:
+            logger.info("Hand %d waiting updates to worker %d", len(undelivered), worker.index)
+        while undelivered:
+            self._send(worker, undelivered.popleft())
+            self.stats.redelivered += 1
+
+    async def _serve(self, worker: _Worker) -> None:
+        """Take changes from a worker, start it again when it dies"""
+        with suppress(asyncio.IncompleteReadError, ConnectionError):
+            while True:
+                self._handle(worker, await read_frame(worker.reader))
+
+        worker.writer.close()
+        if self._closing:
+            return
+
+        self._lost(worker)
+
+        await asyncio.to_thread(worker.process.join, STOP_TIMEOUT)
+        logger.error(
+            "Worker %d exited with %s, restart it", worker.index, worker.process.exitcode
+        )
+        self.stats.restarts += 1
+        await asyncio.sleep(RESTART_DELAY)
+        if not self._closing:
+            self._workers[worker.index] = await self._spawn(worker.index)
+
+    def _handle(self, worker: _Worker, frame: Frame) -> None:
+        match frame:
+            case ("done", int(update_id)):
+                _ = worker.inflight.pop(update_id, None)
+                return
+            case ("ops", str(name), list(ops)):
+                obj = STORES[name]()
+                apply_changes(obj, ops)
+                self._broadcast(("state", name, settle(obj, ops)))
+            case ("snapshot", str(name), dict(data)):
+                obj = STORES[name]()
+                obj.apply_snapshot(data)
+                obj.save()
+                self._broadcast(("snapshot", name, data))
+            case _:
+                logger.error("Unknown frame from worker %d: %s", worker.index, frame[:1])
+                return
+        self.stats.changes += 1
+
+    def _broadcast(self, frame: Frame) -> None:
+        for worker in self._workers:
+            if worker and worker.alive:
+                write_frame(worker.writer, frame)
+
+    async def stop(self) -> None:
+        self._closing = True
+        for worker in self._workers:
+            if worker and worker.alive:
+                write_frame(worker.writer, ("stop",))
+
+        for worker in self._workers:
+            if not worker:
+                continue
+            await asyncio.to_thread(worker.process.join, STOP_TIMEOUT)
+            if worker.process.is_alive():
+                logger.warning("Worker %d doesn't stop, kill it", worker.index)
+                worker.process.kill()
+            if worker.serving:
+                # changes made while draining are still applied
+                await worker.serving
+
+        logger.info("Worker pool stats: %s", self.stats)
+
+
+async def poll_raw(
+    bot: Bot,
+    allowed_updates: list[str],
+    feed: Feed,
+    unconfirmed: Callable[[], int | None] = lambda: None,
+) -> None:
+    """
+    Long-poll `getUpdates` without parsing the updates. The offset doesn't
+    pass `unconfirmed()`, updates fed already are skipped when they come
+    again.
+    """
+    url = bot.session.api.api_url(token=bot.token, method="getUpdates")
+    timeout = aiohttp.ClientTimeout(total=POLL_TIMEOUT + 10)
+    # last update fed
+    last: int | None = None
+
+    async with aiohttp.ClientSession(timeout=timeout) as http:
+        while True:
+            held = unconfirmed()
+            offset = held if held is not None else last + 1 if last is not None else None
+            payload = {
+                "timeout": str(POLL_TIMEOUT),
+                "allowed_updates": json.dumps(allowed_updates),
+            }
+            if offset is not None:
+                payload["offset"] = str(offset)
+
+            try:
+                async with http.post(url, data=payload) as response:
+                    body: dict[str, Any] = await response.json(content_type=None)
+            except (aiohttp.ClientError, TimeoutError, ValueError) as e:
+                logger.warning("getUpdates failed: %s", e)
+                await asyncio.sleep(1)
+                continue
+
+            if not body.get("ok"):
+                logger.warning("getUpdates failed: %s", body.get("description"))
+                await asyncio.sleep((body.get("parameters") or {}).get("retry_after", 1))
+                continue
+
+            updates: list[dict[str, Any]] = body["result"]
+            fresh = [x for x in updates if last is None or x["update_id"] > last]
+            for update in fresh:
+                last = update["update_id"]
+                await feed(update)
+            if updates and not fresh:
+                # all held for a worker starting again
+                await asyncio.sleep(RESTART_DELAY)
+
+
+async def _poll_until_stopped(bot: Bot, dp: Dispatcher, pool: WorkerPool) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+
+    _ = await bot.delete_webhook()
+    polling = asyncio.create_task(
+        poll_raw(bot, dp.resolve_used_update_types(), pool.dispatch, pool.unconfirmed)
+    )
+    try:
+        _ = await stop.wait()
+    finally:
+        _ = polling.cancel()
+        with suppress(asyncio.CancelledError):
+            await polling
+        await bot.session.close()
+
+
+async def run_pool(settings: Settings) -> None:
+    bot = create_bot(settings)
+    dp = create_dispatcher()
+
+    # loaded before the workers ask for them
+    await load_stores()
+    logger.info("AppData: %s", app_data())
+
+    _ = start_write_behind(settings.save_interval, settings.save_max_pending)
+    pool = WorkerPool(settings.workers, worker_env(settings))
+    metrics_runner = None
+    try:
+        if settings.metrics_port:
+            metrics_runner = await start_metrics_server(
+                settings.metrics_host, settings.metrics_port
+            )
+        await pool.start()
+
+        if settings.mode == "webhook":
+            return await run_webhook(dp, bot, settings, feed=pool.dispatch)
+        return await _poll_until_stopped(bot, dp, pool)
+    finally:
+        await pool.stop()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await stop_write_behind()
+        close_storages()
+
+
+def worker_main(index: int, sock: socket.socket, env: dict[str, str]) -> None:
+    """Entry point of a worker process"""
+    os.environ.update(env)
+    reset_settings()
+    # stopped by the receiver, not by Ctrl-C in the terminal
+    _ = signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_worker(index, sock))
+
+
+async def _feed(
+    dp: Dispatcher, bot: Bot, update: dict[str, Any], writer: asyncio.StreamWriter
+) -> None:
+    try:
+        _ = await dp.feed_raw_update(bot, update)
+    except Exception:
+        logger.exception("Failed to process update %s", update.get("update_id"))
+    finally:
+        # the receiver forgets it, it isn't handed again after a crash
+        write_frame(writer, ("done", update["update_id"]))
+
+
+async def _run_worker(index: int, sock: socket.socket) -> None:
+    reader, writer = await asyncio.open_connection(sock=sock)
+    _, snapshots, lobby = await read_frame(reader)
+
+    loop = asyncio.get_running_loop()
+    ipc = cast(IpcStorage, storage())
+    ipc.snapshots = snapshots
+    # write jobs may run outside the loop
+    ipc.send = lambda frame: loop.call_soon_threadsafe(write_frame, writer, frame)
+
+    cfg = settings()
+    bot = create_bot(cfg)
+    dp = create_dispatcher()
+    await GlobalData.init(cfg)
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    if lobby:
+        start_broadcast()
+    write_frame(writer, ("ready",))
+    logger.info("Worker %d started", index)
+
+    tasks: set[asyncio.Task[None]] = set()
+    try:
+        while True:
+            try:
+                frame = await read_frame(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                logger.error("Worker %d lost the receiver", index)
+                break
+
+            match frame:
+                case ("update", dict(update)):
+                    task = asyncio.create_task(_feed(dp, bot, update, writer))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                case ("state", str(name), list(ops)):
+                    STORES[name]().apply_ops(ops)
+                case ("snapshot", str(name), dict(data)):
+                    STORES[name]().apply_snapshot(data)
+                case ("stop",):
+                    break
+                case _:
+                    logger.error("Unknown frame in worker %d: %s", index, frame[:1])
+    finally:
+        if tasks:
+            _ = await asyncio.wait(tasks, timeout=STOP_TIMEOUT)
+        await forwarder().close()
+        close_reply_index()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
+        writer.close()
+        with suppress(ConnectionError):
+            await writer.wait_closed()
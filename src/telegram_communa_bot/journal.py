@@ -0,0 +1,78 @@
+"""
+Append-only mutation journal for Persistent stores.
+
+Every record is one JSON line `[op, field, value]`. The journal lives next
+to the snapshot and is folded into a fresh snapshot once it grows past
+a threshold.
+"""
+
+from .logging_setup import setup_logging
+
+logger = setup_logging(__file__)
+
+import json
+import os
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+from pydantic_core import to_jsonable_python
+
+Op = tuple[str, str, Any]
+
+
+def encode(ops: list[Op]) -> bytes:
+    return b"".join(
+        json.dumps(to_jsonable_python(op), separators=(",", ":")).encode() + b"\n"
+        for op in ops
+    )
+
+
+class Journal:
+    def __init__(self, path: Path):
+        self.path: Path = path
+        try:
+            self.size: int = path.stat().st_size
+        except FileNotFoundError:
+            self.size = 0
+
+    def replay(self) -> Iterator[Op]:
+        """Yield journal records, dropping a torn record at the end"""
+        try:
+            raw = self.path.read_bytes()
+        except FileNotFoundError:
+            return
+
+        offset = 0
+        for line in raw.splitlines(keepends=True):
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("record is not terminated")
+                op, field, value = json.loads(line)
+            except (ValueError, TypeError):
+                if offset + len(line) == len(raw):
+                    logger.warning("Drop torn record at %s:%d", self.path, offset)
+                    self._truncate(offset)
+                    return
+                logger.error("Skip corrupted record at %s:%d", self.path, offset)
+            else:
+                yield op, field, value
+            offset += len(line)
+
+    def append(self, records: bytes) -> None:
+        with open(self.path, "ab") as f:
+            _ = f.write(records)
+            f.flush()
+            os.fsync(f.fileno())
+        self.size += len(records)
+
+    def reset(self) -> None:
+        """Drop all records, called once they are folded into a snapshot"""
+        if self.size or self.path.exists():
+            self._truncate(0)
+
+    def _truncate(self, size: int) -> None:
+        with open(self.path, "r+b") as f:
+            _ = f.truncate(size)
+            os.fsync(f.fileno())
+        self.size = size
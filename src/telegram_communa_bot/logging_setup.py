@@ -1,59 +1,197 @@
 #!/bin/env/python3
 
-"""Logging setup for the Telegram Communa Bot."""
+"""
+Logging setup for the Telegram Communa Bot.
 
+Logging is configured once, on the first `setup_logging` call. Records are
+put on a queue by the calling code and formatted and written by a
+`QueueListener` thread, so the event loop never waits on stdout.
+
+Environment:
+    BOT_LOG_LEVEL          - level of the bot loggers (default INFO)
+    BOT_LOG_AIOGRAM_LEVEL  - level of the aiogram loggers (default INFO)
+    BOT_LOG_FORMAT         - `plain` or `json` (default plain)
+    BOT_LOG_HOT_RATE       - records per second a hot path may log (default 1)
+"""
+
+import atexit
+import json
 import logging
 import logging.config
+import logging.handlers
+import os
+import time
+from pathlib import Path
+from typing import Any, override
 
-from typing import Any
-
+from dotenv import load_dotenv
 
+PACKAGE = "telegram_communa_bot"
 DATEFMT = "%Y-%m-%d %H:%M:%S"
+FORMATS = ("plain", "json")
 
-LOGGING_CONFIG = {
-    "version": 1,
-    "disable_existing_loggers": False,
-    "formatters": {
-        "default": {
-            "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-            "datefmt": DATEFMT,
-        },
-        "detailed": {
-            "format": "%(asctime)s - %(name)s - %(levelname)s - %(module)s:%(funcName)s:%(lineno)d - %(message)s",
-            "datefmt": DATEFMT,
-        },
-    },
-    "handlers": {
-        "console": {
-            "class": "logging.StreamHandler",
-            "level": "DEBUG",
-            "formatter": "default",
-            "stream": "ext://sys.stdout",
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    @override
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, Any] = {
+            "time": self.formatTime(record, DATEFMT),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
         }
-    },
-    "loggers": {
-        "telegram_communa_bot": {
-            "level": "DEBUG",
-            "handlers": ["console"],
-            "propagate": False,
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def _level(name: str, default: str) -> str:
+    value = (os.getenv(name) or default).strip().upper()
+    if not isinstance(logging.getLevelName(value), int):
+        return default
+    return value
+
+
+def logging_config() -> dict[str, Any]:
+    """Build the `dictConfig` from environment"""
+    _ = load_dotenv()
+    level = _level("BOT_LOG_LEVEL", "INFO")
+    aiogram_level = _level("BOT_LOG_AIOGRAM_LEVEL", "INFO")
+    fmt = (os.getenv("BOT_LOG_FORMAT") or "plain").strip().lower()
+
+    return {
+        "version": 1,
+        "disable_existing_loggers": False,
+        "formatters": {
+            "plain": {
+                "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                "datefmt": DATEFMT,
+            },
+            "json": {"()": JsonFormatter},
         },
-        "aiogram": {"level": "DEBUG", "handlers": ["console"], "propagate": False},
-        "aiogram.event": {
-            "level": "DEBUG",
-            "handlers": ["console"],
-            "propagete": False,
+        "handlers": {
+            "console": {
+                "class": "logging.StreamHandler",
+                "formatter": fmt if fmt in FORMATS else "plain",
+                "stream": "ext://sys.stdout",
+            },
+            "queue": {
+                "class": "logging.handlers.QueueHandler",
+                "handlers": ["console"],
+                "respect_handler_level": True,
+            },
         },
-        "aiogram.dispatcher.dispatcher": {
-            "level": "DEBUG",
-            "handlers": ["console"],
-            "propagate": False,
+        "loggers": {
+            PACKAGE: {"level": level, "handlers": ["queue"], "propagate": False},
+            "aiogram": {"level": aiogram_level, "handlers": ["queue"], "propagate": False},
         },
-    },
-    "root": {"level": "DEBUG", "handlers": ["console"]},
-}
+        "root": {"level": "WARNING", "handlers": ["queue"]},
+    }
+
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+def configure_logging(config: dict[str, Any] | None = None) -> None:
+    """(Re)configure logging and start the writer thread"""
+    global _listener
+    stop_logging()
+    logging.config.dictConfig(config or logging_config())
+
+    for handler in logging.getLogger().handlers:
+        listener = getattr(handler, "listener", None)
+        if isinstance(handler, logging.handlers.QueueHandler) and listener:
+            _listener = listener
+            _listener.start()
+            break
+
+
+def stop_logging() -> None:
+    """Write out queued records and stop the writer thread"""
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+
+
+_ = atexit.register(stop_logging)
+
+
+def module_name(path: str) -> str:
+    """`.../telegram_communa_bot/bot/admin.py` -> `telegram_communa_bot.bot.admin`"""
+    if not path.endswith(".py"):
+        return path
+
+    parts = Path(path).with_suffix("").parts
+    if PACKAGE not in parts:
+        return Path(path).stem
+
+    start = len(parts) - 1 - parts[::-1].index(PACKAGE)
+    parts = parts[start:]
+    if parts[-1] == "__init__":
+        parts = parts[:-1]
+    return ".".join(parts)
+
+
+_configured = False
+
+
+def setup_logging(logger_name: str, config: dict[str, Any] | None = None) -> logging.Logger:
+    """Initialize logging once and return the logger of a module"""
+    global _configured
+    if config is not None or not _configured:
+        configure_logging(config)
+        _configured = True
+    return logging.getLogger(module_name(logger_name))
+
+
+class RateLimitedLog:
+    """
+    Log from a hot path at most `rate` records per second.
+
+    Dropped records are counted and reported with the next logged one. When
+    the level is disabled the call costs a single `isEnabledFor` check.
+    """
+
+    def __init__(
+        self,
+        logger: logging.Logger,
+        level: int = logging.DEBUG,
+        rate: float | None = None,
+    ):
+        self.logger: logging.Logger = logger
+        self.level: int = level
+        self.rate: float = rate if rate is not None else _hot_rate()
+        self.allowance: float = max(1.0, self.rate)
+        self.updated: float = time.monotonic()
+        self.suppressed: int = 0
+
+    def __call__(self, msg: str, *args: object) -> None:
+        if not self.logger.isEnabledFor(self.level):
+            return
+
+        if self.rate > 0:
+            now = time.monotonic()
+            self.allowance = min(
+                max(1.0, self.rate), self.allowance + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            if self.allowance < 1:
+                self.suppressed += 1
+                return
+            self.allowance -= 1
+
+        if self.suppressed:
+            msg += " (%d similar suppressed)"
+            args = (*args, self.suppressed)
+            self.suppressed = 0
+        self.logger.log(self.level, msg, *args, stacklevel=2)
 
 
-def setup_logging(logger_name: str, config: dict[str, Any] = LOGGING_CONFIG):
-    """Initialize logging"""
-    logging.config.dictConfig(config)
-    return logging.getLogger(logger_name)
+def _hot_rate() -> float:
+    try:
+        return float(os.getenv("BOT_LOG_HOT_RATE") or 1.0)
+    except ValueError:
+        return 1.0
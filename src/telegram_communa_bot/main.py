@@ -5,10 +5,15 @@ logger = setup_logging(__file__)
 
 import asyncio
 from .bot.bot import run_bot
+from .bot.workers import run_pool
 from .settings import settings
 
 
 def main():
     logger.info("Start Telegram Lobby Bot...")
 
-    _ = asyncio.run(run_bot(settings()))
+    cfg = settings()
+    if cfg.workers > 1:
+        _ = asyncio.run(run_pool(cfg))
+    else:
+        _ = asyncio.run(run_bot(cfg))
@@ -0,0 +1,181 @@
+"""
+Compact id -> status map behind the mutually exclusive id sets of a store.
+
+Ids are kept in a sorted `array("q")` with a parallel status byte per id,
+9 bytes per id instead of ~60 for an int in a set. Changes go to a small
+dict first and are merged into new arrays once it grows, so the arrays
+are never changed in place: a write job may hold them while the loop goes
+on, and they may be slices of a memory-mapped snapshot.
+
+The binary snapshot is a header, the ids and the statuses; loading it maps
+the file instead of parsing it.
+"""
+
+import bisect
+import mmap
+import struct
+from array import array
+from collections.abc import Iterable, Iterator, MutableSet, Sequence
+from itertools import compress
+from pathlib import Path
+from typing import Any, override
+
+MAGIC = b"MEMB"
+VERSION = 1
+# magic, version, number of ids; ids start 8-byte aligned
+HEADER = struct.Struct("<4sIQ")
+# changes merged into the arrays at once, at least this or 1/64 of the ids
+MERGE_MIN = 4096
+# status of an id removed in the overlay, also "no status"
+NONE = 0
+
+
+class Membership:
+    def __init__(self, ids: Sequence[int] | None = None, statuses: Sequence[int] | None = None):
+        self._ids: Sequence[int] = array("q") if ids is None else ids
+        self._statuses: Sequence[int] = array("b") if statuses is None else statuses
+        # id -> status changed since the last merge, NONE for removed ids
+        self._overlay: dict[int, int] = {}
+        raw = bytes(self._statuses)
+        self._counts: dict[int, int] = {x: raw.count(x) for x in set(raw)}
+
+    @classmethod
+    def from_sets(cls, sets: Sequence[Iterable[int]]) -> "Membership":
+        """Status `i + 1` for the ids of `sets[i]`, later sets win"""
+        pairs: dict[int, int] = {}
+        for index, ids in enumerate(sets):
+            status = index + 1
+            for user_id in ids:
+                pairs[user_id] = status
+        order = sorted(pairs)
+        return cls(array("q", order), array("b", [pairs[x] for x in order]))
+
+    def __len__(self) -> int:
+        return sum(self._counts.values())
+
+    def count(self, status: int) -> int:
+        return self._counts.get(status, 0)
+
+    def get(self, user_id: int) -> int:
+        status = self._overlay.get(user_id)
+        if status is not None:
+            return status
+        ids = self._ids
+        i = bisect.bisect_left(ids, user_id)
+        if i < len(ids) and ids[i] == user_id:
+            return self._statuses[i]
+        return NONE
+
+    def set(self, user_id: int, status: int) -> None:
+        old = self.get(user_id)
+        if old == status:
+            return
+        if old:
+            self._counts[old] -= 1
+        if status:
+            self._counts[status] = self._counts.get(status, 0) + 1
+        self._overlay[user_id] = status
+        if len(self._overlay) >= max(MERGE_MIN, len(self._ids) >> 6):
+            self.merge()
+
+    def merge(self) -> None:
+        """Fold the overlay into new arrays, slices of the old ones are copied at C speed"""
+        if not self._overlay:
+            return
+        old_ids = self._ids
+        ids, statuses = array("q"), array("b")
+        # byte views, frombytes() takes those only
+        raw_ids = memoryview(old_ids).cast("B")  # pyright: ignore[reportArgumentType]
+        raw_statuses = memoryview(self._statuses).cast("B")  # pyright: ignore[reportArgumentType]
+        size = ids.itemsize
+        start = 0
+        for user_id in sorted(self._overlay):
+            i = bisect.bisect_left(old_ids, user_id, start)
+            ids.frombytes(raw_ids[start * size : i * size])
+            statuses.frombytes(raw_statuses[start:i])
+            start = i + 1 if i < len(old_ids) and old_ids[i] == user_id else i
+            status = self._overlay[user_id]
+            if status:
+                ids.append(user_id)
+                statuses.append(status)
+        ids.frombytes(raw_ids[start * size :])
+        statuses.frombytes(raw_statuses[start:])
+
+        self._ids, self._statuses = ids, statuses
+        self._overlay = {}
+
+    def iter_status(self, status: int) -> Iterator[int]:
+        """Ids with `status` in ascending order"""
+        self.merge()
+        mask = bytes(self._statuses).translate(_MASKS[status])
+        return compress(self._ids, mask)
+
+    def to_bytes(self) -> list[bytes | memoryview]:
+        """Binary snapshot, the parts are written one after another"""
+        self.merge()
+        ids, statuses = self._ids, self._statuses
+        return [HEADER.pack(MAGIC, VERSION, len(ids)), memoryview(ids), memoryview(statuses)]
+
+    @classmethod
+    def open(cls, path: Path) -> "Membership":
+        """Map a binary snapshot, ValueError when it isn't one"""
+        with open(path, "rb") as f:
+            if f.seek(0, 2) < HEADER.size:
+                raise ValueError(f"{path} is too short")
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count = HEADER.unpack_from(mapped)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a membership snapshot v{VERSION}")
+        end = HEADER.size + count * 9
+        if len(mapped) < end:
+            raise ValueError(f"{path} is truncated")
+
+        view = memoryview(mapped)
+        ids = view[HEADER.size : HEADER.size + count * 8].cast("q")
+        statuses = view[HEADER.size + count * 8 : end].cast("b")
+        return cls(ids, statuses)
+
+
+# byte translation tables: 1 for the status, 0 for any other
+_MASKS = [bytes(int(i == s) for i in range(256)) for s in range(256)]
+
+
+class StatusView(MutableSet[int]):
+    """Ids with one status of a `Membership`, a set to the code using it"""
+
+    def __init__(self, members: Membership, status: int):
+        self.members: Membership = members
+        self.status: int = status
+
+    @override
+    def __contains__(self, user_id: object) -> bool:
+        return isinstance(user_id, int) and self.members.get(user_id) == self.status
+
+    @override
+    def __iter__(self) -> Iterator[int]:
+        return self.members.iter_status(self.status)
+
+    @override
+    def __len__(self) -> int:
+        return self.members.count(self.status)
+
+    @override
+    def add(self, value: int) -> None:
+        """Also takes the id out of the other statuses"""
+        self.members.set(value, self.status)
+
+    @override
+    def discard(self, value: int) -> None:
+        if value in self:
+            self.members.set(value, NONE)
+
+    @classmethod
+    @override
+    def _from_iterable(cls, it: Iterable[Any]) -> set[Any]:
+        # results of `|`, `&`, `-` are plain sets
+        return set(it)
+
+    @override
+    def __repr__(self) -> str:
+        return f"StatusView({self.status}, {len(self)} ids)"
@@ -0,0 +1,232 @@
+"""
+Prometheus metrics.
+
+A small in-process registry rendered in the text exposition format. Each
+metric keeps its series in a dict keyed by label values, so recording is
+a dict lookup and an add; bucket search is a `bisect`.
+"""
+
+from .logging_setup import setup_logging
+
+logger = setup_logging(__file__)
+
+import bisect
+from collections.abc import Callable, Iterator, Sequence
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)  # fmt: skip
+LAG_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+Labels = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+class Metric:
+    kind: str = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name: str = name
+        self.help: str = help
+        self.labels: tuple[str, ...] = tuple(labels)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self.samples()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, *labels: str, value: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def total(self, **match: str) -> float:
+        """Sum of the series with the given label values"""
+        where = [(self.labels.index(k), v) for k, v in match.items()]
+        return sum(
+            value
+            for labels, value in self._values.items()
+            if all(labels[i] == v for i, v in where)
+        )
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labels, labels)} {_number(value)}"
+
+
+class Gauge(Metric):
+    """Value read at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable[[], float]):
+        super().__init__(name, help)
+        self.read: Callable[[], float] = read
+
+    def samples(self) -> Iterator[str]:
+        try:
+            value = float(self.read())
+        except Exception:
+            logger.exception("Can't read gauge %s", self.name)
+            return
+        yield f"{self.name} {_number(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets: tuple[float, ...] = tuple(sorted(buckets))
+        # per series: counts per bucket, the last one is +Inf, then sum
+        self._series: dict[Labels, list[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return int(sum(series[:-1])) if series else 0
+
+    def sum(self, *labels: str) -> float:
+        series = self._series.get(labels)
+        return series[-1] if series else 0.0
+
+    def samples(self) -> Iterator[str]:
+        for labels, series in self._series.items():
+            cumulative = 0.0
+            for bound, count in zip((*self.buckets, float("inf")), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket = _labels(self.labels, labels, f'le="{le}"')
+                yield f"{self.name}_bucket{bucket} {_number(cumulative)}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {_number(series[-1])}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {_number(cumulative)}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def _add[M: Metric](self, metric: M) -> M:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, read: Callable[[], float]) -> Gauge:
+        """Register a gauge, an existing one with the same name is replaced"""
+        _ = self.metrics.pop(name, None)
+        return self._add(Gauge(name, help, read))
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+UPDATES = registry.counter(
+    "bot_updates_total",
+    "Updates processed, by update type, router and outcome",
+    ("type", "router", "outcome"),
+)
+UPDATE_LAG = registry.histogram(
+    "bot_update_lag_seconds",
+    "Time from the message date to the start of processing",
+    buckets=LAG_BUCKETS,
+)
+HANDLER_SECONDS = registry.histogram(
+    "bot_handler_seconds",
+    "Handler run time",
+    ("router", "handler"),
+)
+API_REQUESTS = registry.counter(
+    "bot_api_requests_total",
+    "Bot API requests, by method and result code",
+    ("method", "code"),
+)
+API_SECONDS = registry.histogram(
+    "bot_api_request_seconds",
+    "Bot API request latency, retries are separate requests",
+    ("method",),
+)
+API_CONNECTIONS = registry.counter(
+    "bot_api_connections_total",
+    "Bot API connection events: created, reused, dns_cache_hit, dns_cache_miss",
+    ("event",),
+)
+API_FAILURES = registry.counter(
+    "bot_api_failures_total",
+    "Bot API requests without an answer: timeout, network, rejected by the breaker",
+    ("kind",),
+)
+FLOOD = registry.counter(
+    "bot_flood_messages_total",
+    "Private messages by flood control verdict: pass, or dropped with drop, warn, mute, block",
+    ("verdict",),
+)
+FLUSHES = registry.counter(
+    "bot_flushes_total",
+    "Write-behind flushes, by outcome",
+    ("outcome",),
+)
+FLUSH_SECONDS = registry.histogram(
+    "bot_flush_seconds",
+    "Write-behind flush duration",
+)
+HANDLER_WAIT = registry.histogram(
+    "bot_handler_wait_seconds",
+    "Time an update waited for earlier updates of its chat and a handler slot, by lane",
+    ("lane",),
+)
@@ -2,24 +2,180 @@ from .logging_setup import setup_logging
 
 logger = setup_logging(__file__)
 
-import json
-from typing import TypeVar, cast
+import asyncio
+import sqlite3
+import time
+from collections.abc import Callable
+from contextlib import AbstractContextManager, suppress
+from contextvars import ContextVar, Token
+from dataclasses import dataclass
+from typing import Any, ClassVar, TypeVar, cast, override
 from pathlib import Path
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
+from .journal import Op
+from .membership import Membership, StatusView
+from .metrics import FLUSH_SECONDS, FLUSHES
 from .settings import settings
+from .storage import WriteJob, close_storage, storage
 
 T = TypeVar("T", bound="Persistent")
 
 
+class Tenant:
+    """
+    Stores of one lobby in a data directory of its own, loaded on first
+    use and dropped by `unload()`, see `bot.tenants`.
+    """
+
+    def __init__(self, name: str, path: Path, on_load: Callable[["Tenant"], None] | None = None):
+        self.name: str = name
+        self.path: Path = path
+        # a bot of its own, see `GlobalBot.get()`
+        self.bot: Any = None
+        # updates and tasks using the stores, they are kept loaded meanwhile
+        self.active: int = 0
+        # per-tenant objects other than stores, closed before unloading
+        self.resources: dict[str, Any] = {}
+
+        self._stores: dict[str, "Persistent"] = {}
+        self._on_load: Callable[[Tenant], None] | None = on_load
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self._stores)
+
+    def stores(self) -> list["Persistent"]:
+        return list(self._stores.values())
+
+    def store(self, cls: type[T]) -> T:
+        data = self._stores.get(cls.__name__)
+        if data is None:
+            if not self._stores and self._on_load:
+                self._on_load(self)
+            self.path.mkdir(parents=True, exist_ok=True)
+            with using_tenant(self):
+                data = self._stores[cls.__name__] = cls.load()
+        return cast(T, data)
+
+    def unload(self) -> None:
+        self._stores = {}
+        self.resources = {}
+        # an open SQLite database holds a few file descriptors
+        close_storage(self.path)
+
+    def hold(self) -> AbstractContextManager[None]:
+        """Keep the stores loaded while in it"""
+        return _Hold(self)
+
+    @override
+    def __repr__(self) -> str:
+        return f"Tenant({self.name!r})"
+
+
+# tenant of the update being handled, None for the stores in BOT_DATA_PATH
+_tenant: ContextVar[Tenant | None] = ContextVar("tenant", default=None)
+
+
+def current_tenant() -> Tenant | None:
+    return _tenant.get()
+
+
+# classes, not @contextmanager: entered for every update, a few times faster
+class _Hold(AbstractContextManager[None]):
+    __slots__: ClassVar[tuple[str, ...]] = ("tenant",)
+
+    def __init__(self, tenant: Tenant):
+        self.tenant: Tenant = tenant
+
+    @override
+    def __enter__(self) -> None:
+        self.tenant.active += 1
+
+    @override
+    def __exit__(self, *exc: object) -> None:
+        self.tenant.active -= 1
+
+
+class _Using(AbstractContextManager[None]):
+    __slots__: ClassVar[tuple[str, ...]] = ("tenant", "token")
+
+    def __init__(self, tenant: Tenant | None):
+        self.tenant: Tenant | None = tenant
+        self.token: Token[Tenant | None] | None = None
+
+    @override
+    def __enter__(self) -> None:
+        self.token = _tenant.set(self.tenant)
+
+    @override
+    def __exit__(self, *exc: object) -> None:
+        if self.token:
+            _tenant.reset(self.token)
+
+
+def using_tenant(tenant: Tenant | None) -> AbstractContextManager[None]:
+    """Make the stores of `tenant` current, tasks started in it inherit them"""
+    return _Using(tenant)
+
+
+def data_path() -> Path:
+    tenant = _tenant.get()
+    return tenant.path if tenant else settings().data_path
+
+
 class Persistent(BaseModel):
+    # id sets holding mutually exclusive statuses of the same id, kept in
+    # one `Membership`; storage backends may keep them as `(id, status)`
+    # rows or as its binary snapshot
+    membership_fields: ClassVar[tuple[str, ...]] = ()
+
+    # mutations recorded since the last write, see `add_to()` and friends
+    _ops: list[Op] = PrivateAttr(default_factory=list)
+    # tracked mutation methods were used since the last save()
+    _tracked: bool = PrivateAttr(default=False)
+    # store was changed behind the journal's back
+    _dirty_untracked: bool = PrivateAttr(default=False)
+    # bumped on every change, lets readers memoize derived data
+    _version: int = PrivateAttr(default=0)
+    # statuses behind the `membership_fields` views
+    _members: Membership | None = PrivateAttr(default=None)
+    # tenant the store belongs to, it is written to its directory
+    _tenant: Tenant | None = PrivateAttr(default=None)
+
+    @override
+    def model_post_init(self, context: Any, /) -> None:
+        if self.membership_fields:
+            sets = [getattr(self, field) for field in self.membership_fields]
+            self.bind_members(Membership.from_sets(sets))
+
+    def bind_members(self, members: Membership) -> None:
+        """Make `membership_fields` views of `members`, status `i + 1` for field `i`"""
+        self._members = members
+        for index, field in enumerate(self.membership_fields):
+            # not an assignment, it would be validated back into a set
+            self.__dict__[field] = StatusView(members, index + 1)
+
+    @property
+    def members(self) -> Membership | None:
+        return self._members
+
     @classmethod
     def _file_name(cls) -> str:
         raise NotImplemented
 
     @classmethod
     def file_path(cls) -> Path:
-        return settings().data_path.joinpath(cls._file_name())
+        return data_path().joinpath(cls._file_name())
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def store_name(self) -> str:
+        name = type(self).__name__
+        return f"{self._tenant.name}/{name}" if self._tenant else name
 
     @classmethod
     def get(cls: type[T]) -> T:
@@ -27,24 +183,250 @@ class Persistent(BaseModel):
 
     @classmethod
     def load(cls: type[T]) -> T:
-        path: Path = cls.file_path()
-
-        logger.info("Load data from path %s", path)
-        try:
-            data = cls.model_validate(json.loads(path.read_text(encoding="utf-8")))
-
-        except FileNotFoundError:
+        """Load the store of the current tenant"""
+        tenant = current_tenant()
+        data = storage(data_path()).load(cls)
+        if data is None:
             data = cls()
+            data._tenant = tenant
             data.save()
 
-        _signltones[cls.__name__] = data
+        data._tenant = tenant
+        if not tenant:
+            _signltones[cls.__name__] = data
         return data
 
+    def add_to(self, field: str, value: Any) -> None:
+        """Add `value` to a set field and record it for the journal"""
+        getattr(self, field).add(value)
+        self._record("add", field, value)
+
+    def discard_from(self, field: str, value: Any) -> None:
+        """Discard `value` from a set field and record it for the journal"""
+        getattr(self, field).discard(value)
+        self._record("discard", field, value)
+
+    def put_in(self, field: str, key: Any, value: Any) -> None:
+        """Set `key` of a dict field and record it for the journal"""
+        getattr(self, field)[key] = value
+        self._record("put", field, [key, value])
+
+    def pop_from(self, field: str, key: Any) -> None:
+        """Remove `key` from a dict field and record it for the journal"""
+        _ = getattr(self, field).pop(key, None)
+        self._record("pop", field, key)
+
+    def set_field(self, field: str, value: Any) -> None:
+        """Assign a field and record it for the journal"""
+        setattr(self, field, value)
+        self._record("set", field, value)
+
+    def _record(self, op: str, field: str, value: Any) -> None:
+        self._ops.append((op, field, value))
+        self._tracked = True
+        self._version += 1
+
+    def _apply(self, op: str, field: str, value: Any) -> None:
+        match op:
+            case "add":
+                getattr(self, field).add(value)
+            case "discard":
+                getattr(self, field).discard(value)
+            case "put":
+                key, item = value
+                getattr(self, field)[key] = item
+            case "pop":
+                _ = getattr(self, field).pop(value, None)
+            case "set":
+                setattr(self, field, value)
+            case _:
+                logger.error("Unknown journal op %s for %s", op, type(self).__name__)
+
+    def apply_ops(self, ops: list[Op]) -> None:
+        """Apply changes made elsewhere, they are not recorded again"""
+        for op, field, value in ops:
+            self._apply(op, field, value)
+        self._version += 1
+
+    def apply_snapshot(self, data: dict[str, Any]) -> None:
+        """Replace the state with a dump made elsewhere"""
+        other = self.model_validate(data)
+        for field in type(self).model_fields:
+            if field not in self.membership_fields:
+                setattr(self, field, getattr(other, field))
+        if other.members:
+            self.bind_members(other.members)
+        self._version += 1
+
     def save(self) -> None:
-        path: Path = self.file_path()
-        logger.info("Save %s to %s", type(self), path)
+        """Save now, or mark dirty when the write-behind engine is running"""
+        if not self._tracked:
+            self._dirty_untracked = True
+            self._version += 1
+        self._tracked = False
+
+        if _write_behind and _write_behind.running:
+            _write_behind.mark_dirty(self)
+            return
+
+        logger.info("Save %s", type(self).__name__)
+        self._write_job()()
 
-        _ = path.write_text(self.model_dump_json(indent=2), encoding="utf-8")
+    def _write_job(self) -> WriteJob:
+        """Take recorded changes, runs on the loop, the job may run in a thread"""
+        ops, self._ops = self._ops, []
+        untracked, self._dirty_untracked = self._dirty_untracked, False
+        # the paths are taken now, the job writes to them later
+        with using_tenant(self._tenant):
+            return storage(data_path()).write_job(self, ops, full=untracked)
+
+    def _write_failed(self) -> None:
+        # recorded ops are gone with the failed job, only a snapshot is safe now
+        self._dirty_untracked = True
 
 
 _signltones: dict[str, Persistent] = {}
+
+
+def _run_all(jobs: list[WriteJob]) -> None:
+    for job in jobs:
+        job()
+
+
+@dataclass
+class FlushStats:
+    flushes: int = 0
+    writes: int = 0
+    # save() calls absorbed by a write of the same store
+    coalesced: int = 0
+    errors: int = 0
+    latency_last: float = 0.0
+    latency_max: float = 0.0
+    latency_total: float = 0.0
+
+
+class WriteBehind:
+    """
+    Coalescing write-behind engine for Persistent stores.
+
+    `save()` only marks a store dirty; a background task serializes dirty
+    stores on the loop and writes them in a thread at most once per
+    `interval`, or earlier when `max_pending` saves have piled up.
+    """
+
+    def __init__(self, interval: float, max_pending: int):
+        self.interval: float = interval
+        self.max_pending: int = max(1, max_pending)
+        self.stats: FlushStats = FlushStats()
+
+        self._dirty: dict[str, Persistent] = {}
+        self._pending: int = 0
+        self._has_dirty: asyncio.Event = asyncio.Event()
+        self._is_full: asyncio.Event = asyncio.Event()
+        self._lock: asyncio.Lock = asyncio.Lock()
+        self._task: asyncio.Task[None] | None = None
+        self._closing: bool = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def is_dirty(self, obj: Persistent) -> bool:
+        """Changes of `obj` are waiting for a flush, or for a retry of one"""
+        return self._dirty.get(obj.store_name) is obj
+
+    def mark_dirty(self, obj: Persistent) -> None:
+        self._dirty[obj.store_name] = obj
+        self._pending += 1
+        self._has_dirty.set()
+        if self._pending >= self.max_pending:
+            self._is_full.set()
+
+    def start(self) -> None:
+        if not self._task:
+            self._task = asyncio.create_task(self._run(), name="write-behind")
+
+    async def stop(self) -> None:
+        """Stop background task and flush everything still pending"""
+        task, self._task = self._task, None
+        if task:
+            # wake the loop instead of cancelling it, a write may be in progress
+            self._closing = True
+            self._has_dirty.set()
+            self._is_full.set()
+            await task
+        await self.flush()
+
+    async def _run(self) -> None:
+        while not self._closing:
+            _ = await self._has_dirty.wait()
+            with suppress(TimeoutError):
+                _ = await asyncio.wait_for(self._is_full.wait(), self.interval)
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._dirty:
+                return
+
+            dirty, pending = self._dirty, self._pending
+            self._dirty, self._pending = {}, 0
+            self._has_dirty.clear()
+            self._is_full.clear()
+
+            # serialize on the loop, so nobody mutates a store under our feet
+            jobs = [obj._write_job() for obj in dirty.values()]
+
+            start = time.perf_counter()
+            try:
+                await asyncio.to_thread(_run_all, jobs)
+            except (OSError, sqlite3.Error):
+                logger.exception("Flush of %s failed, retry later", list(dirty))
+                self.stats.errors += 1
+                FLUSHES.inc("error")
+                for name, obj in dirty.items():
+                    obj._write_failed()
+                    _ = self._dirty.setdefault(name, obj)
+                self._pending += pending
+                self._has_dirty.set()
+                return
+
+            elapsed = time.perf_counter() - start
+            stats = self.stats
+            stats.flushes += 1
+            stats.writes += len(jobs)
+            stats.coalesced += pending - len(jobs)
+            stats.latency_last = elapsed
+            stats.latency_max = max(stats.latency_max, elapsed)
+            stats.latency_total += elapsed
+            FLUSHES.inc("ok")
+            FLUSH_SECONDS.observe(elapsed)
+            logger.debug("Flushed %s in %.4fs", list(dirty), elapsed)
+
+
+_write_behind: WriteBehind | None = None
+
+
+def write_behind() -> WriteBehind | None:
+    return _write_behind
+
+
+def start_write_behind(interval: float, max_pending: int) -> WriteBehind | None:
+    """Start write-behind engine, `interval <= 0` keeps synchronous saves"""
+    global _write_behind
+    if interval <= 0:
+        return None
+
+    _write_behind = WriteBehind(interval, max_pending)
+    _write_behind.start()
+    return _write_behind
+
+
+async def stop_write_behind() -> None:
+    global _write_behind
+    if not _write_behind:
+        return
+
+    engine, _write_behind = _write_behind, None
+    await engine.stop()
+    logger.info("Persistence stats: %s", engine.stats)
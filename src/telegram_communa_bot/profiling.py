@@ -0,0 +1,111 @@
+"""
+On-demand profiling of the running process.
+
+`profile(seconds)` runs cProfile and tracemalloc over a window of the
+event loop and returns a text report: top functions by cumulative time,
+top allocation sites and memory growth. Nothing is enabled outside a
+window, and one window runs at a time.
+
+Tracing starts with the window, so the sites and the growth cover memory
+allocated during it. With tracing on from the start (`PYTHONTRACEMALLOC`)
+the growth is counted from the end of the previous window.
+"""
+
+from .logging_setup import setup_logging
+
+logger = setup_logging(__file__)
+
+import asyncio
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+
+from .metrics import UPDATES
+
+TOP = 30
+MAX_SECONDS = 300.0
+
+_FILTERS = (
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+_active = False
+# end of the last window, comparable while tracing stays on
+_last: tracemalloc.Snapshot | None = None
+
+
+def running() -> bool:
+    return _active
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces(_FILTERS)
+
+
+async def profile(seconds: float, top: int = TOP) -> str:
+    """Profile the next `seconds`, RuntimeError while another window runs"""
+    global _active, _last
+    if _active:
+        raise RuntimeError("Profiling is running already")
+    _active = True
+
+    profiler = cProfile.Profile()
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        since_last = tracing and _last is not None
+        before = _last if _last and since_last else _snapshot()
+        tracemalloc.reset_peak()
+        updates = UPDATES.total()
+        start = time.monotonic()
+        profiler.enable()
+        try:
+            await asyncio.sleep(min(seconds, MAX_SECONDS))
+        finally:
+            profiler.disable()
+        elapsed = time.monotonic() - start
+        after = _snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+        _active = False
+    _last = after if tracing else None
+
+    logger.info("Profiled %.1fs", elapsed)
+    header = (
+        f"Window {elapsed:.1f}s, {UPDATES.total() - updates:.0f} updates, "
+        f"traced memory peak {peak / 1024:.0f} KiB"
+    )
+    return "\n\n".join(
+        (
+            header,
+            _section("Top functions by cumulative time", _functions(profiler, top)),
+            _section("Top allocation sites", _lines(after.statistics("lineno")[:top])),
+            _section(
+                "Growth since the " + ("last window" if since_last else "window start"),
+                _lines(after.compare_to(before, "lineno")[:top]),
+            ),
+        )
+    )
+
+
+def _section(title: str, body: str) -> str:
+    return f"{title}\n{'=' * len(title)}\n{body}"
+
+
+def _functions(profiler: cProfile.Profile, top: int) -> str:
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    _ = stats.strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+    return out.getvalue().strip()
+
+
+def _lines(stats: list[tracemalloc.Statistic] | list[tracemalloc.StatisticDiff]) -> str:
+    return "\n".join(str(x) for x in stats) or "nothing"
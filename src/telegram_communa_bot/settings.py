@@ -17,21 +17,130 @@ def get_env_var(name: str, default: str | None = None) -> str | None:
     return value.strip()
 
 
+def get_env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        logger.error(f"Environment variable {name} is not a number: {value}")
+        return default
+
+
+def get_env_int(name: str, default: int) -> int:
+    return int(get_env_float(name, default))
+
+
+# "ipc" is set by the worker pool for its workers
+STORAGES = ("json", "journal", "sqlite", "ipc")
+MODES = ("polling", "webhook")
+
+
 @dataclass(frozen=True)
 class Settings:
     token: str
     data_path: Path
     admin: str
+    # Write-behind persistence: 0 disables it and saves synchronously
+    save_interval: float = 1.0
+    save_max_pending: int = 100
+    # "json" rewrites the whole file, "journal" appends changes to a log,
+    # "sqlite" keeps everything in one SQLite database
+    storage: str = "json"
+    journal_compact_size: int = 1 << 20
+    # "json"/"journal": id lists in a binary file mapped on load, not in the JSON
+    binary_members: bool = False
+    # user profile cache in front of get_chat
+    user_cache_ttl: float = 3600.0
+    user_cache_negative_ttl: float = 300.0
+    user_cache_size: int = 10_000
+    user_fetch_concurrency: int = 8
+    # outbound budgets: messages per second overall, per minute per group
+    global_rate: float = 30.0
+    group_rate: float = 20.0
+    send_retries: int = 3
+    # update delivery: "polling" or "webhook"
+    mode: str = "polling"
+    # public base URL passed to setWebhook, unset to manage the webhook elsewhere
+    webhook_url: str | None = None
+    webhook_path: str = "/webhook"
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8080
+    webhook_secret: str | None = None
+    webhook_max_inflight: int = 100
+    # forwarding to the lobby: seconds to collect an album / a burst (0 = off)
+    album_window: float = 0.5
+    burst_window: float = 0.0
+    forward_batch: int = 100
+    # seconds to collect join requests into one lobby message (0 = a message each)
+    join_digest_window: float = 5.0
+    # private messages per second a user may send on average, 0 = no limit
+    flood_rate: float = 0.5
+    flood_burst: int = 20
+    flood_mute: float = 300.0
+    # mutes that put the user into the black list, 0 = never
+    flood_block_after: int = 3
+    flood_max_users: int = 1 << 20
+    reply_index_size: int = 1 << 18
+    reply_index_max_age: float = 30 * 24 * 3600.0
+    metrics_host: str = "0.0.0.0"
+    metrics_port: int = 0
+    api_url: str | None = None
+    # HTTP session of the bot: regular calls get api_timeout, getUpdates its
+    # long-poll wait on top; the breaker opens after that many failures in a row
+    api_timeout: float = 10.0
+    api_connect_timeout: float = 5.0
+    api_pool_size: int = 100
+    api_keepalive: float = 30.0
+    api_dns_ttl: int = 300
+    api_breaker_threshold: int = 5
+    api_breaker_reset: float = 10.0
+    workers: int = 1
+    # seconds in-flight updates get to finish on SIGTERM
+    drain_timeout: float = 20.0
+    # copies `/broadcast` keeps in flight
+    broadcast_concurrency: int = 8
+    # handlers running at once, and updates taken before fetching pauses
+    handler_concurrency: int = 64
+    handler_queue: int = 1000
+    # a lobby per tenant with its own stores, at most `tenants_loaded` in
+    # memory; tenants with a bot of their own as (name, token)
+    tenants: bool = False
+    tenants_loaded: int = 100
+    tenant_tokens: tuple[tuple[str, str], ...] = ()
 
 
 __settings: Settings | None = None
 
 
 def settings() -> Settings:
+    """Settings parsed from the environment on the first call"""
+    global __settings
+    if not __settings:
+        __settings = _parse()
+    return __settings
+
+
+def reset_settings() -> None:
+    """Parse the environment again on the next call, after it was changed"""
     global __settings
-    if __settings:
-        return __settings
+    __settings = None
+
+
+def parse_tenant_tokens(value: str) -> tuple[tuple[str, str], ...]:
+    """`name=token,name=token` of BOT_TENANT_TOKENS"""
+    tokens: list[tuple[str, str]] = []
+    for item in value.split(","):
+        name, _, token = item.strip().partition("=")
+        if not name or not token:
+            logger.error(f"Invalid BOT_TENANT_TOKENS entry: {item}")
+            raise SystemExit(1)
+        tokens.append((name.strip(), token.strip()))
+    return tuple(tokens)
 
+
+def _parse() -> Settings:
     _ = load_dotenv()
     token = get_env_var("TELEGRAM_BOT_TOKEN")
     data_path = Path(get_env_var("BOT_DATA_PATH") or "")
@@ -40,8 +149,89 @@ def settings() -> Settings:
     if not token or not data_path or not admin:
         raise SystemExit(1)
 
+    storage = get_env_var("BOT_STORAGE", "json") or "json"
+    if storage not in STORAGES:
+        logger.error(f"Unknown BOT_STORAGE {storage}, expected one of {STORAGES}")
+        raise SystemExit(1)
+
+    mode = get_env_var("BOT_MODE", "polling") or "polling"
+    if mode not in MODES:
+        logger.error(f"Unknown BOT_MODE {mode}, expected one of {MODES}")
+        raise SystemExit(1)
+
+    webhook_secret = os.getenv("BOT_WEBHOOK_SECRET") or None
+    if mode == "webhook" and not webhook_secret:
+        # anyone reaching the server could post updates, an admin /lobby too
+        logger.error("BOT_MODE=webhook needs BOT_WEBHOOK_SECRET")
+        raise SystemExit(1)
+
+    tokens = os.getenv("BOT_TENANT_TOKENS")
+    tenant_tokens = parse_tenant_tokens(tokens) if tokens else ()
+    tenants = get_env_int("BOT_TENANTS", 0) > 0 or bool(tenant_tokens)
+    workers = max(1, get_env_int("BOT_WORKERS", 1))
+    if tenants and workers > 1:
+        logger.error("BOT_TENANTS works with BOT_WORKERS=1 only")
+        raise SystemExit(1)
+    if tenant_tokens and mode != "polling":
+        logger.error("BOT_TENANT_TOKENS works in the polling mode only")
+        raise SystemExit(1)
+    # the digest and its page buttons live in the process that renders
+    # them, `/start` and the lobby may be handled by different workers
+    join_digest_window = get_env_float("BOT_JOIN_DIGEST_WINDOW", 5.0 if workers == 1 else 0.0)
+    if join_digest_window > 0 and workers > 1:
+        logger.error("BOT_JOIN_DIGEST_WINDOW works with BOT_WORKERS=1 only")
+        raise SystemExit(1)
+
     return Settings(
         token=token,
         data_path=data_path,
         admin=admin,
+        save_interval=get_env_float("BOT_SAVE_INTERVAL", 1.0),
+        save_max_pending=get_env_int("BOT_SAVE_MAX_PENDING", 100),
+        storage=storage,
+        journal_compact_size=get_env_int("BOT_JOURNAL_COMPACT_SIZE", 1 << 20),
+        binary_members=get_env_int("BOT_BINARY_MEMBERS", 0) > 0,
+        user_cache_ttl=get_env_float("BOT_USER_CACHE_TTL", 3600.0),
+        user_cache_negative_ttl=get_env_float("BOT_USER_CACHE_NEGATIVE_TTL", 300.0),
+        user_cache_size=get_env_int("BOT_USER_CACHE_SIZE", 10_000),
+        user_fetch_concurrency=get_env_int("BOT_USER_FETCH_CONCURRENCY", 8),
+        global_rate=get_env_float("BOT_GLOBAL_RATE", 30.0),
+        group_rate=get_env_float("BOT_GROUP_RATE", 20.0),
+        send_retries=get_env_int("BOT_SEND_RETRIES", 3),
+        mode=mode,
+        webhook_url=os.getenv("BOT_WEBHOOK_URL") or None,
+        webhook_path=get_env_var("BOT_WEBHOOK_PATH", "/webhook") or "/webhook",
+        webhook_host=get_env_var("BOT_WEBHOOK_HOST", "0.0.0.0") or "0.0.0.0",
+        webhook_port=get_env_int("BOT_WEBHOOK_PORT", 8080),
+        webhook_secret=webhook_secret,
+        webhook_max_inflight=get_env_int("BOT_WEBHOOK_MAX_INFLIGHT", 100),
+        album_window=get_env_float("BOT_ALBUM_WINDOW", 0.5),
+        burst_window=get_env_float("BOT_BURST_WINDOW", 0.0),
+        forward_batch=get_env_int("BOT_FORWARD_BATCH", 100),
+        join_digest_window=join_digest_window,
+        flood_rate=get_env_float("BOT_FLOOD_RATE", 0.5),
+        flood_burst=get_env_int("BOT_FLOOD_BURST", 20),
+        flood_mute=get_env_float("BOT_FLOOD_MUTE", 300.0),
+        flood_block_after=get_env_int("BOT_FLOOD_BLOCK_AFTER", 3),
+        flood_max_users=get_env_int("BOT_FLOOD_MAX_USERS", 1 << 20),
+        reply_index_size=get_env_int("BOT_REPLY_INDEX_SIZE", 1 << 18),
+        reply_index_max_age=get_env_float("BOT_REPLY_INDEX_MAX_AGE", 30 * 24 * 3600.0),
+        metrics_host=get_env_var("BOT_METRICS_HOST", "0.0.0.0") or "0.0.0.0",
+        metrics_port=get_env_int("BOT_METRICS_PORT", 0),
+        api_url=os.getenv("BOT_API_URL") or None,
+        api_timeout=get_env_float("BOT_API_TIMEOUT", 10.0),
+        api_connect_timeout=get_env_float("BOT_API_CONNECT_TIMEOUT", 5.0),
+        api_pool_size=get_env_int("BOT_API_POOL_SIZE", 100),
+        api_keepalive=get_env_float("BOT_API_KEEPALIVE", 30.0),
+        api_dns_ttl=get_env_int("BOT_API_DNS_TTL", 300),
+        api_breaker_threshold=get_env_int("BOT_API_BREAKER_THRESHOLD", 5),
+        api_breaker_reset=get_env_float("BOT_API_BREAKER_RESET", 10.0),
+        workers=workers,
+        drain_timeout=get_env_float("BOT_DRAIN_TIMEOUT", 20.0),
+        broadcast_concurrency=max(1, get_env_int("BOT_BROADCAST_CONCURRENCY", 8)),
+        handler_concurrency=max(1, get_env_int("BOT_HANDLER_CONCURRENCY", 64)),
+        handler_queue=max(1, get_env_int("BOT_HANDLER_QUEUE", 1000)),
+        tenants=tenants,
+        tenants_loaded=max(1, get_env_int("BOT_TENANTS_LOADED", 100)),
+        tenant_tokens=tenant_tokens,
     )
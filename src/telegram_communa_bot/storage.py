@@ -0,0 +1,362 @@
+"""
+Storage backends for Persistent stores.
+
+`JsonStorage` keeps one JSON snapshot per store, optionally followed by
+a mutation journal; with `binary_members` the id sets listed in
+`Persistent.membership_fields` go to a binary `Membership` snapshot next
+to it instead, mapped on load. `SqliteStorage` keeps everything in one SQLite
+database; id sets listed in `Persistent.membership_fields` are stored
+as `(user_id, status)` rows, so every membership change is a single row
+update. `IpcStorage` is used by worker processes, which send changes to
+the process owning the stores.
+
+Backends build write jobs on the loop and the jobs themselves are safe
+to run in a thread, which is what the write-behind engine does.
+"""
+
+from .logging_setup import setup_logging
+
+logger = setup_logging(__file__)
+
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager, suppress
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, TypeVar
+
+from .journal import Journal, Op, encode
+from .membership import Membership
+from .settings import settings
+
+if TYPE_CHECKING:
+    from .persistent import Persistent
+
+T = TypeVar("T", bound="Persistent")
+
+WriteJob = Callable[[], None]
+
+SQLITE_FILE_NAME = "bot.sqlite3"
+
+
+def atomic_write(path: Path, data: str | Iterable[bytes | memoryview]) -> None:
+    """Write file via temp file + fsync + rename, so readers never see a torn file"""
+    tmp = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+    parts = [data.encode("utf-8")] if isinstance(data, str) else data
+    with open(tmp, "wb") as f:
+        f.writelines(parts)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+    # make the rename itself durable
+    with suppress(OSError):
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class Storage(ABC):
+    @abstractmethod
+    def load(self, cls: type[T]) -> T | None:
+        """Load stored state, None when nothing was stored yet"""
+
+    @abstractmethod
+    def write_job(self, obj: "Persistent", ops: list[Op], full: bool) -> WriteJob:
+        """
+        Build a job persisting `ops`, or the whole `obj` when `full` is set.
+        Called on the loop, the returned job may run in a thread.
+        """
+
+    def close(self) -> None:
+        pass
+
+
+class JsonStorage(Storage):
+    def __init__(self, journal: bool, compact_size: int, binary_members: bool = False):
+        self.use_journal: bool = journal
+        self.compact_size: int = compact_size
+        self.binary_members: bool = binary_members
+        self._journals: dict[Path, Journal] = {}
+
+    def journal(self, cls: type["Persistent"]) -> Journal:
+        path = cls.file_path()
+        journal = self._journals.get(path)
+        if not journal:
+            journal = Journal(path.with_name(path.name + ".log"))
+            self._journals[path] = journal
+        return journal
+
+    @staticmethod
+    def members_path(path: Path) -> Path:
+        return path.with_name(path.name + ".members")
+
+    def load(self, cls: type[T]) -> T | None:
+        path = cls.file_path()
+
+        logger.info("Load data from path %s", path)
+        try:
+            doc: dict[str, Any] = json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            doc = {}
+            data = None
+        else:
+            data = cls.model_validate(doc)
+
+        # written without the id sets, they are in the binary snapshot;
+        # older files still have them inline
+        members_path = self.members_path(path)
+        if (
+            data is not None
+            and cls.membership_fields
+            and not any(f in doc for f in cls.membership_fields)
+            and members_path.exists()
+        ):
+            members = Membership.open(members_path)
+            data.bind_members(members)
+            logger.info("Mapped %d members from %s", len(members), members_path)
+
+        replayed = 0
+        for op in self.journal(cls).replay():
+            data = data or cls()
+            data._apply(*op)
+            replayed += 1
+        if replayed:
+            logger.info("Replayed %d journal records for %s", replayed, cls.__name__)
+
+        return data
+
+    def write_job(self, obj: "Persistent", ops: list[Op], full: bool) -> WriteJob:
+        journal = self.journal(type(obj))
+
+        if self.use_journal and not full:
+            records = encode(ops)
+            if journal.size + len(records) < self.compact_size:
+                return lambda: journal.append(records)
+
+        # full snapshot, also folds the journal in
+        path = obj.file_path()
+        members = obj.members if self.binary_members else None
+        if members is not None:
+            snapshot = obj.model_dump_json(indent=2, exclude=set(obj.membership_fields))
+            # views of arrays which are replaced, never changed, safe in a thread
+            parts = members.to_bytes()
+        else:
+            snapshot = obj.model_dump_json(indent=2)
+            parts = None
+
+        def job() -> None:
+            if parts:
+                atomic_write(self.members_path(path), parts)
+            atomic_write(path, snapshot)
+            journal.reset()
+
+        return job
+
+
+class SqliteStorage(Storage):
+    def __init__(self, path: Path):
+        self.path: Path = path
+        # jobs run in worker threads, one at a time
+        self._lock: threading.Lock = threading.Lock()
+        self._db: sqlite3.Connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        _ = self._db.execute("PRAGMA journal_mode=WAL")
+        _ = self._db.execute("PRAGMA synchronous=NORMAL")
+        _ = self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS stores (
+                store TEXT PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS membership (
+                store TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                PRIMARY KEY (store, user_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS membership_status
+                ON membership (store, status);
+            """
+        )
+
+    def load(self, cls: type[T]) -> T | None:
+        store = cls.__name__
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data FROM stores WHERE store = ?", (store,)
+            ).fetchone()
+            members = self._db.execute(
+                "SELECT user_id, status FROM membership WHERE store = ?", (store,)
+            ).fetchall()
+
+        if row is None:
+            return self._migrate(cls)
+
+        data: dict[str, Any] = json.loads(row[0])
+        for field in cls.membership_fields:
+            data[field] = set()
+        for user_id, status in members:
+            data[status].add(user_id)
+
+        logger.info("Load %s from %s: %d members", store, self.path, len(members))
+        return cls.model_validate(data)
+
+    def _migrate(self, cls: type[T]) -> T | None:
+        """One-shot import of the JSON state files used before SQLite"""
+        path = cls.file_path()
+        legacy = JsonStorage(journal=True, compact_size=0)
+        data = legacy.load(cls)
+        if data is None:
+            return None
+
+        logger.warning("Migrate %s from %s to %s", cls.__name__, path, self.path)
+        self.write_job(data, [], full=True)()
+
+        journal = legacy.journal(cls)
+        for old in (path, journal.path, legacy.members_path(path)):
+            if old.exists():
+                _ = old.rename(old.with_name(old.name + ".migrated"))
+        return data
+
+    def write_job(self, obj: "Persistent", ops: list[Op], full: bool) -> WriteJob:
+        store = type(obj).__name__
+        membership = obj.membership_fields
+        doc = obj.model_dump_json(exclude=set(membership))
+
+        if full:
+            rows = [
+                (store, user_id, field)
+                for field in membership
+                for user_id in getattr(obj, field)
+            ]
+
+            def replace() -> None:
+                with self._transaction() as db:
+                    _ = db.execute(
+                        "INSERT OR REPLACE INTO stores VALUES (?, ?)", (store, doc)
+                    )
+                    _ = db.execute("DELETE FROM membership WHERE store = ?", (store,))
+                    _ = db.executemany(
+                        "INSERT OR REPLACE INTO membership VALUES (?, ?, ?)", rows
+                    )
+
+            return replace
+
+        doc_changed = any(f not in membership for _, f, _ in ops)
+
+        def update() -> None:
+            with self._transaction() as db:
+                # single-row statements, applied in the recorded order
+                for op, field, value in ops:
+                    if field not in membership:
+                        continue
+                    if op == "add":
+                        _ = db.execute(
+                            "INSERT OR REPLACE INTO membership VALUES (?, ?, ?)",
+                            (store, value, field),
+                        )
+                    elif op == "discard":
+                        _ = db.execute(
+                            "DELETE FROM membership"
+                            " WHERE store = ? AND user_id = ? AND status = ?",
+                            (store, value, field),
+                        )
+                if doc_changed:
+                    _ = db.execute(
+                        "INSERT OR REPLACE INTO stores VALUES (?, ?)", (store, doc)
+                    )
+
+        return update
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            _ = self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                _ = self._db.execute("ROLLBACK")
+                raise
+            _ = self._db.execute("COMMIT")
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class IpcStorage(Storage):
+    """
+    Replica of stores owned by another process, see `bot.workers`.
+
+    Loads from snapshots sent by the owner, writes send the recorded ops,
+    or the whole store, to the owner instead of persisting them.
+    """
+
+    def __init__(self):
+        self.snapshots: dict[str, dict[str, Any]] = {}
+        self.send: Callable[[tuple[Any, ...]], None] | None = None
+
+    def load(self, cls: type[T]) -> T | None:
+        data = self.snapshots.get(cls.__name__)
+        return cls.model_validate(data) if data is not None else None
+
+    def write_job(self, obj: "Persistent", ops: list[Op], full: bool) -> WriteJob:
+        name = type(obj).__name__
+        if full:
+            message: tuple[Any, ...] = ("snapshot", name, obj.model_dump(mode="json"))
+        else:
+            message = ("ops", name, ops)
+
+        send = self.send
+
+        def job() -> None:
+            if send:
+                send(message)
+            else:
+                logger.error("%s changed, but there is no owner to send it to", name)
+
+        return job
+
+
+_storages: dict[tuple[str, Path], Storage] = {}
+
+
+def storage(path: Path | None = None) -> Storage:
+    """Storage backend selected by `BOT_STORAGE` for the data directory `path`"""
+    cfg = settings()
+    path = path or cfg.data_path
+    key = (cfg.storage, path)
+    backend = _storages.get(key)
+    if backend:
+        return backend
+
+    if cfg.storage == "sqlite":
+        backend = SqliteStorage(path.joinpath(SQLITE_FILE_NAME))
+    elif cfg.storage == "ipc":
+        backend = IpcStorage()
+    else:
+        backend = JsonStorage(
+            cfg.storage == "journal", cfg.journal_compact_size, cfg.binary_members
+        )
+
+    _storages[key] = backend
+    return backend
+
+
+def close_storage(path: Path) -> None:
+    """Close the backends of the data directory `path`, opened again on next use"""
+    for key in [x for x in _storages if x[1] == path]:
+        _storages.pop(key).close()
+
+
+def close_storages() -> None:
+    for backend in _storages.values():
+        backend.close()
+    _storages.clear()
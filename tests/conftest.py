@@ -0,0 +1,22 @@
+#!/bin/env/python3
+
+import pytest
+
+from telegram_communa_bot.settings import reset_settings
+
+
+@pytest.fixture(autouse=True)
+def fresh_settings():
+    """Settings are parsed once, tests change the environment"""
+    reset_settings()
+    yield
+    reset_settings()
+
+
+@pytest.fixture
+def data_path(tmp_path, monkeypatch):
+    """Point bot settings to a temporary data directory"""
+    monkeypatch.setenv("TELEGRAM_BOT_TOKEN", "1234567890:ABCdefGHIjklMNOpqrsTUVwxyz")
+    monkeypatch.setenv("BOT_ADMIN", "1")
+    monkeypatch.setenv("BOT_DATA_PATH", str(tmp_path))
+    return tmp_path
@@ -0,0 +1,111 @@
+#!/bin/env/python3
+
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.methods import CopyMessage
+
+from telegram_communa_bot.bot import app_data as app_data_module
+from telegram_communa_bot.bot import broadcast as broadcast_module
+from telegram_communa_bot.bot import globals as globals_module
+from telegram_communa_bot.bot.app_data import users_lists
+from telegram_communa_bot.bot.broadcast import Broadcast, BroadcastState, broadcast_state
+
+
+class FakeBot:
+    def __init__(self, blocked: set[int] = set()):
+        self.blocked: set[int] = blocked
+        self.copied: list[int] = []
+        self.edits: list[str] = []
+        self.gate: asyncio.Event = asyncio.Event()
+        self.gate.set()
+        # ids from which copies wait for the gate
+        self.hold_from: int = 0
+
+    async def copy_message(self, chat_id: int, from_chat_id: int, message_id: int):
+        if self.hold_from and chat_id >= self.hold_from:
+            await self.gate.wait()
+        if chat_id in self.blocked:
+            method = CopyMessage(chat_id=chat_id, from_chat_id=from_chat_id, message_id=message_id)
+            raise TelegramForbiddenError(method=method, message="bot was blocked by the user")
+        self.copied.append(chat_id)
+
+    async def edit_message_text(self, text: str, chat_id: int, message_id: int):
+        self.edits.append(text)
+
+
+class FakeGlobalBot:
+    def __init__(self, bot: FakeBot):
+        self._bot: FakeBot = bot
+
+
+@pytest.fixture
+def fake_bot(data_path, monkeypatch):
+    monkeypatch.setattr(app_data_module, "__user_lists", None)
+    monkeypatch.setattr(broadcast_module, "__broadcast_state", None)
+    bot = FakeBot(blocked={4})
+    monkeypatch.setattr(globals_module, "_global_bot", FakeGlobalBot(bot))
+    return bot
+
+
+@pytest.mark.asyncio
+async def test_broadcast_flags_blocked_users(fake_bot):
+    state = broadcast_state()
+    state.begin(-100, 7, 8, list(range(1, 11)))
+
+    await Broadcast(state, concurrency=3).run()
+
+    assert sorted(fake_bot.copied) == [1, 2, 3, 5, 6, 7, 8, 9, 10]
+    assert users_lists().unreachable == {4}
+    assert "доставлено 9 из 10" in fake_bot.edits[-1]
+    assert "заблокировали бота 1" in fake_bot.edits[-1]
+    assert not BroadcastState.load().running
+
+
+@pytest.mark.asyncio
+async def test_cut_broadcast_resumes(fake_bot):
+    fake_bot.hold_from = 6
+    fake_bot.gate.clear()
+    state = broadcast_state()
+    state.begin(-100, 7, 0, list(range(1, 11)))
+
+    task = asyncio.create_task(Broadcast(state, concurrency=2).run())
+    while len(fake_bot.copied) < 4:
+        await asyncio.sleep(0)
+    _ = task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    saved = BroadcastState.load()
+    assert saved.running
+    assert saved.position == 5
+    assert (saved.sent, saved.blocked) == (4, 1)
+
+    fake_bot.gate.set()
+    await Broadcast(saved, concurrency=2).run()
+
+    assert sorted(fake_bot.copied) == [1, 2, 3, 5, 6, 7, 8, 9, 10]
+    assert not BroadcastState.load().running
+
+
+def test_resume_skips_done_above(fake_bot):
+    state = BroadcastState(recipients=[10, 20, 30, 40], position=1, done_above=[2])
+    broadcast = Broadcast(state, concurrency=1)
+
+    assert broadcast.done == 2
+    broadcast._finish(1)
+    assert broadcast.position == 3
+    assert state.done_above == []
+
+
+@pytest.mark.asyncio
+async def test_resume_sends_once_to_each_recipient(fake_bot):
+    fake_bot.blocked = set()
+    state = broadcast_state()
+    state.begin(-100, 7, 0, [1, 2, 3, 4, 5])
+    state.set_field("position", 1)
+    state.set_field("done_above", [2, 3])
+
+    await Broadcast(state, concurrency=1).run()
+    assert fake_bot.copied == [2, 5]
@@ -0,0 +1,63 @@
+#!/bin/env/python3
+
+from telegram_communa_bot.bot.flood import BLOCK, DROP, MUTE, PASS, WARN, FloodControl
+
+
+class Clock:
+    def __init__(self):
+        self.now: float = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def flood(clock: Clock, **kwargs) -> FloodControl:
+    args = dict(rate=1.0, burst=3, mute=60.0, block_after=2, max_users=100, clock=clock)
+    args.update(kwargs)
+    return FloodControl(**args)
+
+
+def test_bucket_refills():
+    clock = Clock()
+    fc = flood(clock)
+
+    assert [fc.check(1) for _ in range(4)] == [PASS, PASS, PASS, WARN]
+    assert fc.check(2) == PASS
+    clock.now = 1.0
+    assert fc.check(1) == PASS
+    assert fc.check(1) == WARN
+
+
+def test_escalation_to_block():
+    clock = Clock()
+    fc = flood(clock)
+
+    verdicts = [fc.check(1) for _ in range(6)]
+    assert verdicts == [PASS, PASS, PASS, WARN, DROP, MUTE]
+    clock.now = 59.0
+    assert fc.check(1) == DROP
+
+    clock.now = 60.0
+    # refilled while muted
+    assert [fc.check(1) for _ in range(6)] == [PASS, PASS, PASS, WARN, DROP, BLOCK]
+    assert fc.stats.dropped == 7
+    assert len(fc) == 0
+
+
+def test_idle_senders_expire():
+    clock = Clock()
+    fc = flood(clock, max_users=3)
+
+    for user_id in range(3):
+        _ = fc.check(user_id)
+    assert len(fc) == 3
+    _ = fc.check(3)
+    assert len(fc) == 3
+    assert fc.stats.evictions == 1
+
+    clock.now = 1000.0
+    for user_id in range(10, 13):
+        _ = fc.check(user_id)
+    # slots are reused, the arrays don't grow
+    assert len(fc) == 3
+    assert len(fc._tokens) == 3
@@ -0,0 +1,87 @@
+#!/bin/env/python3
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from telegram_communa_bot.bot import forwarding
+from telegram_communa_bot.bot.forwarding import Forwarder
+from telegram_communa_bot.bot.reply_index import ReplyIndex
+
+
+class FakeBot:
+    def __init__(self):
+        self.calls: list[tuple[str, int, list[int]]] = []
+
+    async def forward_message(self, chat_id, from_chat_id, message_id):
+        self.calls.append(("one", from_chat_id, [message_id]))
+        return SimpleNamespace(message_id=1000 + message_id)
+
+    async def forward_messages(self, chat_id, from_chat_id, message_ids):
+        self.calls.append(("many", from_chat_id, message_ids))
+        return [SimpleNamespace(message_id=1000 + x) for x in message_ids]
+
+
+def message(chat_id: int, message_id: int, media_group_id: str | None = None):
+    return SimpleNamespace(
+        chat=SimpleNamespace(id=chat_id),
+        message_id=message_id,
+        media_group_id=media_group_id,
+    )
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = ReplyIndex(tmp_path / "reply_index.bin", capacity=64, max_age=0)
+    yield index
+    index.close()
+
+
+@pytest.fixture
+def bot(monkeypatch, index):
+    bot = FakeBot()
+    monkeypatch.setattr(forwarding.GlobalBot, "get", staticmethod(lambda: bot))
+    monkeypatch.setattr(forwarding, "app_data", lambda: SimpleNamespace(chat_id=-100))
+    monkeypatch.setattr(forwarding, "reply_index", lambda: index)
+    return bot
+
+
+@pytest.mark.asyncio
+async def test_album_is_forwarded_in_one_call(bot):
+    fw = Forwarder(album_window=0.01, burst_window=0, max_batch=100)
+
+    for i in (1, 2, 3):
+        await fw.add(message(5, i, "album"))
+    await fw.add(message(5, 4))
+    await asyncio.sleep(0.05)
+
+    assert bot.calls == [("many", 5, [1, 2, 3]), ("one", 5, [4])]
+    assert fw.stats.saved == 2
+
+
+@pytest.mark.asyncio
+async def test_burst_flushes_on_batch_limit(bot):
+    fw = Forwarder(album_window=0.01, burst_window=60, max_batch=2)
+
+    for i in (1, 2, 3):
+        await fw.add(message(5, i))
+    assert bot.calls == [("many", 5, [1, 2])]
+
+    await fw.close()
+    assert bot.calls[-1] == ("one", 5, [3])
+
+
+@pytest.mark.asyncio
+async def test_forwards_are_indexed_for_replies(bot, index):
+    fw = Forwarder(album_window=0.01, burst_window=0, max_batch=100)
+
+    for i in (1, 2):
+        await fw.add(message(5, i, "album"))
+    await fw.add(message(7, 3))
+    await fw.close()
+
+    assert index.lookup(-100, 1001) == (5, 1)
+    assert index.lookup(-100, 1002) == (5, 2)
+    assert index.lookup(-100, 1003) == (7, 3)
+    assert index.lookup(-100, 1004) is None
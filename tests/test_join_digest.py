@@ -0,0 +1,102 @@
+#!/bin/env/python3
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.types import User
+
+from telegram_communa_bot.bot import app_data as app_data_module
+from telegram_communa_bot.bot import globals as globals_module
+from telegram_communa_bot.bot import join_digest as join_digest_module
+from telegram_communa_bot.bot.app_data import app_data, users_lists
+from telegram_communa_bot.bot.join_digest import _PAGES_SIZE, PAGE_KEY, PAGE_SIZE, JoinDigest
+
+
+class FakeBot:
+    def __init__(self):
+        self.calls: list[str] = []
+
+    async def send_message(self, chat_id: int, text: str, reply_markup=None):
+        self.calls.append("send")
+        return SimpleNamespace(message_id=100 + len(self.calls))
+
+    async def edit_message_text(self, text: str, chat_id: int, message_id: int, reply_markup=None):
+        self.calls.append("edit")
+        self.last = (text, reply_markup)
+
+
+@pytest.fixture
+def fake_bot(data_path, monkeypatch):
+    monkeypatch.setattr(app_data_module, "__persistent", None)
+    monkeypatch.setattr(app_data_module, "__user_lists", None)
+
+    async def fake_user_from_id(user_id: int) -> User | None:
+        return User(id=user_id, is_bot=False, first_name=f"user{user_id}")
+
+    monkeypatch.setattr(join_digest_module, "user_from_id", fake_user_from_id)
+    bot = FakeBot()
+    monkeypatch.setattr(globals_module, "_global_bot", SimpleNamespace(_bot=bot))
+    app_data().set_field("chat_id", -100)
+    return bot
+
+
+@pytest.mark.asyncio
+async def test_burst_of_joins_is_one_message(fake_bot):
+    digest = JoinDigest(window=0.05)
+    ul = users_lists()
+    for user_id in range(1, 1001):
+        ul.wait(user_id)
+        digest.add(user_id)
+    await asyncio.sleep(0.1)
+
+    assert fake_bot.calls == ["send"]
+    assert app_data().join_digest_id == 101
+
+    for user_id in range(1001, 1011):
+        ul.wait(user_id)
+        digest.add(user_id)
+    await asyncio.sleep(0.1)
+    assert fake_bot.calls == ["send", "edit"]
+
+    text, kb = fake_bot.last
+    assert "1010" in text
+    rows = kb.inline_keyboard
+    assert rows[0][0].callback_data == "allow_user:1:yes"
+    assert rows[PAGE_SIZE][0].callback_data == "allow_user:p2:yes"
+    assert rows[-1][0].callback_data == "list:digest:1"
+
+
+@pytest.mark.asyncio
+async def test_digest_closes_when_handled(fake_bot):
+    digest = JoinDigest(window=0.05)
+    users_lists().wait(1)
+    digest.add(1)
+    await digest.close()
+    assert app_data().join_digest_id
+
+    users_lists().allow(1)
+    await digest.update_now()
+    assert fake_bot.calls == ["send", "edit"]
+    assert fake_bot.last[1] is None
+    assert not app_data().join_digest_id
+
+
+@pytest.mark.asyncio
+async def test_page_buttons_keep_the_ids_shown(fake_bot):
+    digest = JoinDigest(window=0.05)
+    ul = users_lists()
+    for user_id in (10, 20, 30):
+        ul.wait(user_id)
+
+    _, kb = await digest.render(0)
+    assert kb
+    key = kb.inline_keyboard[3][0].callback_data.split(":")[1].removeprefix(PAGE_KEY)
+
+    # joins later, between the ids on the page
+    ul.wait(15)
+    assert digest.page_ids(key) == [10, 20, 30]
+
+    for _ in range(_PAGES_SIZE):
+        _ = await digest.render(0)
+    assert digest.page_ids(key) is None
@@ -0,0 +1,58 @@
+#!/bin/env/python3
+
+import json
+
+from telegram_communa_bot.bot.app_data import UsersLists
+
+
+def test_journal_replay(data_path, monkeypatch):
+    monkeypatch.setenv("BOT_STORAGE", "journal")
+
+    ul = UsersLists.load()
+    ul.wait(1)
+    ul.save()
+    ul.allow(1)
+    ul.block(2)
+    ul.save()
+
+    log = data_path / "users_lists.json.log"
+    assert log.read_text().splitlines()[-1] == '["add","black_list",2]'
+
+    ul = UsersLists.load()
+    assert ul.white_list == {1}
+    assert ul.black_list == {2}
+    assert ul.wait_list == set()
+
+
+def test_journal_torn_record(data_path, monkeypatch):
+    monkeypatch.setenv("BOT_STORAGE", "journal")
+
+    ul = UsersLists.load()
+    ul.allow(1)
+    ul.save()
+
+    log = data_path / "users_lists.json.log"
+    with open(log, "ab") as f:
+        _ = f.write(b'["add","black_li')
+
+    ul = UsersLists.load()
+    assert ul.white_list == {1}
+    assert ul.black_list == set()
+    assert log.read_text() == '["add","white_list",1]\n'
+
+
+def test_journal_compaction(data_path, monkeypatch):
+    monkeypatch.setenv("BOT_STORAGE", "journal")
+    monkeypatch.setenv("BOT_JOURNAL_COMPACT_SIZE", "100")
+
+    ul = UsersLists.load()
+    for i in range(10):
+        ul.allow(i)
+        ul.save()
+
+    log = data_path / "users_lists.json.log"
+    assert log.stat().st_size < 100
+
+    snapshot = json.loads((data_path / "users_lists.json").read_text())
+    assert len(snapshot["white_list"]) + len(log.read_text().splitlines()) == 10
+    assert UsersLists.load().white_list == set(range(10))
@@ -0,0 +1,181 @@
+#!/bin/env/python3
+
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import pytest
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message
+from aiohttp import web
+
+from telegram_communa_bot.bot import app_data as app_data_module
+from telegram_communa_bot.bot.app_data import app_data
+from telegram_communa_bot.bot import lifecycle
+from telegram_communa_bot.bot.lifecycle import Poller, UpdateTracker
+from telegram_communa_bot.settings import settings
+
+
+def test_tracker_offset_and_dedupe():
+    tracker = UpdateTracker()
+    for update_id in (1, 2, 3):
+        assert tracker.start(update_id)
+
+    tracker.finish(2)
+    assert tracker.checkpoint() == (1, [2])
+    tracker.finish(1)
+    assert tracker.offset == 3
+    tracker.finish(3)
+    assert tracker.checkpoint() == (4, [])
+
+    restored = UpdateTracker(1, [2])
+    assert restored.offset == 1
+    assert not restored.start(2)
+    assert restored.start(1)
+
+
+def message(update_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(datetime.now().timestamp()),
+            "chat": {"id": 5, "type": "private"},
+            "text": text,
+        },
+    }
+
+
+@asynccontextmanager
+async def serve_updates(updates: list[dict], offsets: list[int | None]):
+    """Telegram keeps `updates` until an offset above them confirms them"""
+
+    async def handle(request: web.Request) -> web.Response:
+        if request.match_info["method"] != "getUpdates":
+            return web.json_response({"ok": True, "result": True})
+
+        form = await request.post()
+        offset = int(str(form["offset"])) if "offset" in form else None
+        offsets.append(offset)
+        if offset is not None:
+            updates[:] = [x for x in updates if x["update_id"] >= offset]
+        if not updates:
+            await asyncio.sleep(0.05)
+        # the default limit of getUpdates
+        return web.json_response({"ok": True, "result": updates[:100]})
+
+    app = web.Application()
+    _ = app.router.add_post("/bot{token}/{method}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]  # pyright: ignore
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{port}"))
+    try:
+        yield Bot("42:lifecycle", session=session)
+    finally:
+        await runner.cleanup()
+
+
+async def poll(
+    updates: list[dict], block: str, fetches: int = 1
+) -> tuple[Poller, list[int | None]]:
+    """Poll until an update is handled and `fetches` made, stop with `block` messages in flight"""
+    router = Router()
+    handled = asyncio.Event()
+
+    @router.message()
+    async def handle(msg: Message):
+        if msg.text == block:
+            await asyncio.sleep(10)
+        handled.set()
+
+    dp = Dispatcher()
+    _ = dp.include_router(router)
+
+    offsets: list[int | None] = []
+    async with serve_updates(updates, offsets) as bot:
+        poller = Poller(dp, bot, settings())
+        running = asyncio.create_task(poller.run())
+        _ = await asyncio.wait_for(handled.wait(), 5)
+        while len(offsets) < fetches:
+            await asyncio.sleep(0.01)
+        poller.stop()
+        await running
+    return poller, offsets
+
+
+@pytest.mark.asyncio
+async def test_restart_resumes_at_the_saved_offset(data_path, monkeypatch):
+    monkeypatch.setenv("BOT_DRAIN_TIMEOUT", "0.2")
+    monkeypatch.setattr(app_data_module, "__persistent", None)
+    telegram = [message(10, "fast"), message(11, "slow"), message(12, "fast")]
+
+    first, offsets = await poll(telegram, block="slow")
+    assert offsets[0] is None
+    assert (first.stats.processed, first.stats.cancelled) == (2, 1)
+    assert json.loads((data_path / "persistent.json").read_text())["update_offset"] == 11
+    assert app_data().updates_done == [12]
+
+    # Telegram delivers everything from the offset again
+    second, offsets = await poll(telegram, block="")
+    assert offsets[0] == 11
+    assert (second.stats.processed, second.stats.skipped) == (1, 1)
+    assert app_data().update_offset == 13
+
+
+@pytest.mark.asyncio
+async def test_updates_in_flight_stay_with_telegram(data_path, monkeypatch):
+    monkeypatch.setenv("BOT_DRAIN_TIMEOUT", "0.1")
+    monkeypatch.setattr(app_data_module, "__persistent", None)
+    telegram = [message(20, "slow"), message(21, "fast")]
+
+    # fetches go on while 20 is handled, then it is cancelled
+    first, offsets = await poll(telegram, block="slow", fetches=4)
+    assert set(offsets[1:]) == {20}
+    assert first.stats.cancelled == 1
+    assert [x["update_id"] for x in telegram] == [20, 21]
+
+    second, offsets = await poll(telegram, block="")
+    assert offsets[0] == 20
+    assert (second.stats.processed, second.stats.skipped) == (1, 1)
+    assert app_data().update_offset == 22
+
+
+@pytest.mark.asyncio
+async def test_slow_update_holds_the_offset_for_a_while(data_path, monkeypatch):
+    monkeypatch.setenv("BOT_DRAIN_TIMEOUT", "0.1")
+    monkeypatch.setattr(app_data_module, "__persistent", None)
+    monkeypatch.setattr(lifecycle, "OFFSET_HOLD", 0.3)
+    # more than a batch behind the slow one
+    telegram = [message(100, "slow")] + [message(x, "fast") for x in range(101, 251)]
+
+    router = Router()
+    handled: list[int] = []
+
+    @router.message()
+    async def handle(msg: Message):
+        if msg.text == "slow":
+            await asyncio.sleep(10)
+        handled.append(msg.message_id)
+
+    dp = Dispatcher()
+    _ = dp.include_router(router)
+    offsets: list[int | None] = []
+    async with serve_updates(telegram, offsets) as bot:
+        poller = Poller(dp, bot, settings())
+        running = asyncio.create_task(poller.run())
+        for _ in range(300):
+            if len(handled) == 150:
+                break
+            await asyncio.sleep(0.01)
+        poller.stop()
+        await running
+
+    assert len(handled) == 150
+    assert 100 in offsets and 200 in offsets
+    assert poller.stats.cancelled == 1
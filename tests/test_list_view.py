@@ -0,0 +1,46 @@
+#!/bin/env/python3
+
+import pytest
+from aiogram.types import User
+
+from telegram_communa_bot.bot import list_view
+from telegram_communa_bot.bot.app_data import UsersLists
+from telegram_communa_bot.bot.common import md_escape
+
+
+def test_md_escape():
+    assert md_escape("a_b (c).") == "a\\_b \\(c\\)\\."
+
+
+@pytest.mark.asyncio
+async def test_render_list_pages(data_path, monkeypatch):
+    resolved: list[int] = []
+
+    async def fake_user_from_id(user_id: int) -> User | None:
+        resolved.append(user_id)
+        return User(id=user_id, is_bot=False, first_name="Name_" + str(user_id))
+
+    monkeypatch.setattr(list_view, "user_from_id", fake_user_from_id)
+
+    ul = UsersLists.load()
+    monkeypatch.setattr(list_view, "users_lists", lambda: ul)
+    total = list_view.PAGE_SIZE * 2 + 1
+    for i in range(total):
+        ul.allow(i)
+
+    text, kb = await list_view.render_list("white", 1)
+    assert "стр\\. 2/3" in text
+    assert "Name\\_" + str(list_view.PAGE_SIZE) in text
+    assert len(resolved) == list_view.PAGE_SIZE
+    assert kb and [b.callback_data for b in kb.inline_keyboard[0]] == [
+        "list:white:0",
+        "list:white:2",
+    ]
+
+    # memoized until the list changes
+    assert await list_view.render_list("white", 1) == (text, kb)
+    assert len(resolved) == list_view.PAGE_SIZE
+
+    ul.block(0)
+    _ = await list_view.render_list("white", 1)
+    assert len(resolved) == list_view.PAGE_SIZE * 2
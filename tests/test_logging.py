@@ -1,9 +1,48 @@
 #!/bin/env/python3
 
-from telegram_communa_bot.logging_setup import setup_logging
+import logging
+
+from telegram_communa_bot.logging_setup import (
+    RateLimitedLog,
+    module_name,
+    setup_logging,
+)
 
 
 def test_logging_setup():
     """Test that logging setup initializes correctly."""
     logger = setup_logging(__file__)
     assert logger is not None
+
+
+def test_module_name():
+    assert (
+        module_name("/app/src/telegram_communa_bot/bot/admin.py")
+        == "telegram_communa_bot.bot.admin"
+    )
+    assert module_name("/app/telegram_communa_bot/__init__.py") == "telegram_communa_bot"
+    assert module_name("/tmp/other.py") == "other"
+    assert module_name("aiogram") == "aiogram"
+
+
+def test_rate_limited_log(caplog):
+    logger = logging.getLogger("test_rate_limited_log")
+    trace = RateLimitedLog(logger, level=logging.INFO, rate=2)
+
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        for i in range(10):
+            trace("update %s", i)
+
+    assert [r.getMessage() for r in caplog.records] == ["update 0", "update 1"]
+    assert trace.suppressed == 8
+
+
+def test_rate_limited_log_skips_disabled_level(caplog):
+    logger = logging.getLogger("test_rate_limited_log_disabled")
+    trace = RateLimitedLog(logger, level=logging.DEBUG, rate=1)
+
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        trace("update")
+
+    assert not caplog.records
+    assert trace.suppressed == 0
@@ -0,0 +1,104 @@
+#!/bin/env/python3
+
+import json
+import random
+
+import pytest
+
+from telegram_communa_bot import membership as membership_module
+from telegram_communa_bot.bot.app_data import UsersLists
+from telegram_communa_bot.membership import Membership, StatusView
+from telegram_communa_bot.settings import reset_settings
+
+
+def test_matches_a_dict(monkeypatch):
+    # merge often, so lookups go through both the overlay and the arrays
+    monkeypatch.setattr(membership_module, "MERGE_MIN", 16)
+    rng = random.Random(22)
+    members = Membership.from_sets([[5, 1], [3], [-7]])
+    expected = {5: 1, 1: 1, 3: 2, -7: 3}
+
+    for _ in range(3000):
+        user_id, status = rng.randrange(-50, 200), rng.randrange(4)
+        members.set(user_id, status)
+        if status:
+            expected[user_id] = status
+        else:
+            _ = expected.pop(user_id, None)
+        assert members.get(user_id) == status
+
+    for status in (1, 2, 3):
+        ids = sorted(x for x, s in expected.items() if s == status)
+        assert list(members.iter_status(status)) == ids
+        assert members.count(status) == len(ids)
+    assert len(members) == len(expected)
+
+
+def test_views_are_exclusive_sets():
+    members = Membership.from_sets([[1, 2], [3]])
+    white, black = StatusView(members, 1), StatusView(members, 2)
+
+    black.add(2)
+    assert white == {1} and black == {2, 3}
+    white.discard(3)
+    assert 3 in black
+    assert white | black == {1, 2, 3}
+    assert {1, 2, 3} - black == {1}
+    assert sorted(black - {3}) == [2]
+
+
+def test_binary_snapshot_is_mapped(tmp_path):
+    path = tmp_path / "members"
+    members = Membership.from_sets([range(0, 1000, 2), range(1, 1000, 2)])
+    members.set(4, 0)
+    path.write_bytes(b"".join(members.to_bytes()))
+
+    mapped = Membership.open(path)
+    assert isinstance(mapped._ids, memoryview)
+    assert (len(mapped), mapped.get(4), mapped.get(7)) == (999, 0, 2)
+
+    # changes never touch the mapped file
+    mapped.set(7, 1)
+    mapped.merge()
+    assert Membership.open(path).get(7) == 2
+
+    path.write_bytes(b"".join(members.to_bytes())[:-1])
+    with pytest.raises(ValueError, match="truncated"):
+        _ = Membership.open(path)
+    path.write_bytes(b"{}" * 16)
+    with pytest.raises(ValueError, match="not a membership"):
+        _ = Membership.open(path)
+
+
+def test_binary_members_storage(data_path, monkeypatch):
+    ul = UsersLists.load()
+    for i in range(10):
+        ul.wait(i)
+    ul.allow(3)
+    ul.save()
+
+    # the lists are inline until binary members are turned on
+    assert json.loads((data_path / "users_lists.json").read_text())["wait_list"]
+    monkeypatch.setenv("BOT_BINARY_MEMBERS", "1")
+    monkeypatch.setenv("BOT_STORAGE", "journal")
+    reset_settings()
+    ul = UsersLists.load()
+    assert ul.white_list == {3}
+    ul.save()
+
+    doc = json.loads((data_path / "users_lists.json").read_text())
+    assert "wait_list" not in doc and "5" in doc["wait_since"]
+    assert (data_path / "users_lists.json.members").exists()
+
+    ul = UsersLists.load()
+    ul.block(4)
+    ul.save()
+
+    ul = UsersLists.load()
+    assert (ul.status(3), ul.status(4), ul.status(5), ul.status(99)) == (
+        "white_list",
+        "black_list",
+        "wait_list",
+        None,
+    )
+    assert sorted(ul.wait_list) == [0, 1, 2, 5, 6, 7, 8, 9]
@@ -0,0 +1,106 @@
+#!/bin/env/python3
+
+from datetime import datetime
+
+import pytest
+from aiogram import Bot, Dispatcher, Router
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+from aiogram.types import Chat, Message, Update
+
+from telegram_communa_bot.bot.instrumentation import (
+    ApiMetricsMiddleware,
+    instrument_dispatcher,
+)
+from telegram_communa_bot.metrics import (
+    API_REQUESTS,
+    HANDLER_SECONDS,
+    UPDATES,
+    Registry,
+)
+
+
+def test_render_exposition_format():
+    registry = Registry()
+    counter = registry.counter("c_total", "A counter", ("kind",))
+    histogram = registry.histogram("h_seconds", "A histogram", buckets=(0.1, 1.0))
+    _ = registry.gauge("g", "A gauge", lambda: 3)
+
+    counter.inc('a"b')
+    counter.inc('a"b', value=2)
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+
+    assert registry.render().splitlines() == [
+        "# HELP c_total A counter",
+        "# TYPE c_total counter",
+        'c_total{kind="a\\"b"} 3',
+        "# HELP h_seconds A histogram",
+        "# TYPE h_seconds histogram",
+        'h_seconds_bucket{le="0.1"} 1',
+        'h_seconds_bucket{le="1.0"} 2',
+        'h_seconds_bucket{le="+Inf"} 3',
+        "h_seconds_sum 5.55",
+        "h_seconds_count 3",
+        "# HELP g A gauge",
+        "# TYPE g gauge",
+        "g 3",
+    ]
+    assert histogram.count() == 3
+
+
+def test_duplicate_metric_is_rejected():
+    registry = Registry()
+    _ = registry.counter("c_total", "A counter")
+    with pytest.raises(ValueError):
+        _ = registry.counter("c_total", "A counter")
+
+
+def update(update_id: int, text: str) -> Update:
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=1,
+            date=datetime.now(),
+            chat=Chat(id=5, type="private"),
+            text=text,
+        ),
+    )
+
+
+@pytest.mark.asyncio
+async def test_updates_and_handlers_are_counted():
+    router = Router(name="metrics_test")
+
+    @router.message(lambda m: m.text == "ok")
+    async def metrics_test_handler(_: Message):
+        return True
+
+    dp = Dispatcher()
+    instrument_dispatcher(dp)
+    _ = dp.include_router(router)
+    bot = Bot("42:metrics")
+
+    handled = UPDATES.get("message", "metrics_test", "handled")
+    unhandled = UPDATES.get("message", "none", "unhandled")
+
+    _ = await dp.feed_update(bot, update(1, "ok"))
+    _ = await dp.feed_update(bot, update(2, "other"))
+
+    assert UPDATES.get("message", "metrics_test", "handled") == handled + 1
+    assert UPDATES.get("message", "none", "unhandled") == unhandled + 1
+    assert HANDLER_SECONDS.count("metrics_test", "metrics_test_handler") >= 1
+    await bot.session.close()
+
+
+@pytest.mark.asyncio
+async def test_api_errors_are_counted_by_code():
+    method = SendMessage(chat_id=1, text="hi")
+
+    async def flooded(bot, method):
+        raise TelegramRetryAfter(method=method, message="flood", retry_after=1)
+
+    before = API_REQUESTS.get("sendMessage", "429")
+    with pytest.raises(TelegramRetryAfter):
+        _ = await ApiMetricsMiddleware()(flooded, None, method)
+    assert API_REQUESTS.get("sendMessage", "429") == before + 1
@@ -0,0 +1,73 @@
+#!/bin/env/python3
+
+import time
+
+import pytest
+
+from telegram_communa_bot.bot.app_data import UsersLists
+from telegram_communa_bot.bot.moderation import apply, parse_targets, select, undated
+
+
+def test_parse_targets():
+    targets = parse_targets("5, 7 100-90 since 2h", now=10_000)
+    assert targets.ids == {5, 7}
+    assert targets.ranges == [(90, 100)]
+    assert targets.since == 10_000 - 7200
+
+    assert parse_targets("since 2026-10-18T10:00").since
+    assert not parse_targets("")
+    with pytest.raises(ValueError, match="@spam"):
+        _ = parse_targets("1 @spam")
+    with pytest.raises(ValueError, match="since"):
+        _ = parse_targets("since yesterday")
+
+
+def test_bulk_change_is_saved_once(data_path, monkeypatch):
+    ul = UsersLists.load()
+    for i in range(1, 11):
+        ul.wait(i)
+    ul.allow(20)
+    ul.save()
+
+    saves: list[int] = []
+    monkeypatch.setattr(UsersLists, "save", lambda self: saves.append(1))
+    ids = select(parse_targets("20 21 3-5"), ul)
+    outcome = apply(ul, "allow", ids)
+
+    assert outcome.changed == [3, 4, 5]
+    assert (outcome.unchanged, outcome.unknown) == (1, 1)
+    assert len(saves) == 1
+    assert ul.white_list == {3, 4, 5, 20}
+    assert 3 not in ul.wait_since
+
+
+def test_waitlisted_since_survives_restart(data_path, monkeypatch):
+    monkeypatch.setenv("BOT_STORAGE", "journal")
+
+    ul = UsersLists.load()
+    ul.wait(1)
+    ul.put_in("wait_since", 1, time.time() - 3600)
+    ul.save()
+    ul.wait(2)
+    ul.save()
+
+    ul = UsersLists.load()
+    assert select(parse_targets("since 30m"), ul) == {2}
+    assert select(parse_targets("since 2h"), ul) == {1, 2}
+
+    outcome = apply(ul, "block", select(parse_targets("since 30m"), ul))
+    assert outcome.changed == [2]
+    assert UsersLists.load().wait_since.keys() == {1}
+
+
+def test_since_counts_users_without_a_time(data_path):
+    ul = UsersLists.load()
+    ul.wait(1)
+    ul.wait(2)
+    # waitlisted before times were recorded
+    ul.pop_from("wait_since", 2)
+
+    targets = parse_targets("since 1h")
+    assert select(targets, ul) == {1}
+    assert undated(targets, ul) == 1
+    assert undated(parse_targets("2"), ul) == 0
@@ -0,0 +1,98 @@
+#!/bin/env/python3
+
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetChat, SendMessage
+
+from telegram_communa_bot.bot.outbound import (
+    BULK,
+    HIGH,
+    NORMAL,
+    OutboundScheduler,
+    TokenBucket,
+    lane,
+)
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.try_take()
+    assert bucket.try_take()
+    assert not bucket.try_take()
+    assert 0 < bucket.wait_time() <= 0.1
+
+
+@pytest.mark.asyncio
+async def test_high_lane_goes_first():
+    scheduler = OutboundScheduler(global_rate=50, group_rate=100, retries=0)
+    sent: list[str] = []
+
+    async def make_request(bot, method):
+        sent.append(method.text)
+        return True
+
+    # drain the burst, so the rest has to queue
+    for i in range(50):
+        _ = await scheduler(make_request, None, SendMessage(chat_id=i, text="warmup"))
+    sent.clear()
+
+    async def send(text: str, value: int):
+        with lane(value):
+            _ = await scheduler(make_request, None, SendMessage(chat_id=1, text=text))
+
+    tasks = [asyncio.create_task(send(f"bulk{i}", BULK)) for i in range(3)]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(send("lobby", HIGH)))
+    await asyncio.gather(*tasks)
+
+    assert sent[0] == "lobby"
+    assert scheduler.stats.queued == {"high": 0, "normal": 0, "bulk": 0}
+
+
+@pytest.mark.asyncio
+async def test_high_lane_goes_first_in_a_group():
+    scheduler = OutboundScheduler(global_rate=1000, group_rate=5, retries=0)
+    sent: list[str] = []
+
+    async def make_request(bot, method):
+        sent.append(method.text)
+        return True
+
+    async def send(text: str, value: int):
+        with lane(value):
+            _ = await scheduler(make_request, None, SendMessage(chat_id=-100, text=text))
+
+    await send("warmup", NORMAL)
+    # the burst of the lobby is used up
+    scheduler._groups[-100].bucket.tokens = 0
+    sent.clear()
+
+    tasks = [asyncio.create_task(send(f"forward{i}", NORMAL)) for i in range(3)]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(send("reply", HIGH)))
+    await asyncio.gather(*tasks)
+
+    assert sent == ["reply", "forward0", "forward1", "forward2"]
+
+
+@pytest.mark.asyncio
+async def test_retry_after_parks_chat():
+    scheduler = OutboundScheduler(global_rate=100, group_rate=100, retries=2)
+    calls = 0
+
+    async def make_request(bot, method):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise TelegramRetryAfter(method=method, message="flood", retry_after=0)
+        return True
+
+    assert await scheduler(make_request, None, SendMessage(chat_id=-1, text="x"))
+    assert calls == 2
+    assert scheduler.stats.retry_after == 1
+
+    # reads are not paced
+    assert await scheduler(make_request, None, GetChat(chat_id=1))
+    assert scheduler.stats.sent == 1
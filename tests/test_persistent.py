@@ -0,0 +1,60 @@
+#!/bin/env/python3
+
+import asyncio
+import json
+
+import pytest
+
+from telegram_communa_bot.bot.app_data import UsersLists
+from telegram_communa_bot.persistent import (
+    WriteBehind,
+    start_write_behind,
+    stop_write_behind,
+)
+
+
+def test_sync_save(data_path):
+    ul = UsersLists.load()
+    ul.white_list.add(1)
+    ul.save()
+
+    data = json.loads((data_path / "users_lists.json").read_text())
+    assert data["white_list"] == [1]
+    assert [p.name for p in data_path.iterdir()] == ["users_lists.json"]
+
+
+@pytest.mark.asyncio
+async def test_write_behind_coalesces(data_path):
+    ul = UsersLists.load()
+    engine = start_write_behind(interval=60, max_pending=1000)
+    assert engine
+
+    for i in range(10):
+        ul.wait_list.add(i)
+        ul.save()
+
+    await stop_write_behind()
+
+    data = json.loads((data_path / "users_lists.json").read_text())
+    assert sorted(data["wait_list"]) == list(range(10))
+    assert engine.stats.flushes == 1
+    assert engine.stats.coalesced == 9
+
+
+@pytest.mark.asyncio
+async def test_write_behind_flushes_when_full(data_path):
+    ul = UsersLists.load()
+    engine = WriteBehind(interval=60, max_pending=3)
+    engine.start()
+
+    for i in range(3):
+        ul.black_list.add(i)
+        engine.mark_dirty(ul)
+
+    for _ in range(100):
+        if engine.stats.flushes:
+            break
+        await asyncio.sleep(0.01)
+
+    assert engine.stats.flushes == 1
+    await engine.stop()
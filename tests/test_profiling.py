@@ -0,0 +1,45 @@
+#!/bin/env/python3
+
+import asyncio
+import sys
+import tracemalloc
+
+import pytest
+
+from telegram_communa_bot.profiling import profile, running
+
+kept: list[bytes] = []
+
+
+async def busy(until: float) -> None:
+    loop = asyncio.get_running_loop()
+    while loop.time() < until:
+        kept.append(bytes(1000))
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_report_covers_the_window():
+    kept.clear()
+    loop = asyncio.get_running_loop()
+    worker = asyncio.create_task(busy(loop.time() + 0.2))
+    report = await profile(0.1)
+    await worker
+
+    assert "Top functions by cumulative time" in report
+    assert "busy" in report
+    sites, growth = report.split("Top allocation sites")[1].split("Growth since the window start")
+    assert "test_profiling.py" in sites and "test_profiling.py" in growth
+    # nothing stays on after the window
+    assert not running() and not tracemalloc.is_tracing() and sys.getprofile() is None
+
+
+@pytest.mark.asyncio
+async def test_one_window_at_a_time():
+    first = asyncio.create_task(profile(0.05))
+    await asyncio.sleep(0)
+    assert running()
+    with pytest.raises(RuntimeError, match="running already"):
+        _ = await profile(0.05)
+    assert "Top allocation sites" in await first
+    assert not running()
@@ -0,0 +1,64 @@
+#!/bin/env/python3
+
+import time
+
+from telegram_communa_bot.bot.reply_index import RECORD, HEADER, ReplyIndex
+
+
+def test_lookup_survives_reopen(tmp_path):
+    path = tmp_path / "reply_index.bin"
+    index = ReplyIndex(path, capacity=16, max_age=0)
+    index.record(-100, 10, 5, 1)
+    index.record(-100, 11, 6, 2)
+    index.close()
+
+    index = ReplyIndex(path, capacity=16, max_age=0)
+    assert index.lookup(-100, 10) == (5, 1)
+    assert index.lookup(-100, 11) == (6, 2)
+    assert index.lookup(-100, 12) is None
+    assert path.stat().st_size == HEADER.size + 16 * RECORD.size
+    index.close()
+
+
+def test_old_records_are_overwritten(tmp_path):
+    index = ReplyIndex(tmp_path / "reply_index.bin", capacity=4, max_age=0)
+    index.record(-100, 1, 5, 1)
+    index.record(-100, 5, 6, 2)
+
+    assert index.lookup(-100, 1) is None
+    assert index.lookup(-100, 5) == (6, 2)
+    index.close()
+
+
+def test_expired_records_are_ignored(tmp_path, monkeypatch):
+    index = ReplyIndex(tmp_path / "reply_index.bin", capacity=4, max_age=60)
+    index.record(-100, 1, 5, 1)
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    assert index.lookup(-100, 1) is None
+    index.close()
+
+
+def test_lobbies_share_the_index(tmp_path):
+    index = ReplyIndex(tmp_path / "reply_index.bin", capacity=64, max_age=0)
+    index.record(-100, 5, 5, 1)
+    index.record(-200, 9, 6, 2)
+    index.record(-200, 5, 7, 3)
+
+    assert index.lookup(-100, 5) == (5, 1)
+    assert index.lookup(-200, 9) == (6, 2)
+    assert index.lookup(-200, 5) == (7, 3)
+    assert index.lookup(-100, 9) is None
+    index.close()
+
+
+def test_capacity_change_starts_over(tmp_path):
+    path = tmp_path / "reply_index.bin"
+    index = ReplyIndex(path, capacity=4, max_age=0)
+    index.record(-100, 1, 5, 1)
+    index.close()
+
+    index = ReplyIndex(path, capacity=8, max_age=0)
+    assert index.lookup(-100, 1) is None
+    index.close()
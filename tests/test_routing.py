@@ -0,0 +1,104 @@
+#!/bin/env/python3
+
+from datetime import datetime
+
+import pytest
+from aiogram import Bot, Dispatcher, Router
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import Chat, Message, Update
+
+from telegram_communa_bot.bot.routing import (
+    ADMIN,
+    GROUP,
+    LOBBY,
+    PRIVATE,
+    ChatKindFilter,
+    ChatKindMiddleware,
+    ChatKinds,
+)
+
+
+def message(chat_id: int, chat_type: str, text: str = "hi") -> Message:
+    return Message(
+        message_id=1,
+        date=datetime.now(),
+        chat=Chat(id=chat_id, type=chat_type),
+        text=text,
+    )
+
+
+def named_router(name: str, *kinds: str, catch_all: bool = True) -> Router:
+    router = Router(name=name)
+    if kinds:
+        _ = router.message.filter(ChatKindFilter(*kinds))
+
+    if catch_all:
+
+        @router.message()
+        async def handle(_: Message) -> str:
+            return name
+
+    else:
+
+        @router.message(lambda m: m.text == name)
+        async def handle_named(_: Message) -> str:
+            return name
+
+    return router
+
+
+@pytest.fixture
+def ids():
+    return {"lobby": -100, "admin": 1}
+
+
+@pytest.fixture
+def kinds(ids):
+    return ChatKinds(lambda: ids["lobby"], lambda: ids["admin"])
+
+
+@pytest.fixture
+def dispatch(kinds):
+    dp = Dispatcher()
+    _ = dp.update.outer_middleware(ChatKindMiddleware(kinds))
+    _ = dp.include_routers(
+        named_router("admin", ADMIN, catch_all=False),
+        named_router("lobby", LOBBY, catch_all=False),
+        named_router("private", ADMIN, PRIVATE),
+        named_router("public", LOBBY, GROUP),
+        named_router("default"),
+    )
+    return dp
+
+
+async def dispatched(dispatch: Dispatcher, msg: Message):
+    update = Update(update_id=1, message=msg)
+    return await dispatch.feed_update(Bot("42:routing"), update)
+
+
+@pytest.mark.asyncio
+async def test_messages_go_to_their_chat_routers(dispatch):
+    assert await dispatched(dispatch, message(1, "private", "admin")) == "admin"
+    # admin chat falls through to the private router
+    assert await dispatched(dispatch, message(1, "private")) == "private"
+    assert await dispatched(dispatch, message(-100, "supergroup", "lobby")) == "lobby"
+    assert await dispatched(dispatch, message(-100, "supergroup")) == "public"
+    assert await dispatched(dispatch, message(5, "private", "admin")) == "private"
+    assert await dispatched(dispatch, message(-200, "group", "lobby")) == "public"
+    assert await dispatched(dispatch, message(-300, "channel")) == "default"
+
+
+@pytest.mark.asyncio
+async def test_table_follows_lobby_change(kinds, ids):
+    assert kinds.classify(Chat(id=-200, type="supergroup")) == GROUP
+
+    ids["lobby"] = -200
+    assert kinds.classify(Chat(id=-200, type="supergroup")) == LOBBY
+    assert kinds.classify(Chat(id=-100, type="supergroup")) == GROUP
+
+
+@pytest.mark.asyncio
+async def test_kind_routers_need_the_middleware():
+    dp = Dispatcher()
+    _ = dp.include_router(named_router("private", PRIVATE))
+    assert await dispatched(dp, message(5, "private")) is UNHANDLED
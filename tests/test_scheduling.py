@@ -0,0 +1,118 @@
+#!/bin/env/python3
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.types import Chat, User
+
+from telegram_communa_bot.bot import app_data as app_data_module
+from telegram_communa_bot.bot import globals as globals_module
+from telegram_communa_bot.bot.app_data import app_data
+from telegram_communa_bot.bot.scheduling import UpdateScheduler
+
+LOBBY = -100
+
+
+@pytest.fixture
+def lobby(data_path, monkeypatch):
+    monkeypatch.setattr(app_data_module, "__persistent", None)
+    monkeypatch.setattr(globals_module, "_global_data", SimpleNamespace(admin_id=1), raising=False)
+    app_data().set_field("chat_id", LOBBY)
+
+
+def event(chat_id: int | None, user_id: int = 7) -> dict[str, object]:
+    chat = Chat(id=chat_id, type="private" if chat_id > 0 else "supergroup") if chat_id else None
+    return {"event_chat": chat, "event_from_user": User(id=user_id, is_bot=False, first_name="u")}
+
+
+@pytest.mark.asyncio
+async def test_updates_of_a_chat_run_in_order(lobby):
+    scheduler = UpdateScheduler(concurrency=10, max_pending=100)
+    log: list[str] = []
+
+    def handler(name: str, delay: float):
+        async def handle(event, data):
+            log.append(f"{name}>")
+            await asyncio.sleep(delay)
+            log.append(f"<{name}")
+
+        return handle
+
+    _ = await asyncio.gather(
+        scheduler(handler("a1", 0.02), None, event(5)),
+        scheduler(handler("a2", 0), None, event(5)),
+        scheduler(handler("b1", 0.01), None, event(6)),
+    )
+    # a2 waits for a1, b1 runs alongside
+    assert log == ["a1>", "b1>", "<b1", "<a1", "a2>", "<a2"]
+    assert (scheduler.stats.handled, scheduler.stats.ordered) == (3, 1)
+    assert scheduler._chats == {} and scheduler.running == 0
+
+
+@pytest.mark.asyncio
+async def test_lobby_goes_ahead_of_private_chats(lobby):
+    scheduler = UpdateScheduler(concurrency=1, max_pending=100)
+    release = asyncio.Event()
+    order: list[int] = []
+
+    async def handler(event, data):
+        order.append(data["event_chat"].id)
+        if len(order) == 1:
+            _ = await release.wait()
+
+    tasks = [asyncio.create_task(scheduler(handler, None, event(i))) for i in (10, 11, 12)]
+    tasks.append(asyncio.create_task(scheduler(handler, None, event(LOBBY))))
+    tasks.append(asyncio.create_task(scheduler(handler, None, event(1))))
+    await asyncio.sleep(0.01)
+    assert (scheduler.running, scheduler.depth) == (1, 4)
+
+    release.set()
+    _ = await asyncio.gather(*tasks)
+    assert order == [10, LOBBY, 1, 11, 12]
+    assert scheduler.stats.queued == 4
+
+
+@pytest.mark.asyncio
+async def test_cancelled_updates_free_their_turn(lobby):
+    scheduler = UpdateScheduler(concurrency=1, max_pending=100)
+    release = asyncio.Event()
+    seen: list[int] = []
+
+    async def handler(event, data):
+        seen.append(data["event_from_user"].id)
+        if len(seen) == 1:
+            _ = await release.wait()
+
+    first = asyncio.create_task(scheduler(handler, None, event(5, user_id=1)))
+    cancelled = asyncio.create_task(scheduler(handler, None, event(5, user_id=2)))
+    other = asyncio.create_task(scheduler(handler, None, event(6, user_id=3)))
+    last = asyncio.create_task(scheduler(handler, None, event(5, user_id=4)))
+    await asyncio.sleep(0.01)
+    _ = cancelled.cancel()
+    release.set()
+    _ = await asyncio.gather(first, other, last)
+
+    assert seen == [1, 3, 4]
+    assert scheduler._chats == {} and scheduler.running == 0 and scheduler.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_room_waits_while_saturated(lobby):
+    scheduler = UpdateScheduler(concurrency=1, max_pending=2)
+    release = asyncio.Event()
+
+    async def handler(event, data):
+        _ = await release.wait()
+
+    tasks = [asyncio.create_task(scheduler(handler, None, event(None, i))) for i in (1, 2)]
+    await asyncio.sleep(0)
+    assert scheduler.saturated
+
+    room = asyncio.create_task(scheduler.room())
+    await asyncio.sleep(0.01)
+    assert not room.done()
+    release.set()
+    await asyncio.wait_for(room, 1)
+    _ = await asyncio.gather(*tasks)
+    assert scheduler.stats.paused == 1
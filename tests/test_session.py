@@ -0,0 +1,142 @@
+#!/bin/env/python3
+
+import asyncio
+from collections import Counter
+from contextlib import asynccontextmanager
+
+import pytest
+from aiogram import Bot
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramNetworkError, TelegramServerError
+from aiohttp import web
+
+from telegram_communa_bot.bot.session import CircuitBreaker, TunedSession
+from telegram_communa_bot.metrics import API_CONNECTIONS, API_FAILURES
+
+
+class Clock:
+    def __init__(self):
+        self.now: float = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_breaker_opens_and_probes():
+    clock = Clock()
+    breaker = CircuitBreaker(threshold=2, reset_after=10, clock=clock)
+
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.is_open
+    assert not breaker.allow()
+
+    clock.now = 11
+    assert breaker.allow()
+    # one probe at a time
+    assert not breaker.allow()
+    breaker.failure()
+    assert not breaker.allow()
+
+    clock.now = 22
+    assert breaker.allow()
+    breaker.success()
+    assert not breaker.is_open
+    assert breaker.allow()
+
+
+@asynccontextmanager
+async def serve_api():
+    calls: Counter[str] = Counter()
+
+    async def handle(request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        calls[method] += 1
+        if method == "getChat":
+            await asyncio.sleep(1)
+        if method == "sendMessage":
+            return web.json_response(
+                {"ok": False, "error_code": 500, "description": "down"}, status=500
+            )
+        return web.json_response(
+            {"ok": True, "result": {"id": 42, "is_bot": True, "first_name": "b"}}
+        )
+
+    app = web.Application()
+    _ = app.router.add_post("/bot{token}/{method}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]  # pyright: ignore
+
+    session = TunedSession(
+        api=TelegramAPIServer.from_base(f"http://127.0.0.1:{port}"),
+        timeout=0.2,
+        breaker=CircuitBreaker(threshold=2, reset_after=60),
+    )
+    bot = Bot("42:session", session=session)
+    try:
+        yield bot, calls
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_connections_are_reused():
+    async with serve_api() as (bot, _):
+        reused = API_CONNECTIONS.get("reused")
+
+        _ = await bot.get_me()
+        _ = await bot.get_me()
+
+        assert API_CONNECTIONS.get("reused") > reused
+
+
+@pytest.mark.asyncio
+async def test_regular_call_times_out():
+    async with serve_api() as (bot, _):
+        timeouts = API_FAILURES.get("timeout")
+
+        with pytest.raises(TelegramNetworkError):
+            _ = await bot.get_chat(chat_id=1)
+
+        assert API_FAILURES.get("timeout") == timeouts + 1
+
+
+@pytest.mark.asyncio
+async def test_failing_api_is_not_called():
+    async with serve_api() as (bot, calls):
+        rejected = API_FAILURES.get("rejected")
+
+        for _ in range(2):
+            with pytest.raises(TelegramServerError):
+                _ = await bot.send_message(chat_id=1, text="hi")
+        with pytest.raises(TelegramNetworkError):
+            _ = await bot.send_message(chat_id=1, text="hi")
+
+        assert calls["sendMessage"] == 2
+        assert API_FAILURES.get("rejected") == rejected + 1
+
+
+@pytest.mark.asyncio
+async def test_failed_probe_lets_another_one_in(monkeypatch):
+    async with serve_api() as (bot, calls):
+        breaker = bot.session.breaker
+        breaker.failure()
+        breaker.failure()
+        breaker.opened_at = -60
+
+        def broken(**kwargs):
+            raise OSError("can't read the file")
+
+        with monkeypatch.context() as patch:
+            patch.setattr(bot.session, "build_form_data", broken)
+            with pytest.raises(OSError):
+                _ = await bot.get_me()
+
+        _ = await bot.get_me()
+        assert not breaker.is_open
+        assert calls["getMe"] == 1
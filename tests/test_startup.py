@@ -0,0 +1,65 @@
+#!/bin/env/python3
+
+import json
+
+import pytest
+
+from telegram_communa_bot.bot import app_data as app_data_module
+from telegram_communa_bot.bot import globals as globals_module
+from telegram_communa_bot.bot.app_data import app_data, load_stores, users_lists
+from telegram_communa_bot.bot.globals import GlobalData
+from telegram_communa_bot.settings import reset_settings, settings
+
+
+@pytest.fixture
+def stores(data_path, monkeypatch):
+    monkeypatch.setattr(app_data_module, "__persistent", None)
+    monkeypatch.setattr(app_data_module, "__user_lists", None)
+    return data_path
+
+
+def test_settings_are_parsed_once(data_path, monkeypatch):
+    first = settings()
+    monkeypatch.setenv("BOT_WORKERS", "3")
+    assert settings() is first
+
+    reset_settings()
+    assert settings().workers == 3
+
+
+@pytest.mark.asyncio
+async def test_stores_are_loaded_together(stores):
+    _ = (stores / "persistent.json").write_text(json.dumps({"chat_id": -100}))
+    _ = (stores / "users_lists.json").write_text(json.dumps({"white_list": [1]}))
+
+    await load_stores()
+
+    assert app_data().chat_id == -100
+    assert users_lists().white_list == {1}
+
+
+@pytest.mark.asyncio
+async def test_admin_username_is_resolved_once(stores, monkeypatch):
+    monkeypatch.setenv("BOT_ADMIN", "boss")
+    resolved = {"boss": 77}
+    calls: list[str] = []
+
+    async def username_to_id(username: str) -> int | None:
+        calls.append(username)
+        return resolved.get(username)
+
+    monkeypatch.setattr(globals_module, "username_to_id", username_to_id)
+
+    await GlobalData.init(settings())
+    assert GlobalData.get().admin_id == 77
+    assert app_data().admin_username == "@boss"
+    assert calls == ["boss"]
+
+    # the next start uses the saved id and checks it in the background
+    resolved["boss"] = 78
+    await GlobalData.init(settings())
+    assert GlobalData.get().admin_id == 77
+    assert globals_module._revalidation
+    await globals_module._revalidation
+    assert GlobalData.get().admin_id == 78
+    assert app_data().admin_id == 78
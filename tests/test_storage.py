@@ -0,0 +1,52 @@
+#!/bin/env/python3
+
+import json
+import sqlite3
+
+import pytest
+
+from telegram_communa_bot.bot.app_data import AppData, UsersLists
+from telegram_communa_bot.storage import close_storages
+
+
+@pytest.fixture
+def sqlite_storage(data_path, monkeypatch):
+    monkeypatch.setenv("BOT_STORAGE", "sqlite")
+    yield data_path / "bot.sqlite3"
+    close_storages()
+
+
+def test_sqlite_membership_rows(sqlite_storage):
+    ul = UsersLists.load()
+    ul.wait(1)
+    ul.wait(2)
+    ul.save()
+    ul.allow(1)
+    ul.block(2)
+    ul.save()
+
+    db = sqlite3.connect(sqlite_storage)
+    rows = db.execute("SELECT user_id, status FROM membership ORDER BY user_id")
+    assert rows.fetchall() == [(1, "white_list"), (2, "black_list")]
+
+    ad = AppData.load()
+    ad.set_field("chat_id", -100)
+    ad.save()
+
+    close_storages()
+    assert UsersLists.load().black_list == {2}
+    assert AppData.load().chat_id == -100
+
+
+def test_sqlite_migration(data_path, sqlite_storage):
+    legacy = data_path / "users_lists.json"
+    _ = legacy.write_text(json.dumps({"white_list": [1, 2], "wait_list": [3]}))
+
+    ul = UsersLists.load()
+    assert ul.white_list == {1, 2}
+    assert ul.wait_list == {3}
+    assert not legacy.exists()
+    assert (data_path / "users_lists.json.migrated").exists()
+
+    close_storages()
+    assert UsersLists.load().white_list == {1, 2}
@@ -0,0 +1,176 @@
+#!/bin/env/python3
+
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from aiogram.types import Chat, Message, Update, User
+
+from telegram_communa_bot.bot import app_data as app_data_module
+from telegram_communa_bot import storage as storage_module
+from telegram_communa_bot.bot import forwarding
+from telegram_communa_bot.bot import reply_index as reply_index_module
+from telegram_communa_bot.bot import tenants as tenants_module
+from telegram_communa_bot.bot.app_data import app_data, users_lists
+from telegram_communa_bot.bot.forwarding import Forwarder
+from telegram_communa_bot.bot.lobby_chat import ReplyRouteFilter
+from telegram_communa_bot.bot.tenants import TenantMiddleware, Tenants
+from telegram_communa_bot.persistent import (
+    current_tenant,
+    start_write_behind,
+    stop_write_behind,
+    using_tenant,
+)
+from telegram_communa_bot.settings import reset_settings
+
+
+@pytest.fixture
+def registry(data_path, monkeypatch):
+    monkeypatch.setattr(app_data_module, "__persistent", None)
+    monkeypatch.setattr(app_data_module, "__user_lists", None)
+    registry = Tenants(data_path, max_loaded=2)
+    monkeypatch.setattr(tenants_module, "_tenants", registry)
+    return registry
+
+
+def group(chat_id: int) -> Chat:
+    return Chat(id=chat_id, type="supergroup")
+
+
+def test_stores_are_partitioned_and_lazy(registry, data_path):
+    lobby = registry.tenant("-10")
+    registry.add_lobby(-10, lobby)
+    assert registry.resolve(1, group(-10), None) is lobby
+    assert registry.resolve(1, group(-20), None) is None
+    assert not lobby.loaded and registry.loaded == 0
+
+    with using_tenant(lobby):
+        app_data().set_field("chat_id", -10)
+        app_data().save()
+        users_lists().allow(5)
+        users_lists().save()
+    assert lobby.loaded and registry.loaded == 1
+
+    saved = json.loads((data_path / "tenants" / "-10" / "users_lists.json").read_text())
+    assert saved["white_list"] == [5]
+    assert 5 not in users_lists().white_list
+    assert app_data().chat_id == 0
+    assert json.loads((data_path / "tenants.json").read_text())["lobbies"] == {"-10": "-10"}
+
+
+@pytest.mark.asyncio
+async def test_idle_tenants_are_flushed_and_evicted(registry, data_path):
+    _ = start_write_behind(interval=60, max_pending=1000)
+    a, b, c = (registry.tenant(x) for x in "abc")
+    try:
+        for user_id, tenant in enumerate((a, b, c)):
+            with using_tenant(tenant):
+                users_lists().wait(user_id)
+                users_lists().save()
+
+        with b.hold():
+            await registry.evict()
+        # `a` is the least recently used idle one, `b` is busy
+        assert (a.loaded, b.loaded, c.loaded) == (False, True, True)
+        assert registry.stats.evictions == 1
+        saved = json.loads((data_path / "tenants" / "a" / "users_lists.json").read_text())
+        assert saved["wait_list"] == [0]
+
+        registry.touch(b)
+        with using_tenant(a):
+            assert users_lists().wait_list == {0}
+        await registry.evict()
+        assert (a.loaded, b.loaded, c.loaded) == (True, True, False)
+    finally:
+        await stop_write_behind()
+
+
+@pytest.mark.asyncio
+async def test_evicted_tenants_close_their_database(registry, data_path, monkeypatch):
+    monkeypatch.setenv("BOT_STORAGE", "sqlite")
+    reset_settings()
+    monkeypatch.setattr(storage_module, "_storages", {})
+    registry.max_loaded = 1
+    a, b = registry.tenant("a"), registry.tenant("b")
+
+    with using_tenant(a):
+        users_lists().allow(1)
+        users_lists().save()
+    with using_tenant(b):
+        users_lists().allow(2)
+        users_lists().save()
+    assert {path for _, path in storage_module._storages} == {a.path, b.path}
+
+    await registry.evict()
+    assert (a.loaded, b.loaded) == (False, True)
+    assert {path for _, path in storage_module._storages} == {b.path}
+    with using_tenant(a):
+        assert users_lists().white_list == {1}
+
+
+@pytest.mark.asyncio
+async def test_middleware_routes_updates(registry):
+    lobby = registry.tenant("-10")
+    registry.add_lobby(-10, lobby)
+    own = registry.add_bot("own", SimpleNamespace(id=99))
+    seen: list[object] = []
+
+    async def handler(event, data):
+        seen.append(current_tenant())
+
+    user = User(id=7, is_bot=False, first_name="u")
+
+    async def feed(chat: Chat, text: str, bot_id: int = 42):
+        message = Message(
+            message_id=1, date=datetime.now(), chat=chat, from_user=user, text=text
+        )
+        data = {"bot": SimpleNamespace(id=bot_id), "event_chat": chat, "event_from_user": user}
+        await TenantMiddleware()(handler, Update(update_id=1, message=message), data)
+
+    private = Chat(id=7, type="private")
+    await feed(private, "hi")
+    await feed(private, "/start -10")
+    await feed(private, "hi")
+    await feed(group(-10), "hi")
+    await feed(group(-20), "hi")
+    await feed(group(-20), "hi", bot_id=99)
+
+    assert seen == [None, lobby, lobby, lobby, None, own]
+    assert registry.index.users == {7: "-10"}
+
+
+@pytest.mark.asyncio
+async def test_replies_are_routed_in_each_lobby(registry, monkeypatch):
+    async def forward_message(chat_id, from_chat_id, message_id):
+        # both lobbies number their messages alike
+        return SimpleNamespace(message_id=1000 + message_id)
+
+    bot = SimpleNamespace(forward_message=forward_message)
+    monkeypatch.setattr(forwarding.GlobalBot, "get", staticmethod(lambda: bot))
+    monkeypatch.setattr(reply_index_module, "_reply_index", None)
+    fw = Forwarder(album_window=0, burst_window=0, max_batch=1)
+
+    lobbies = {-10: 5, -20: 6}
+    for chat_id, user_id in lobbies.items():
+        with using_tenant(registry.tenant(str(chat_id))):
+            app_data().set_field("chat_id", chat_id)
+            await fw.add(
+                SimpleNamespace(chat=SimpleNamespace(id=user_id), message_id=1, media_group_id=None)
+            )
+
+    user = User(id=1, is_bot=False, first_name="moderator")
+    try:
+        for chat_id, user_id in lobbies.items():
+            forwarded = Message(message_id=1001, date=datetime.now(), chat=group(chat_id))
+            reply = Message(
+                message_id=1002,
+                date=datetime.now(),
+                chat=group(chat_id),
+                from_user=user,
+                text="hi",
+                reply_to_message=forwarded,
+            )
+            assert await ReplyRouteFilter()(reply) == {"user_id": user_id}
+    finally:
+        reply_index_module.close_reply_index()
@@ -0,0 +1,69 @@
+#!/bin/env/python3
+
+import asyncio
+
+import pytest
+from aiogram.types import User
+
+from telegram_communa_bot.bot.user_cache import UserCache
+
+
+def make_user(user_id: int) -> User:
+    return User(id=user_id, is_bot=False, first_name=f"user{user_id}")
+
+
+@pytest.mark.asyncio
+async def test_single_flight_and_negative_cache():
+    calls: list[int] = []
+
+    async def fetch(user_id: int) -> User | None:
+        calls.append(user_id)
+        await asyncio.sleep(0.01)
+        return make_user(user_id) if user_id > 0 else None
+
+    cache = UserCache(ttl=60, negative_ttl=60, max_size=10, concurrency=2)
+
+    users = await asyncio.gather(*(cache.get(1, fetch) for _ in range(5)))
+    assert all(u and u.id == 1 for u in users)
+    assert calls == [1]
+    assert cache.stats.coalesced == 4
+
+    assert await cache.get(-1, fetch) is None
+    assert await cache.get(-1, fetch) is None
+    assert calls == [1, -1]
+    assert cache.stats.negative_hits == 1
+
+
+@pytest.mark.asyncio
+async def test_errors_are_not_cached():
+    calls: list[int] = []
+
+    async def fetch(user_id: int) -> User | None:
+        calls.append(user_id)
+        if len(calls) == 1:
+            raise ConnectionError("api is down")
+        return make_user(user_id)
+
+    cache = UserCache(ttl=60, negative_ttl=60, max_size=10, concurrency=2)
+    with pytest.raises(ConnectionError):
+        _ = await cache.get(1, fetch)
+    assert len(cache) == 0
+
+    user = await cache.get(1, fetch)
+    assert user and user.id == 1
+    assert calls == [1, 1]
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction_and_put():
+    async def fetch(user_id: int) -> User | None:
+        raise AssertionError("must be served from cache")
+
+    cache = UserCache(ttl=60, negative_ttl=60, max_size=2, concurrency=1)
+    for i in range(3):
+        cache.put(make_user(i))
+
+    assert len(cache) == 2
+    assert cache.stats.evictions == 1
+    assert (await cache.get(2, fetch)).id == 2
+    assert cache.stats.hits == 1
@@ -0,0 +1,68 @@
+#!/bin/env/python3
+
+import asyncio
+
+import pytest
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message
+from aiohttp.test_utils import TestClient, TestServer
+
+from telegram_communa_bot.bot.webhook import SECRET_HEADER, WebhookServer
+from telegram_communa_bot.settings import settings
+
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 10,
+        "date": 1700000000,
+        "chat": {"id": 42, "type": "private", "first_name": "User"},
+        "from": {"id": 42, "is_bot": False, "first_name": "User"},
+        "text": "hello",
+    },
+}
+
+
+@pytest.mark.asyncio
+async def test_webhook_accepts_recorded_update(data_path):
+    dp = Dispatcher()
+    seen: list[str] = []
+    release = asyncio.Event()
+
+    @dp.message()
+    async def handler(message: Message):
+        _ = await release.wait()
+        seen.append(message.text or "")
+
+    bot = Bot("1234567890:ABCdefGHIjklMNOpqrsTUVwxyz")
+    server = WebhookServer(dp, bot, secret="s3cret", max_inflight=1)
+
+    async with TestClient(TestServer(server.app("/webhook"))) as client:
+        response = await client.get("/readyz")
+        assert response.status == 503
+
+        response = await client.post("/webhook", json=UPDATE)
+        assert response.status == 401
+
+        headers = {SECRET_HEADER: "s3cret"}
+        response = await client.post("/webhook", json=UPDATE, headers=headers)
+        assert response.status == 200
+
+        # the first update is still being handled
+        response = await client.post("/webhook", json=UPDATE, headers=headers)
+        assert response.status == 429
+
+        release.set()
+        await server.drain(timeout=1)
+        assert seen == ["hello"]
+
+    await bot.session.close()
+
+
+def test_webhook_mode_needs_a_secret(data_path, monkeypatch):
+    monkeypatch.setenv("BOT_MODE", "webhook")
+    monkeypatch.delenv("BOT_WEBHOOK_SECRET", raising=False)
+    with pytest.raises(SystemExit):
+        _ = settings()
+
+    monkeypatch.setenv("BOT_WEBHOOK_SECRET", "s3cret")
+    assert settings().webhook_secret == "s3cret"
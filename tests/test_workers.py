@@ -0,0 +1,137 @@
+#!/bin/env/python3
+
+import asyncio
+import socket
+
+import pytest
+
+from telegram_communa_bot.bot.app_data import AppData, UsersLists
+from telegram_communa_bot.bot.workers import (
+    WorkerPool,
+    _Worker,
+    apply_changes,
+    read_frame,
+    settle,
+    shard_key,
+    write_frame,
+)
+from telegram_communa_bot.settings import reset_settings, settings
+from telegram_communa_bot.storage import IpcStorage, close_storages, storage
+
+
+@pytest.fixture
+def ipc_storage(data_path, monkeypatch):
+    monkeypatch.setenv("BOT_STORAGE", "ipc")
+    backend = storage()
+    assert isinstance(backend, IpcStorage)
+    sent: list[tuple] = []
+    backend.send = sent.append
+    yield backend, sent
+    close_storages()
+
+
+def test_shard_key():
+    lobby = {"id": -100, "type": "supergroup"}
+    user = {"id": 5, "is_bot": False, "first_name": "u"}
+
+    assert shard_key({"update_id": 1, "message": {"chat": lobby, "from": user}}) == -100
+    callback = {"id": "1", "from": user, "message": {"chat": lobby}}
+    assert shard_key({"update_id": 2, "callback_query": callback}) == -100
+    assert shard_key({"update_id": 3, "inline_query": {"from": user}}) == 5
+
+
+def test_join_digest_needs_one_worker(data_path, monkeypatch):
+    monkeypatch.setenv("BOT_WORKERS", "2")
+    assert settings().join_digest_window == 0
+
+    monkeypatch.setenv("BOT_JOIN_DIGEST_WINDOW", "5")
+    reset_settings()
+    with pytest.raises(SystemExit):
+        _ = settings()
+
+
+def test_replica_sends_ops(ipc_storage):
+    backend, sent = ipc_storage
+    backend.snapshots = {"UsersLists": {"white_list": [1]}}
+
+    ul = UsersLists.load()
+    assert ul.white_list == {1}
+    ul.block(1)
+    ul.save()
+
+    assert sent == [
+        ("ops", "UsersLists", [("discard", "white_list", 1), ("add", "black_list", 1)])
+    ]
+
+
+def test_settled_ops_converge_replicas(data_path):
+    owner, replica = UsersLists(), UsersLists(white_list={7})
+
+    ops: list = [("add", "wait_list", 7), ("discard", "white_list", 7)]
+    apply_changes(owner, ops)
+    # a later change of the same user, sent before the replica saw the first
+    ops += [("add", "white_list", 7), ("discard", "wait_list", 7)]
+    apply_changes(owner, ops[2:])
+
+    replica.apply_ops(settle(owner, ops))
+    assert replica.white_list == {7}
+    assert replica.wait_list == set()
+
+    ad = AppData()
+    apply_changes(ad, [("set", "chat_id", -1), ("set", "chat_id", -2)])
+    assert settle(ad, [("set", "chat_id", -1)]) == [("set", "chat_id", -2)]
+
+
+@pytest.mark.asyncio
+async def test_frames_roundtrip():
+    ours, theirs = socket.socketpair()
+    _, writer = await asyncio.open_connection(sock=ours)
+    reader, other = await asyncio.open_connection(sock=theirs)
+
+    write_frame(writer, ("update", {"update_id": 1}))
+    write_frame(writer, ("stop",))
+    await writer.drain()
+
+    assert await read_frame(reader) == ("update", {"update_id": 1})
+    assert await read_frame(reader) == ("stop",)
+    writer.close()
+    other.close()
+
+
+@pytest.mark.asyncio
+async def test_updates_of_a_dead_worker_are_kept():
+    pool = WorkerPool(1, {})
+
+    async def connect():
+        ours, theirs = socket.socketpair()
+        _, writer = await asyncio.open_connection(sock=ours)
+        reader, other = await asyncio.open_connection(sock=theirs)
+        return _Worker(0, None, reader, writer), reader, other
+
+    def update(update_id: int) -> dict:
+        return {"update_id": update_id, "message": {"chat": {"id": 5}}}
+
+    worker, _, _ = await connect()
+    pool._workers = [worker]
+    for update_id in (1, 2):
+        await pool.dispatch(update(update_id))
+    pool._handle(worker, ("done", 1))
+
+    # dies with 2 unfinished, 3 comes meanwhile
+    worker.writer.close()
+    await pool.dispatch(update(3))
+    pool._lost(worker)
+    assert pool.unconfirmed() == 2
+
+    restarted, received, other = await connect()
+    pool._redeliver(restarted)
+    pool._workers = [restarted]
+    await pool.dispatch(update(4))
+    await restarted.writer.drain()
+
+    frames = [await read_frame(received) for _ in range(3)]
+    assert [x[1]["update_id"] for x in frames] == [2, 3, 4]
+    assert pool.unconfirmed() is None
+    assert (pool.stats.redelivered, pool.stats.dropped) == (2, 0)
+    restarted.writer.close()
+    other.close()